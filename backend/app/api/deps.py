@@ -0,0 +1,114 @@
+"""Lazily loaded services and their readiness
+
+The service modules import torch, transformers, sentence-transformers, minio
+or qdrant_client and connect or load models when instantiated, so routers
+only reach them through the dependencies below. The first call imports the
+module and builds the process-wide instance; concurrent callers wait for
+that load instead of starting their own. warm_up() loads them ahead of the
+first request, staged in WARMUP_COMPONENTS order, and readiness() reports
+how far it got.
+"""
+from typing import Any, Callable, Dict, List
+import threading
+import time
+from ..core.config import settings
+
+_getters: Dict[str, Callable[[], Any]] = {}
+_instances: Dict[str, Any] = {}
+_status: Dict[str, Dict[str, Any]] = {}
+_locks: Dict[str, threading.Lock] = {}
+
+def _lazy(name: str):
+    """Register a factory as a lazily loaded component"""
+    def decorator(factory):
+        _status[name] = {"status": "cold"}
+        _locks[name] = threading.Lock()
+
+        def getter():
+            if name in _instances:
+                return _instances[name]
+            with _locks[name]:
+                if name not in _instances:
+                    _status[name] = {"status": "loading", "started_at": time.time()}
+                    started = time.perf_counter()
+                    try:
+                        instance = factory()
+                    except Exception as e:
+                        _status[name] = {"status": "failed", "error": str(e)}
+                        raise
+                    _status[name] = {"status": "ready", "load_seconds": round(time.perf_counter() - started, 3)}
+                    # Per-model timings of services that load several models
+                    if getattr(instance, "warm_up_seconds", None):
+                        _status[name]["models"] = instance.warm_up_seconds
+                    _instances[name] = instance
+            return _instances[name]
+
+        getter.__name__ = factory.__name__
+        getter.__doc__ = factory.__doc__
+        _getters[name] = getter
+        return getter
+    return decorator
+
+@_lazy("document_storage")
+def get_document_storage():
+    """Process-wide DocumentStorage"""
+    from ..services.document_storage import get_document_storage
+    return get_document_storage()
+
+@_lazy("vector_storage")
+def get_vector_storage():
+    """Process-wide VectorStorage"""
+    from ..services.vector_storage import get_vector_storage
+    return get_vector_storage()
+
+@_lazy("ai_service")
+def get_ai_service():
+    """Process-wide AIService with every model run once"""
+    from ..services.ai_service import get_ai_service
+    ai_service = get_ai_service()
+    ai_service.warm_up()
+    return ai_service
+
+@_lazy("batch_scheduler")
+def get_batch_scheduler():
+    """Process-wide BatchScheduler"""
+    from ..services.batch_scheduler import get_batch_scheduler
+    return get_batch_scheduler()
+
+@_lazy("training_service")
+def get_training_service():
+    """Process-wide TrainingService"""
+    from ..services.training_service import get_training_service
+    return get_training_service()
+
+def get_model_store():
+    """The model store, without loading any model"""
+    from ..services.model_store import ModelStore
+    return ModelStore()
+
+def warm_up(components: List[str] = None):
+    """Load components one after another; failures are recorded, not raised"""
+    for name in components or settings.WARMUP_COMPONENTS:
+        try:
+            _getters[name]()
+        except Exception:
+            pass
+
+def start_warm_up() -> threading.Thread:
+    """warm_up() on a background thread"""
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def shutdown():
+    """Persist what loaded components hold in memory, in the process that serves requests"""
+    vector_storage = _instances.get("vector_storage")
+    if vector_storage is not None:
+        vector_storage.backend.snapshot()
+
+def readiness() -> Dict[str, Any]:
+    """Whether every WARMUP_COMPONENTS entry is loaded, and the state of each component"""
+    return {
+        "ready": all(name in _instances for name in settings.WARMUP_COMPONENTS),
+        "components": {name: dict(status) for name, status in _status.items()}
+    }
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.responses import FileResponse
+from typing import Optional
+import os
+from ...core.config import settings
+from ...core.profiling import ARTIFACTS, PROFILE_ID, is_admin, list_profiles
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Only allow requests carrying the configured admin token"""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/profiles")
+async def get_profiles():
+    """List captured request profiles, newest first"""
+    return list_profiles()
+
+@router.get("/profiles/{profile_id}/{artifact}")
+async def download_profile_artifact(profile_id: str, artifact: str):
+    """Download one artifact of a captured profile"""
+    # Only names the profiler writes, never paths outside the profile directory
+    if not PROFILE_ID.fullmatch(profile_id) or artifact not in ARTIFACTS:
+        raise HTTPException(status_code=400, detail="Invalid profile or artifact name")
+
+    path = os.path.join(settings.PROFILE_DIR, profile_id, artifact)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=f"{profile_id}-{artifact}")
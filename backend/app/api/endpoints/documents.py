@@ -1,18 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
+from ...core.config import settings
+from ...core.metrics import track
 from ...db.session import get_db
-from ...db.models import Document, DocumentStatus, AnalysisResult
-from ...services.document_storage import DocumentStorage
-from ...services.vector_storage import VectorStorage
-from ...services.ai_service import AIService
+from ...db.models import Document, DocumentStatus, AnalysisResult, BatchJob, Feedback, TrainingExample
+from ...services.docx_processing import InvalidDocument, extract_paragraphs
+from ...services.document_state import TransitionConflict, transition, release_claim, claim_key, complete_key, release_key
+from ...services.fingerprinting import store_fingerprint, find_near_duplicate, split_reusable, paragraph_of
+from ..deps import get_document_storage, get_vector_storage, get_ai_service, get_batch_scheduler
+from ..pagination import project, keyset_page, cached_json
+from ...core.resources import ResourceLimitExceeded, check_memory, limit_exceeded, read_limited
 from pydantic import BaseModel
+import asyncio
 import uuid
+import zipfile
+import zlib
 
 router = APIRouter()
-document_storage = DocumentStorage()
-vector_storage = VectorStorage()
-ai_service = AIService()
 
 class DocumentResponse(BaseModel):
     id: str
@@ -26,17 +33,76 @@ class AnalysisResponse(BaseModel):
     clauses: List[dict]
     status: DocumentStatus
 
+class BatchResponse(BaseModel):
+    batch_id: str
+    document_ids: List[str]
+
+class BatchProgressResponse(BaseModel):
+    batch_id: str
+    total: int
+    completed: int
+    failed: int
+    pending: int
+    documents_per_minute: Optional[float]
+    finished: bool
+
+# Fields the read endpoints can project, and the keys their pages are ordered by
+DOCUMENT_FIELDS = {
+    name: getattr(Document, name)
+    for name in ["id", "status", "original_path", "redline_path", "clean_path", "batch_id", "version", "created_at", "updated_at"]
+}
+DOCUMENT_KEYS = [(Document.created_at, True), (Document.id, True)]  # Newest first
+RESULT_FIELDS = {
+    name: getattr(AnalysisResult, name)
+    for name in [
+        "id", "document_id", "clause_text", "original_text", "suggested_text", "label",
+        "confidence_score", "validation_score", "created_at"
+    ]
+}
+RESULT_KEYS = [(AnalysisResult.id, False)]  # Document order
+
+@router.get("")
+async def list_documents(
+    request: Request,
+    status: Optional[DocumentStatus] = None,
+    batch_id: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    """List the user's documents, newest first
+    
+    Pass the returned next_cursor as cursor to get the next page, and a
+    comma separated list of fields to only get those columns. Responses
+    carry an ETag; send it back in If-None-Match to get 304 when the page
+    did not change.
+    """
+    query = db.query(*project(fields, DOCUMENT_FIELDS, DOCUMENT_KEYS)).filter(
+        Document.user_id == 1  # TODO: Get actual user_id
+    )
+    if status is not None:
+        query = query.filter(Document.status == status)
+    if batch_id is not None:
+        query = query.filter(Document.batch_id == batch_id)
+    return cached_json(request, keyset_page(query, DOCUMENT_KEYS, cursor, limit))
+
 @router.post("/upload", response_model=DocumentResponse)
 async def upload_document(
     file: UploadFile = File(...),
+    document_storage=Depends(get_document_storage),
     db: Session = Depends(get_db)
 ):
     """Upload a new NDA document for analysis"""
     if not file.filename.endswith('.docx'):
         raise HTTPException(status_code=400, detail="Only .docx files are allowed")
+    check_memory()
+    content = read_limited(file.file, file.filename)
+    # Parsed before storing so oversized or corrupt documents are rejected up front
+    paragraphs = _parse(file.filename, content)
     
     # Save the document
-    document_id, file_path = await document_storage.save_original_document(file, "user_1")  # TODO: Get actual user_id
+    document_id, file_path = document_storage.save_original_content(content, "user_1")  # TODO: Get actual user_id
     
     # Create document record
     document = Document(
@@ -46,11 +112,141 @@ async def upload_document(
         status=DocumentStatus.UPLOADED
     )
     db.add(document)
+    
+    # Fingerprint for near-duplicate detection at analysis time
+    store_fingerprint(db, document_id, paragraphs)
+    
     db.commit()
     db.refresh(document)
     
     return document
 
+def _parse(name: str, content: bytes) -> List[str]:
+    """Paragraphs of an uploaded DOCX, 400 if it cannot be opened"""
+    try:
+        return extract_paragraphs(content)
+    except InvalidDocument as e:
+        raise HTTPException(status_code=400, detail=f"{name}: {e}")
+
+def _read_upload(file: UploadFile) -> bytes:
+    """Read an uploaded file from the start, so it can be read more than once"""
+    file.file.seek(0)
+    return read_limited(file.file, file.filename)
+
+def _read_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    """Read a DOCX out of an uploaded zip archive, 400 if the member is corrupt"""
+    try:
+        return archive.read(info)
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError) as e:
+        raise HTTPException(status_code=400, detail=f"{info.filename}: {e}")
+
+def _batch_entries(files: List[UploadFile]):
+    """Name and content reader of every DOCX in the uploads, unpacking zip archives"""
+    entries, total_size = [], 0
+    for file in files:
+        if file.filename.endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(file.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid zip archive")
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.endswith(".docx") or info.filename.startswith("__MACOSX/"):
+                    continue
+                if info.file_size > settings.MAX_FILE_SIZE:
+                    raise limit_exceeded("file_size", f"{info.filename} exceeds the maximum file size")
+                # Declared sizes are enforced by zipfile when the entry is read
+                total_size += info.file_size
+                entries.append((info.filename, lambda archive=archive, info=info: _read_member(archive, info)))
+        elif file.filename.endswith(".docx"):
+            file.file.seek(0, 2)
+            total_size += file.file.tell()
+            file.file.seek(0)
+            entries.append((file.filename, lambda file=file: _read_upload(file)))
+        else:
+            raise HTTPException(status_code=400, detail="Only .docx files and zip archives of them are allowed")
+        if total_size > settings.BATCH_MAX_SIZE:
+            raise limit_exceeded("batch_size", f"Batch documents exceed {settings.BATCH_MAX_SIZE} bytes in total")
+    return entries
+
+def _store_batch(entries, batch: BatchJob, document_storage, db: Session) -> List[Document]:
+    """Read, parse and store the documents of a batch, committing them with the batch
+    
+    Documents are read once each and stored as soon as they parse, so only
+    one is held in memory; if any of them is bad, the ones stored before it
+    are deleted again and the batch leaves nothing behind.
+    """
+    documents = []
+    try:
+        for name, read in entries:
+            content = read()
+            paragraphs = _parse(name, content)
+            document_id, file_path = document_storage.save_original_content(content, "user_1")  # TODO: Get actual user_id
+            documents.append(Document(
+                id=document_id,
+                user_id=1,  # TODO: Get actual user_id
+                original_path=file_path,
+                status=DocumentStatus.UPLOADED,
+                batch_id=batch.id
+            ))
+            store_fingerprint(db, document_id, paragraphs)
+        db.add_all(documents)
+        db.commit()
+    except Exception:
+        db.rollback()
+        for document in documents:
+            try:
+                document_storage.delete_document(document.original_path)
+            except Exception:
+                pass  # Logged by the storage; the error that failed the batch matters more
+        raise
+    return documents
+
+@router.post("/batch", response_model=BatchResponse)
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    document_storage=Depends(get_document_storage),
+    batch_scheduler=Depends(get_batch_scheduler),
+    db: Session = Depends(get_db)
+):
+    """Upload many NDAs, as files or zip archives, and queue them for analysis"""
+    check_memory()
+    entries = _batch_entries(files)
+    if not entries:
+        raise HTTPException(status_code=400, detail="No .docx files found")
+    if len(entries) > settings.BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BATCH_MAX_DOCUMENTS} documents per batch")
+    
+    batch = BatchJob(id=str(uuid.uuid4()), total=len(entries), completed=0, failed=0)
+    db.add(batch)
+    # Unpacking, parsing and storing block, so they run off the event loop
+    documents = await asyncio.to_thread(_store_batch, entries, batch, document_storage, db)
+    
+    batch_scheduler.submit([document.id for document in documents])
+    
+    return {"batch_id": batch.id, "document_ids": [document.id for document in documents]}
+
+@router.get("/batches/{batch_id}", response_model=BatchProgressResponse)
+async def get_batch_progress(
+    batch_id: str,
+    db: Session = Depends(get_db)
+):
+    """Get the aggregate analysis progress and throughput of a batch"""
+    batch = db.query(BatchJob).filter(BatchJob.id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    processed = batch.completed + batch.failed
+    minutes = ((batch.finished_at or datetime.utcnow()) - batch.created_at).total_seconds() / 60
+    return {
+        "batch_id": batch.id,
+        "total": batch.total,
+        "completed": batch.completed,
+        "failed": batch.failed,
+        "pending": batch.total - processed,
+        "documents_per_minute": processed / minutes if processed and minutes > 0 else None,
+        "finished": batch.finished_at is not None
+    }
+
 @router.get("/{document_id}", response_model=DocumentResponse)
 async def get_document(
     document_id: str,
@@ -62,26 +258,92 @@ async def get_document(
         raise HTTPException(status_code=404, detail="Document not found")
     return document
 
+@router.get("/{document_id}/results")
+async def list_analysis_results(
+    request: Request,
+    document_id: str,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    """Page through the stored analysis results of a document without running the models
+    
+    Paging, fields and ETags work as for the document list.
+    """
+    if not db.query(Document.id).filter(Document.id == document_id).first():
+        raise HTTPException(status_code=404, detail="Document not found")
+    query = db.query(*project(fields, RESULT_FIELDS, RESULT_KEYS)).filter(
+        AnalysisResult.document_id == document_id
+    )
+    return cached_json(request, keyset_page(query, RESULT_KEYS, cursor, limit))
+
 @router.post("/{document_id}/analyze", response_model=AnalysisResponse)
 async def analyze_document(
     document_id: str,
+    document_storage=Depends(get_document_storage),
+    vector_storage=Depends(get_vector_storage),
+    ai_service=Depends(get_ai_service),
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    """Analyze the document and generate suggestions"""
+    """Analyze the document and generate suggestions
+    
+    Only one analysis of a document runs at a time; a concurrent request
+    gets 409. Retries sending the same Idempotency-Key get the first
+    request's response instead of a new analysis.
+    """
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Update status
-    document.status = DocumentStatus.ANALYZING
-    db.commit()
+    check_memory()
+    stored = claim_key(db, idempotency_key, "analyze", document_id)
+    if stored is not None:
+        return stored
+    
+    # Claim the document for this analysis
+    previous_status = document.status
+    try:
+        transition(db, document, DocumentStatus.ANALYZING)
+        db.commit()
+    except Exception:
+        db.rollback()
+        release_key(db, idempotency_key, "analyze", document_id)
+        db.commit()
+        raise
+    claimed_version = document.version
     
     try:
         # Get document content
         content = document_storage.get_document(document.original_path)
         
+        paragraphs = extract_paragraphs(content)
+        
+        # A near-duplicate of an analyzed NDA only needs its changed paragraphs analyzed
+        duplicate = find_near_duplicate(db, document_id) if settings.NEAR_DUPLICATE_DETECTION else None
+        if duplicate is not None:
+            reused_results, changed_paragraphs = split_reusable(db, paragraphs, duplicate[0])
+        else:
+            reused_results, changed_paragraphs = [], paragraphs
+        
         # Analyze document
-        analysis_results = await ai_service.analyze_document(content)
+        analysis_results = await ai_service.analyze_document("\n".join(changed_paragraphs)) if changed_paragraphs else []
+        for result in analysis_results:
+            result["paragraph_hash"] = paragraph_of(result["clause_text"], paragraphs)
+        analysis_results = reused_results + analysis_results
+        
+        # Replace a previous analysis; feedback on its clauses becomes document-level
+        previous_results = db.query(AnalysisResult.id, AnalysisResult.original_text).filter(
+            AnalysisResult.document_id == document_id
+        ).all()
+        if previous_results:
+            previous_ids = [result.id for result in previous_results]
+            for model in (Feedback, TrainingExample):
+                db.query(model).filter(model.analysis_result_id.in_(previous_ids)).update(
+                    {model.analysis_result_id: None}, synchronize_session=False
+                )
+            db.query(AnalysisResult).filter(AnalysisResult.id.in_(previous_ids)).delete(synchronize_session=False)
         
         # Store analysis results
         for result in analysis_results:
@@ -90,7 +352,9 @@ async def analyze_document(
                 clause_text=result["clause_text"],
                 original_text=result["original_text"],
                 suggested_text=result["suggested_text"],
-                confidence_score=result["confidence_score"]
+                label=result["label"],
+                confidence_score=result["confidence_score"],
+                paragraph_hash=result["paragraph_hash"]
             )
             db.add(analysis)
         
@@ -100,23 +364,42 @@ async def analyze_document(
         
         # Update document
         document.redline_path = redline_path
-        document.status = DocumentStatus.REDLINE_READY
-        db.commit()
-        
-        return {
+        transition(db, document, DocumentStatus.REDLINE_READY)
+        response = jsonable_encoder({
             "document_id": document_id,
             "clauses": analysis_results,
             "status": document.status
-        }
+        })
+        complete_key(db, idempotency_key, "analyze", document_id, response)
+        with track("db", "commit"):
+            db.commit()
         
     except Exception as e:
-        document.status = DocumentStatus.UPLOADED
+        db.rollback()
+        release_claim(db, document, claimed_version, previous_status)
+        release_key(db, idempotency_key, "analyze", document_id)
         db.commit()
+        if isinstance(e, ResourceLimitExceeded):
+            raise
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # Index clauses for similarity search now that the analysis is committed
+    try:
+        vector_storage.replace_clause_embeddings(
+            [result.original_text for result in previous_results],
+            [{"text": result["original_text"], "label": result["label"]} for result in analysis_results]
+        )
+    except Exception:
+        pass  # Counted in the stage error metric; a clause missing a reference is re-created on next use
+    
+    return response
 
 @router.post("/{document_id}/clean")
 async def create_clean_document(
     document_id: str,
+    document_storage=Depends(get_document_storage),
+    ai_service=Depends(get_ai_service),
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
     """Create a clean version of the document with accepted changes"""
@@ -127,6 +410,10 @@ async def create_clean_document(
     if not document.redline_path:
         raise HTTPException(status_code=400, detail="No redline version available")
     
+    stored = claim_key(db, idempotency_key, "clean", document_id)
+    if stored is not None:
+        return stored
+    
     try:
         # Get redline content
         redline_content = document_storage.get_document(document.redline_path)
@@ -135,12 +422,22 @@ async def create_clean_document(
         clean_content = await ai_service.create_clean_document(redline_content)
         clean_path = document_storage.save_clean_document(clean_content, "user_1", document_id)
         
-        # Update document
+        # Update document, unless it changed since it was read
         document.clean_path = clean_path
-        document.status = DocumentStatus.COMPLETED
+        transition(db, document, DocumentStatus.COMPLETED)
+        response = {"status": "success", "clean_path": clean_path}
+        complete_key(db, idempotency_key, "clean", document_id, response)
         db.commit()
         
-        return {"status": "success", "clean_path": clean_path}
+        return response
         
+    except TransitionConflict:
+        db.rollback()
+        release_key(db, idempotency_key, "clean", document_id)
+        db.commit()
+        raise
     except Exception as e:
+        db.rollback()
+        release_key(db, idempotency_key, "clean", document_id)
+        db.commit()
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,20 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
+from ...core.config import settings
+from ...core.resources import ResourceLimitExceeded, check_memory
 from ...db.session import get_db
-from ...db.models import Document, DocumentStatus, Feedback, AnalysisResult
-from ...services.document_storage import DocumentStorage
-from ...services.vector_storage import VectorStorage
-from ...services.ai_service import AIService
+from ...db.models import Document, DocumentStatus, Feedback, AnalysisResult, TrainingExample
+from ...services.clause_alignment import label_change
+from ...services.document_state import transition, release_claim, claim_key, complete_key, release_key
+from ..deps import get_document_storage, get_vector_storage, get_ai_service
 from pydantic import BaseModel
 
 router = APIRouter()
-document_storage = DocumentStorage()
-vector_storage = VectorStorage()
-ai_service = AIService()
 
 class FeedbackRequest(BaseModel):
     feedback_text: str
+    clause_id: Optional[int] = None  # Analysis result the feedback refers to
+
+class SuggestionDecisionRequest(BaseModel):
+    accepted: bool
+    final_text: Optional[str] = None  # Reviewer's own wording, "" removes the clause
 
 class FeedbackResponse(BaseModel):
     id: int
@@ -25,6 +30,7 @@ class FeedbackResponse(BaseModel):
 async def submit_feedback(
     document_id: str,
     feedback: FeedbackRequest,
+    vector_storage=Depends(get_vector_storage),
     db: Session = Depends(get_db)
 ):
     """Submit feedback for a document's analysis"""
@@ -38,11 +44,32 @@ async def submit_feedback(
     # Create feedback record
     feedback_record = Feedback(
         document_id=document_id,
+        analysis_result_id=feedback.clause_id,
         feedback_text=feedback.feedback_text
     )
     db.add(feedback_record)
     
-    # Store feedback embedding
+    # Feedback on a specific clause flags it as needing changes
+    if feedback.clause_id is not None:
+        clause = db.query(AnalysisResult).filter(
+            AnalysisResult.id == feedback.clause_id,
+            AnalysisResult.document_id == document_id
+        ).first()
+        if not clause:
+            raise HTTPException(status_code=404, detail="Clause not found")
+        db.add(TrainingExample(
+            document_id=document_id,
+            analysis_result_id=clause.id,
+            source="feedback",
+            original_text=clause.original_text,
+            label="modify"
+        ))
+    
+    # Update document status, unless another request changed it since it was read
+    transition(db, document, DocumentStatus.FEEDBACK_RECEIVED, allowed_from=[DocumentStatus.REDLINE_READY])
+    
+    # Store feedback embedding under the ID assigned on flush
+    db.flush()
     vector_storage.store_feedback_embedding(
         document_id=document_id,
         feedback_id=str(feedback_record.id),
@@ -50,78 +77,199 @@ async def submit_feedback(
         metadata={"type": "feedback"}
     )
     
-    # Update document status
-    document.status = DocumentStatus.FEEDBACK_RECEIVED
     db.commit()
     db.refresh(feedback_record)
     
     return feedback_record
 
+@router.post("/{document_id}/clauses/{clause_id}/decision")
+async def record_suggestion_decision(
+    document_id: str,
+    clause_id: int,
+    decision: SuggestionDecisionRequest,
+    vector_storage=Depends(get_vector_storage),
+    db: Session = Depends(get_db)
+):
+    """Record whether a suggestion was accepted, rejected or edited for incremental training
+    
+    Clauses the reviewer keeps as they are become approved clauses, which
+    cascaded analysis keeps without classifying them. Accepted and edited
+    rewrites are reused as suggestions for similar clauses in retrieval
+    suggestion mode. A later decision on the same clause withdraws what an
+    earlier one stored.
+    """
+    clause = db.query(AnalysisResult).filter(
+        AnalysisResult.id == clause_id,
+        AnalysisResult.document_id == document_id
+    ).first()
+    if not clause:
+        raise HTTPException(status_code=404, detail="Clause not found")
+    
+    if decision.final_text is not None:
+        source, revised_text = "edited", decision.final_text
+    elif decision.accepted:
+        source, revised_text = "accepted", clause.suggested_text
+    else:
+        source, revised_text = "rejected", clause.original_text
+    
+    example = TrainingExample(
+        document_id=document_id,
+        analysis_result_id=clause.id,
+        source=source,
+        original_text=clause.original_text,
+        revised_text=revised_text,
+        label=label_change(clause.original_text, revised_text)
+    )
+    db.add(example)
+    db.commit()
+    db.refresh(example)
+    # The latest decision on a clause replaces what earlier ones stored
+    if example.label == "keep":
+        vector_storage.store_approved_clauses([clause.original_text])
+        vector_storage.forget_accepted_rewrites([clause.original_text])
+    elif example.label == "modify":
+        vector_storage.store_accepted_rewrite(clause.original_text, revised_text)
+        vector_storage.forget_approved_clauses([clause.original_text])
+    else:
+        vector_storage.forget_approved_clauses([clause.original_text])
+        vector_storage.forget_accepted_rewrites([clause.original_text])
+    
+    return {
+        "status": "success",
+        "training_example_id": example.id,
+        "label": example.label
+    }
+
 @router.post("/{document_id}/regenerate")
 async def regenerate_analysis(
     document_id: str,
+    incremental: bool = True,
+    document_storage=Depends(get_document_storage),
+    vector_storage=Depends(get_vector_storage),
+    ai_service=Depends(get_ai_service),
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    """Regenerate document analysis based on feedback"""
+    """Regenerate document analysis based on feedback
+
+    Incremental regeneration only re-scores and re-generates the clauses
+    touched by feedback not applied yet: the clause feedback was given on,
+    or for document-level feedback the clauses most similar to it. Other
+    results are kept as they are. With incremental=false every clause is
+    regenerated against the whole feedback history. Retries sending the
+    same Idempotency-Key get the first request's response.
+    """
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
+    check_memory()
+    stored = claim_key(db, idempotency_key, "regenerate", document_id)
+    if stored is not None:
+        return stored
+    
     if document.status != DocumentStatus.FEEDBACK_RECEIVED:
+        release_key(db, idempotency_key, "regenerate", document_id)
+        db.commit()
         raise HTTPException(status_code=400, detail="Document is not in a state to regenerate analysis")
     
+    # Claim the document so a concurrent request cannot regenerate it too
+    try:
+        transition(db, document, DocumentStatus.ANALYZING, allowed_from=[DocumentStatus.FEEDBACK_RECEIVED])
+        db.commit()
+    except Exception:
+        db.rollback()
+        release_key(db, idempotency_key, "regenerate", document_id)
+        db.commit()
+        raise
+    claimed_version = document.version
+    
     try:
         # Get document content
         content = document_storage.get_document(document.original_path)
         
-        # Get feedback history
-        feedback_history = db.query(Feedback).filter(
-            Feedback.document_id == document_id
-        ).all()
+        # Get feedback history, or only the feedback not applied yet
+        feedback_query = db.query(Feedback).filter(Feedback.document_id == document_id)
+        if incremental:
+            feedback_query = feedback_query.filter(Feedback.applied_at.is_(None))
+        feedback_history = feedback_query.all()
         
-        # Get similar feedback from other documents
-        similar_feedback = []
-        for feedback in feedback_history:
-            similar = vector_storage.find_similar_feedback(feedback.feedback_text)
-            similar_feedback.extend(similar)
+        results = db.query(AnalysisResult).filter(
+            AnalysisResult.document_id == document_id
+        ).order_by(AnalysisResult.id).all()
         
-        # Regenerate analysis with feedback
-        analysis_results = await ai_service.regenerate_analysis(
-            content=content,
-            feedback_history=feedback_history,
-            similar_feedback=similar_feedback
+        # Get similar feedback from other documents in one batched lookup
+        similar_rankings = vector_storage.find_similar_feedback_batch(
+            [feedback.feedback_text for feedback in feedback_history],
+            top_k=settings.REGENERATE_SIMILAR_FEEDBACK
         )
         
-        # Clear old analysis results
-        db.query(AnalysisResult).filter(
-            AnalysisResult.document_id == document_id
-        ).delete()
+        # Feedback texts for each touched clause, by result ID
+        touched = {result.id: [] for result in results} if not incremental else {}
+        document_level = [feedback for feedback in feedback_history if feedback.analysis_result_id is None]
+        matches = ai_service.match_feedback(
+            [feedback.feedback_text for feedback in document_level],
+            [result.original_text for result in results]
+        ) if incremental else [range(len(results))] * len(document_level)
+        clause_matches = dict(zip((feedback.id for feedback in document_level), matches))
+        for feedback, similar in zip(feedback_history, similar_rankings):
+            texts = [feedback.feedback_text] + [
+                hit["metadata"]["text"] for hit in similar
+                if hit["metadata"].get("document_id") != document_id and "text" in hit["metadata"]
+            ]
+            if feedback.analysis_result_id is not None:
+                result_ids = [feedback.analysis_result_id]
+            else:
+                result_ids = [results[index].id for index in clause_matches[feedback.id]]
+            for result_id in result_ids:
+                touched.setdefault(result_id, []).extend(texts)
+        
+        # Regenerate the touched clauses and update only the rows that changed
+        touched_results = [result for result in results if result.id in touched]
+        regenerated = await ai_service.regenerate_clauses([
+            {"original_text": result.original_text, "feedback": list(dict.fromkeys(touched[result.id]))}
+            for result in touched_results
+        ])
+        updated = []
+        for result, new in zip(touched_results, regenerated):
+            if (result.suggested_text, result.confidence_score, result.label) != (new["suggested_text"], new["confidence_score"], new["label"]):
+                result.suggested_text = new["suggested_text"]
+                result.confidence_score = new["confidence_score"]
+                result.label = new["label"]
+                result.validation_score = None  # Validated against the old suggestion
+                updated.append(result.id)
         
-        # Store new analysis results
-        for result in analysis_results:
-            analysis = AnalysisResult(
-                document_id=document_id,
-                clause_text=result["clause_text"],
-                original_text=result["original_text"],
-                suggested_text=result["suggested_text"],
-                confidence_score=result["confidence_score"]
-            )
-            db.add(analysis)
+        applied_at = datetime.utcnow()
+        for feedback in feedback_history:
+            feedback.applied_at = applied_at
         
         # Generate new redline document
-        redline_content = await ai_service.create_redline_document(content, analysis_results)
+        redline_content = await ai_service.create_redline_document(content, [
+            {"original_text": result.original_text, "suggested_text": result.suggested_text}
+            for result in results
+        ])
         redline_path = document_storage.save_redline_document(redline_content, "user_1", document_id)
         
         # Update document
         document.redline_path = redline_path
-        document.status = DocumentStatus.REDLINE_READY
-        db.commit()
-        
-        return {
+        transition(db, document, DocumentStatus.REDLINE_READY)
+        response = {
             "status": "success",
             "document_id": document_id,
-            "redline_path": redline_path
+            "redline_path": redline_path,
+            "regenerated_clause_ids": [result.id for result in touched_results],
+            "updated_clause_ids": updated
         }
+        complete_key(db, idempotency_key, "regenerate", document_id, response)
+        db.commit()
+        
+        return response
         
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        db.rollback()
+        release_claim(db, document, claimed_version, DocumentStatus.FEEDBACK_RECEIVED)
+        release_key(db, idempotency_key, "regenerate", document_id)
+        db.commit()
+        if isinstance(e, ResourceLimitExceeded):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,12 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
+from ...core.resources import ResourceLimitExceeded, check_memory, read_limited
 from ...db.session import get_db
-from ...services.training_service import TrainingService
+from ...services.docx_processing import InvalidDocument
+from ..deps import get_training_service, get_model_store, get_vector_storage
 from pydantic import BaseModel
 
 router = APIRouter()
-training_service = TrainingService()
 
 class TrainingData(BaseModel):
     original: str
@@ -16,9 +18,13 @@ class TrainingData(BaseModel):
 class TrainingRequest(BaseModel):
     training_data: List[TrainingData]
 
+class ApprovedClausesRequest(BaseModel):
+    clauses: List[str]
+
 @router.post("/train")
 async def train_models(
     request: TrainingRequest,
+    training_service=Depends(get_training_service),
     db: Session = Depends(get_db)
 ):
     """Train models using provided training data"""
@@ -41,11 +47,67 @@ async def train_models(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/incremental/status")
+async def incremental_training_status(
+    training_service=Depends(get_training_service),
+    db: Session = Depends(get_db)
+):
+    """Report how many feedback examples are buffered for incremental training"""
+    return training_service.incremental_status(db)
+
+@router.post("/incremental")
+async def incremental_training(
+    force: bool = False,
+    training_service=Depends(get_training_service),
+    db: Session = Depends(get_db)
+):
+    """Fine-tune the serving models on buffered feedback
+    
+    Meant to be called periodically; it is a no-op until enough new examples
+    are buffered unless force is set. Training runs in a worker thread so the
+    event loop keeps serving; a second call while it runs gets a 409.
+    """
+    if not training_service.finetune_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="An incremental fine-tune is already running")
+    try:
+        return await asyncio.to_thread(training_service.incremental_finetune, db, force=force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        training_service.finetune_lock.release()
+
+@router.post("/approved-clauses")
+async def add_approved_clauses(
+    request: ApprovedClausesRequest,
+    vector_storage=Depends(get_vector_storage)
+):
+    """Add boilerplate clauses that cascaded analysis keeps without classifying them"""
+    vector_storage.store_approved_clauses(request.clauses)
+    return {"status": "success", "count": len(set(request.clauses))}
+
+@router.get("/models")
+async def list_models(model_store=Depends(get_model_store)):
+    """List stored model versions and which one is active"""
+    return model_store.list_models()
+
+@router.post("/models/{name}/activate/{version}")
+async def activate_model_version(name: str, version: str, model_store=Depends(get_model_store)):
+    """Make a stored model version active, e.g. to roll back a bad training run
+    
+    Running workers pick the new version up on their next restart.
+    """
+    try:
+        model_store.activate(name, version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "name": name, "active_version": version}
+
 @router.post("/train-from-files")
 async def train_from_files(
     original_files: Optional[List[UploadFile]] = File(None),
     redline_files: Optional[List[UploadFile]] = File(None),
     clean_files: Optional[List[UploadFile]] = File(None),
+    training_service=Depends(get_training_service),
     db: Session = Depends(get_db)
 ):
     """Train models using uploaded training files
@@ -72,6 +134,7 @@ async def train_from_files(
             detail="Number of original and clean files must match"
         )
     
+    check_memory()
     try:
         training_data = []
         
@@ -83,7 +146,7 @@ async def train_from_files(
                         status_code=400,
                         detail=f"File {redline_file.filename} is not a DOCX file"
                     )
-                content = await redline_file.read()
+                content = read_limited(redline_file.file, redline_file.filename)
                 training_data.append({"redline": content})
         else:
             # Process original and clean files
@@ -93,8 +156,8 @@ async def train_from_files(
                         status_code=400,
                         detail="All files must be DOCX files"
                     )
-                orig_content = await orig_file.read()
-                clean_content = await clean_file.read()
+                orig_content = read_limited(orig_file.file, orig_file.filename)
+                clean_content = read_limited(clean_file.file, clean_file.filename)
                 training_data.append({
                     "original": orig_content,
                     "clean": clean_content
@@ -105,5 +168,9 @@ async def train_from_files(
         
         return result
         
+    except (HTTPException, ResourceLimitExceeded):
+        raise
+    except InvalidDocument as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -3,15 +3,11 @@ from sqlalchemy.orm import Session
 from typing import List
 from ...db.session import get_db
 from ...db.models import Document, DocumentStatus, AnalysisResult
-from ...services.document_storage import DocumentStorage
-from ...services.vector_storage import VectorStorage
-from ...services.ai_service import AIService
+from ...services.document_state import TransitionConflict, check_unchanged
+from ..deps import get_vector_storage, get_ai_service
 from pydantic import BaseModel
 
 router = APIRouter()
-document_storage = DocumentStorage()
-vector_storage = VectorStorage()
-ai_service = AIService()
 
 class ValidationRequest(BaseModel):
     document_id: str
@@ -25,6 +21,8 @@ class ValidationResponse(BaseModel):
 @router.post("/validate", response_model=ValidationResponse)
 async def validate_analysis(
     request: ValidationRequest,
+    vector_storage=Depends(get_vector_storage),
+    ai_service=Depends(get_ai_service),
     db: Session = Depends(get_db)
 ):
     """Validate specific clauses in a document's analysis"""
@@ -68,6 +66,8 @@ async def validate_analysis(
                 "validation_notes": validation_result["validation_notes"]
             })
         
+        # Only keep the scores if the analysis was not replaced meanwhile
+        check_unchanged(db, document, [DocumentStatus.REDLINE_READY])
         db.commit()
         
         return {
@@ -76,12 +76,17 @@ async def validate_analysis(
             "status": document.status
         }
         
+    except TransitionConflict:
+        db.rollback()
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{document_id}/validate-all")
 async def validate_all_clauses(
     document_id: str,
+    vector_storage=Depends(get_vector_storage),
+    ai_service=Depends(get_ai_service),
     db: Session = Depends(get_db)
 ):
     """Validate all clauses in a document's analysis"""
@@ -116,6 +121,8 @@ async def validate_all_clauses(
             # Update clause with validation score
             clause.validation_score = validation_result["validation_score"]
         
+        # Only keep the scores if the analysis was not replaced meanwhile
+        check_unchanged(db, document, [DocumentStatus.REDLINE_READY])
         db.commit()
         
         return {
@@ -124,5 +131,8 @@ async def validate_all_clauses(
             "validated_clauses_count": len(clauses)
         }
         
+    except TransitionConflict:
+        db.rollback()
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
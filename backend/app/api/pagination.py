@@ -0,0 +1,83 @@
+"""Keyset pagination, column projection and ETags for read endpoints
+
+Pages are ordered by a unique key (e.g. created_at, id) and the cursor is
+the key of the last row served, so the next page is an index range scan
+starting after it instead of an OFFSET that reads and discards every
+earlier row. Clients pick the columns they need with ``fields``; the key
+columns are always selected. Responses carry a weak ETag of their body and
+answer 304 to a matching If-None-Match.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from datetime import datetime
+import base64
+import hashlib
+import json
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import DateTime, and_, or_
+from sqlalchemy.orm import Query
+from ..core.config import settings
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(jsonable_encoder(list(values))).encode()).decode()
+
+def decode_cursor(cursor: str, keys: Sequence[Tuple[Any, bool]]) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("cursor does not match the ordering")
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for (column, _), value in zip(keys, values)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def project(fields: Optional[str], columns: Dict[str, Any], keys: Sequence[Tuple[Any, bool]]) -> List[Any]:
+    """Columns selected by a comma separated fields parameter, plus the key columns"""
+    names = [name.strip() for name in fields.split(",") if name.strip()] if fields else list(columns)
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    selected = [columns[name] for name in names]
+    selected += [column for column, _ in keys if column not in selected]
+    return selected
+
+def keyset_page(
+    query: Query,
+    keys: Sequence[Tuple[Any, bool]],
+    cursor: Optional[str],
+    limit: Optional[int]
+) -> Dict[str, Any]:
+    """One page of a projected query, ordered by keys as (column, descending) pairs
+
+    The keys must identify rows uniquely. Returns the "items" as dicts and
+    the "next_cursor", None on the last page.
+    """
+    limit = min(limit or settings.PAGE_SIZE_DEFAULT, settings.PAGE_SIZE_MAX)
+    if cursor is not None:
+        # (k1, k2, ...) after the cursor, spelled out since row value comparisons are not portable
+        values = decode_cursor(cursor, keys)
+        after = []
+        for i, (column, descending) in enumerate(keys):
+            equal = [keys[j][0] == values[j] for j in range(i)]
+            after.append(and_(*equal, column < values[i] if descending else column > values[i]))
+        query = query.filter(or_(*after))
+    query = query.order_by(*(column.desc() if descending else column.asc() for column, descending in keys))
+
+    # One extra row tells whether there is a next page
+    rows = [dict(row._mapping) for row in query.limit(limit + 1).all()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][column.key] for column, _ in keys])
+    return {"items": rows, "next_cursor": next_cursor}
+
+def cached_json(request: Request, payload: Any) -> Response:
+    """JSON response with a weak ETag, or 304 if the client already has it"""
+    body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -0,0 +1,246 @@
+"""Shared clients for MinIO, Qdrant and Redis
+
+Every process gets one client per backend with a sized connection pool and
+connect/read timeouts. Calls go through a wrapper that retries transient
+failures (connection errors, timeouts, 5xx answers) with exponential
+backoff and full jitter, and a per-backend circuit breaker: after
+CIRCUIT_FAILURE_THRESHOLD consecutive transient failures calls fail fast
+with BackendUnavailable for CIRCUIT_RESET_SECONDS, then a single trial call
+decides whether the circuit closes again. Errors the backend answered with
+on purpose (a missing object, a bad request) pass straight through.
+
+Uploads that consume a stream are not retried, since the stream cannot be
+replayed. Clients are created on first use and dropped in forked children,
+which must not share the parent's pooled connections.
+"""
+from typing import Any, Callable, Dict, Tuple
+import functools
+import os
+import random
+import threading
+import time
+from prometheus_client import Counter, Gauge
+from .config import settings
+
+MINIO = "minio"
+QDRANT = "qdrant"
+REDIS = "redis"
+
+# Methods whose arguments cannot be replayed on a retry
+_NOT_RETRIED = {MINIO: {"put_object"}}
+
+CLIENT_CALLS = Counter(
+    "nda_client_calls_total",
+    "Calls to backend clients by outcome (ok, error, retried, rejected)",
+    ["backend", "outcome"],
+)
+CLIENT_IN_FLIGHT = Gauge(
+    "nda_client_in_flight",
+    "Backend calls in progress; compare with nda_client_pool_size for pool utilization",
+    ["backend"],
+    multiprocess_mode="livesum",
+)
+CLIENT_POOL_SIZE = Gauge(
+    "nda_client_pool_size",
+    "Connections in each backend client pool",
+    ["backend"],
+    multiprocess_mode="livesum",
+)
+CIRCUIT_OPEN = Gauge(
+    "nda_client_circuit_open",
+    "Whether a backend circuit breaker is open",
+    ["backend"],
+    multiprocess_mode="livemax",
+)
+
+class BackendUnavailable(Exception):
+    """Raised instead of calling a backend whose circuit is open"""
+
+class CircuitBreaker:
+    def __init__(self, backend: str, failure_threshold: int, reset_seconds: float):
+        self.backend = backend
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise BackendUnavailable unless the call may go through"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_seconds or self._trial_running:
+                raise BackendUnavailable(f"{self.backend} is unavailable, retrying in at most {self.reset_seconds:.0f}s")
+            # Half-open: let one trial call through
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+            CIRCUIT_OPEN.labels(self.backend).set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                CIRCUIT_OPEN.labels(self.backend).set(1)
+
+def _transient_errors(backend: str) -> Tuple[type, ...]:
+    """Exception types that mean the backend could not be reached or failed"""
+    errors = [ConnectionError, TimeoutError]
+    if backend == MINIO:
+        import urllib3
+        from minio.error import ServerError
+        errors += [urllib3.exceptions.HTTPError, ServerError]
+    elif backend == QDRANT:
+        import httpx
+        from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+        errors += [httpx.TransportError, ResponseHandlingException, UnexpectedResponse]
+        try:
+            import grpc
+            errors.append(grpc.RpcError)
+        except ImportError:  # gRPC is only needed with QDRANT_PREFER_GRPC
+            pass
+    elif backend == REDIS:
+        import redis
+        errors += [redis.ConnectionError, redis.TimeoutError]
+    return tuple(errors)
+
+def _is_transient(backend: str, error: Exception) -> bool:
+    if not isinstance(error, _transient_errors(backend)):
+        return False
+    if backend == QDRANT and hasattr(error, "code") and callable(error.code):
+        # Only some gRPC status codes are worth retrying
+        return error.code().name in ("UNAVAILABLE", "DEADLINE_EXCEEDED", "RESOURCE_EXHAUSTED")
+    if backend == QDRANT and hasattr(error, "status_code"):
+        # An HTTP answer (UnexpectedResponse); 4xx answers are the caller's fault
+        return error.status_code is not None and error.status_code >= 500
+    return True
+
+def _backoff(attempt: int) -> float:
+    """Full jitter: uniform between 0 and the exponential backoff of the attempt"""
+    return random.uniform(0, settings.CLIENT_RETRY_BACKOFF * 2 ** attempt)
+
+class ResilientClient:
+    """Proxy adding retries, the circuit breaker and metrics to a client's methods"""
+
+    def __init__(self, backend: str, client: Any, breaker: CircuitBreaker):
+        self._backend = backend
+        self._client = client
+        self._breaker = breaker
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+        retries = 0 if name in _NOT_RETRIED.get(self._backend, ()) else settings.CLIENT_RETRIES
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            return self._call(attribute, retries, *args, **kwargs)
+        return call
+
+    def _call(self, method: Callable, retries: int, *args, **kwargs):
+        backend = self._backend
+        for attempt in range(retries + 1):
+            try:
+                self._breaker.before_call()
+            except BackendUnavailable:
+                CLIENT_CALLS.labels(backend, "rejected").inc()
+                raise
+            CLIENT_IN_FLIGHT.labels(backend).inc()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                if not _is_transient(backend, e):
+                    # The backend answered; it is up
+                    self._breaker.record_success()
+                    CLIENT_CALLS.labels(backend, "error").inc()
+                    raise
+                self._breaker.record_failure()
+                if attempt == retries:
+                    CLIENT_CALLS.labels(backend, "error").inc()
+                    raise
+                CLIENT_CALLS.labels(backend, "retried").inc()
+            else:
+                self._breaker.record_success()
+                CLIENT_CALLS.labels(backend, "ok").inc()
+                return result
+            finally:
+                CLIENT_IN_FLIGHT.labels(backend).dec()
+            time.sleep(_backoff(attempt))
+
+def _minio_client():
+    import urllib3
+    from minio import Minio
+    http_client = urllib3.PoolManager(
+        num_pools=1,
+        maxsize=settings.CLIENT_POOL_SIZE,
+        block=True,  # Wait for a free connection instead of opening unpooled ones
+        timeout=urllib3.Timeout(connect=settings.CLIENT_CONNECT_TIMEOUT, read=settings.CLIENT_READ_TIMEOUT),
+        retries=False  # Retried by ResilientClient
+    )
+    return Minio(
+        settings.MINIO_URL,
+        access_key=settings.MINIO_ACCESS_KEY,
+        secret_key=settings.MINIO_SECRET_KEY,
+        secure=False,
+        http_client=http_client
+    )
+
+def _qdrant_client():
+    import httpx
+    from qdrant_client import QdrantClient
+    return QdrantClient(
+        url=settings.VECTOR_DB_URL,
+        prefer_grpc=settings.QDRANT_PREFER_GRPC,
+        grpc_port=settings.QDRANT_GRPC_PORT,
+        timeout=int(settings.CLIENT_READ_TIMEOUT),
+        # Passed through to the httpx client of the REST transport
+        limits=httpx.Limits(
+            max_connections=settings.CLIENT_POOL_SIZE,
+            max_keepalive_connections=settings.CLIENT_POOL_SIZE
+        )
+    )
+
+def _redis_client():
+    import redis
+    pool = redis.BlockingConnectionPool.from_url(
+        settings.REDIS_URL,
+        max_connections=settings.CLIENT_POOL_SIZE,
+        timeout=settings.CLIENT_READ_TIMEOUT,  # Wait for a free connection
+        socket_connect_timeout=settings.CLIENT_CONNECT_TIMEOUT,
+        socket_timeout=settings.CLIENT_READ_TIMEOUT
+    )
+    return redis.Redis(connection_pool=pool)
+
+_FACTORIES = {MINIO: _minio_client, QDRANT: _qdrant_client, REDIS: _redis_client}
+_clients: Dict[str, ResilientClient] = {}
+_lock = threading.Lock()
+
+def get_client(backend: str) -> ResilientClient:
+    """The process-wide client of a backend (MINIO, QDRANT or REDIS)"""
+    client = _clients.get(backend)
+    if client is None:
+        with _lock:
+            client = _clients.get(backend)
+            if client is None:
+                breaker = CircuitBreaker(backend, settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_SECONDS)
+                client = _clients[backend] = ResilientClient(backend, _FACTORIES[backend](), breaker)
+                CLIENT_POOL_SIZE.labels(backend).set(settings.CLIENT_POOL_SIZE)
+    return client
+
+def _reset_after_fork():
+    global _lock
+    _clients.clear()
+    _lock = threading.Lock()
+
+# Registered on import, before any service that holds a client registers
+# its own reconnect, so reconnecting services get fresh clients
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -13,14 +13,135 @@ class Settings(BaseSettings):
     
     # Vector DB settings
     VECTOR_DB_URL: str = "http://qdrant:6333"
+    VECTOR_PROFILE: str = "default"  # default, accurate, int8 or binary (see app/services/vector_profiles.py)
+    # Per-field overrides of the profile
+    VECTOR_HNSW_M: Optional[int] = None
+    VECTOR_HNSW_EF_CONSTRUCT: Optional[int] = None
+    VECTOR_ON_DISK: Optional[bool] = None
+    VECTOR_QUANTIZATION: Optional[str] = None  # int8, binary or none
+    VECTOR_SEARCH_EF: Optional[int] = None
+    
+    # Vector backend settings (see app/services/vector_backends.py)
+    VECTOR_BACKEND: str = "qdrant"  # qdrant, or embedded for single-process installs
+    VECTOR_DATA_DIR: str = "./vector-data"  # Embedded index files
+    VECTOR_EMBEDDED_INDEX: str = "auto"  # exact, ivf, or auto to switch to ivf at VECTOR_EMBEDDED_IVF_MIN_POINTS
+    VECTOR_EMBEDDED_IVF_MIN_POINTS: int = 50000
+    VECTOR_EMBEDDED_NPROBE: int = 8  # IVF lists probed per query unless hnsw_ef is given
+    VECTOR_EMBEDDED_TAIL: int = 2000  # Unindexed rows scanned exhaustively before merging
+    VECTOR_EMBEDDED_COMPACT_RATIO: float = 0.2  # Deleted fraction that triggers compaction on snapshot
+    VECTOR_SNAPSHOT_EVERY: int = 10000  # Writes between snapshots, 0 snapshots only on exit
+    
+    # Embedding reduction settings (see app/services/embedding_reduction.py)
+    EMBEDDING_PROJECTION: bool = True  # Serve the active projection version of the model store, if there is one
+    
+    # Retrieval settings (see app/services/retrieval.py)
+    HYBRID_SEARCH: bool = True  # Fuse BM25 with vector search for similar clauses
+    HYBRID_CANDIDATES: int = 50  # Hits taken from each ranking before fusion
+    IDF_CACHE_SECONDS: int = 3600
+    IDF_CACHE_SIZE: int = 100000  # Terms cached before the IDF cache is reset
+    IDF_FETCH_CONCURRENCY: int = 8  # Document frequencies counted at once on IDF cache misses
+    
+    # Near-duplicate detection settings (see app/services/fingerprinting.py)
+    NEAR_DUPLICATE_DETECTION: bool = True  # Reuse results of unchanged paragraphs from a similar analyzed NDA
+    NEAR_DUPLICATE_THRESHOLD: float = 0.8  # Minimum estimated Jaccard similarity of paragraph shingles
+    
+    # Regeneration settings
+    REGENERATE_SIMILAR_FEEDBACK: int = 3  # Feedback from other documents added to each prompt
+    REGENERATE_MATCH_THRESHOLD: float = 0.5  # Similarity at which document-level feedback touches a clause
+    
+    # Clause extraction settings (see app/services/clause_normalization.py)
+    NER_WINDOW_STRIDE: int = 64  # Tokens shared by consecutive 512-token NER windows
+    CLAUSE_DEDUP_THRESHOLD: float = 0.9  # Similarity at which a clause counts as a near-duplicate
+    CLAUSE_MIN_TOKENS: int = 8  # Shorter clauses are packed with the next one in their paragraph
+    CLAUSE_MAX_TOKENS: int = 256  # Upper bound for packed clauses
+    
+    # Cascaded analysis settings
+    CASCADE_ENABLED: bool = False  # Check approved clauses before the classifier, generate only confident modifications
+    CASCADE_APPROVED_THRESHOLD: float = 0.95  # Similarity to an approved clause that keeps a clause without classifying it
+    CASCADE_MODIFY_THRESHOLD: float = 0.6  # Classifier confidence needed before a suggestion is generated
+    
+    # Suggestion settings
+    SUGGESTION_MODE: str = "generate"  # generate, or retrieval to reuse accepted rewrites before generating
+    REWRITE_MATCH_THRESHOLD: float = 0.9  # Similarity to the original of an accepted rewrite needed to reuse it
+    
+    # Evaluation settings (see app/services/evaluation.py)
+    EVALUATION_MODES: dict = {"default": {}, "unbatched": {"CLASSIFY_BATCH_SIZE": 1}}  # Mode name -> settings overrides
+    EVALUATION_FLOORS: dict = {}  # Minimum metric values by dotted path, e.g. {"classification.macro_f1": 0.8}
+    EVALUATION_HOLDOUT: float = 0.1  # Share of training examples held out to evaluate trained classifiers
+    
+    # Read API settings (see app/api/pagination.py)
+    PAGE_SIZE_DEFAULT: int = 50
+    PAGE_SIZE_MAX: int = 500
+    
+    # Batch intake settings (see app/services/batch_scheduler.py)
+    BATCH_MAX_DOCUMENTS: int = 1000  # Documents accepted per batch
+    BATCH_DOCUMENTS_PER_STEP: int = 8  # Documents whose clauses share one model pass
+    BATCH_IO_CONCURRENCY: int = 4  # Documents fetched, parsed or saved at once
+    CLASSIFY_BATCH_SIZE: int = 32  # Clauses per classifier forward pass
     
     # Redis settings
     REDIS_URL: str = "redis://redis:6379"
     
+    # Backend client settings (see app/core/clients.py)
+    CLIENT_POOL_SIZE: int = 20  # Connections per backend and process
+    CLIENT_CONNECT_TIMEOUT: float = 3.0
+    CLIENT_READ_TIMEOUT: float = 30.0
+    CLIENT_RETRIES: int = 3  # Retries of transient failures
+    CLIENT_RETRY_BACKOFF: float = 0.2  # Seconds, doubled per retry and fully jittered
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # Consecutive transient failures that open a circuit
+    CIRCUIT_RESET_SECONDS: float = 30.0  # Time an open circuit fails fast before a trial call
+    QDRANT_PREFER_GRPC: bool = False  # Talk to Qdrant over gRPC instead of REST
+    QDRANT_GRPC_PORT: int = 6334
+    
     # File storage settings
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
     ALLOWED_EXTENSIONS: set = {"docx"}
     
+    # Resource limit settings (see app/core/resources.py)
+    MAX_DOCX_XML_SIZE: int = 50 * 1024 * 1024  # Uncompressed XML of one DOCX
+    MAX_PARAGRAPHS: int = 5000  # Per document
+    MAX_CLAUSES: int = 2000  # Per document, after normalization
+    BATCH_MAX_SIZE: int = 1024 * 1024 * 1024  # Uncompressed size of all documents in a batch
+    MEMORY_BUDGET_MB: int = 0  # Per process, held against its PSS; 0 holds the container's cgroup memory use to its limit
+    MEMORY_HIGH_WATERMARK: float = 0.85  # Fraction of the budget above which new work is held back
+    MEMORY_BACKPRESSURE_POLL: float = 0.5  # Seconds between memory checks while the batch queue is held
+    MEMORY_BACKPRESSURE_MAX_WAIT: float = 60.0  # Then the batch scheduler goes on one document at a time
+    MEMORY_RETRY_AFTER: int = 10  # Retry-After seconds of requests rejected under memory pressure
+    
+    # Concurrency settings (see app/services/document_state.py)
+    CLAIM_LEASE_SECONDS: int = 3600  # A claim or running idempotency key older than this belongs to a crashed run
+    
+    # Startup settings (see app/api/deps.py)
+    WARMUP: str = "background"  # background, blocking (ready before serving) or lazy (load on first use)
+    WARMUP_COMPONENTS: list = ["document_storage", "vector_storage", "ai_service"]  # Loaded in this order
+    
+    # Serving settings (see app/serve.py)
+    SERVE_WORKERS: int = 1
+    TORCH_THREADS_PER_WORKER: int = 0  # 0 splits the cores evenly between workers
+    
+    # Observability settings
+    # Spans are exported when this is set and opentelemetry-sdk plus
+    # opentelemetry-exporter-otlp are installed
+    OTEL_EXPORTER_OTLP_ENDPOINT: Optional[str] = None  # e.g. http://otel-collector:4317
+    OTEL_SERVICE_NAME: str = "nda-validator"
+    
+    # Profiling settings (see app/core/profiling.py)
+    ADMIN_TOKEN: Optional[str] = None  # Required for admin endpoints; unset disables them
+    PROFILE_DIR: str = "./profiles"
+    PROFILE_SAMPLE_RATE: int = 0  # Profile 1 in N analyze requests, 0 disables sampling
+    
+    # Model store settings
+    MODEL_STORE_DIR: str = "./models"
+    MODEL_STORE_KEEP_VERSIONS: int = 5  # Older inactive versions are pruned
+    MODEL_STORE_VERIFY_ON_LOAD: bool = False  # Re-hash weights before serving them
+    
+    # Incremental training settings
+    INCREMENTAL_MIN_EXAMPLES: int = 32  # Buffered examples needed before a fine-tune runs
+    INCREMENTAL_REPLAY_RATIO: float = 1.0  # Replayed historical examples per new example
+    INCREMENTAL_EPOCHS: int = 1
+    INCREMENTAL_LEARNING_RATE: float = 2e-5
+    INCREMENTAL_USE_LORA: bool = False  # Requires the optional peft package
+    
     class Config:
         env_file = ".env"
 
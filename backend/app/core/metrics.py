@@ -0,0 +1,169 @@
+from contextlib import contextmanager, ExitStack
+import functools
+import inspect
+import os
+import time
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+from .config import settings
+from .profiling import is_profiling
+
+try:
+    from opentelemetry import trace
+except ImportError:  # Tracing is optional
+    trace = None
+
+# Latency buckets from sub-millisecond lookups up to multi-minute analyses
+_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_LATENCY = Histogram(
+    "nda_stage_duration_seconds",
+    "Duration of a pipeline stage",
+    ["component", "stage"],
+    buckets=_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "nda_stage_errors_total",
+    "Pipeline stages that raised an exception",
+    ["component", "stage"],
+)
+HTTP_LATENCY = Histogram(
+    "nda_http_request_duration_seconds",
+    "Duration of HTTP requests",
+    ["method", "route", "status"],
+    buckets=_BUCKETS,
+)
+CLAUSES_PROCESSED = Counter(
+    "nda_clauses_processed_total",
+    "Clauses classified by the analysis pipeline",
+    ["label"],
+)
+CASCADE_CLAUSES = Counter(
+    "nda_cascade_clauses_total",
+    "Clauses reaching each tier of cascaded analysis (approved_match, classifier, generator)",
+    ["tier"],
+)
+SUGGESTIONS = Counter(
+    "nda_suggestions_total",
+    "Suggestions for modified clauses by source (retrieved, generated)",
+    ["source"],
+)
+CLAUSES_DROPPED = Counter(
+    "nda_clauses_dropped_total",
+    "Extracted clauses not run through the models on their own: duplicates sharing the analysis of the clause they duplicate, or packed into a neighbour",
+    ["reason"],
+)
+TOKENS_GENERATED = Counter(
+    "nda_tokens_generated_total",
+    "Tokens generated for clause suggestions",
+)
+BATCH_DOCUMENTS = Counter(
+    "nda_batch_documents_total",
+    "Documents finished by the batch scheduler",
+    ["outcome"],
+)
+
+LIMITS_EXCEEDED = Counter(
+    "nda_resource_limits_exceeded_total",
+    "Requests rejected by a resource limit (file_size, docx_xml_size, paragraphs, clauses, batch_size, memory)",
+    ["limit"],
+)
+MEMORY_BACKPRESSURE_SECONDS = Counter(
+    "nda_memory_backpressure_seconds_total",
+    "Time the batch scheduler held its queue because the process was near its memory budget",
+)
+REQUEST_MEMORY_GROWTH = Histogram(
+    "nda_http_request_rss_growth_bytes",
+    "Growth of the process's resident memory over a request; concurrent requests are counted in each other's growth",
+    ["route"],
+    buckets=(1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20, 1 << 30, 4 << 30),
+)
+
+_tracer = trace.get_tracer("nda-validator") if trace is not None else None
+
+@contextmanager
+def track(component: str, stage: str):
+    """Time a stage into the stage histogram and, if enabled, an OpenTelemetry span"""
+    with ExitStack() as stack:
+        if _tracer is not None:
+            stack.enter_context(_tracer.start_as_current_span(f"{component}.{stage}"))
+        if is_profiling():
+            # Label the stage in the torch.profiler trace of a profiled request
+            from torch.profiler import record_function
+            stack.enter_context(record_function(f"{component}.{stage}"))
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            STAGE_ERRORS.labels(component, stage).inc()
+            raise
+        finally:
+            STAGE_LATENCY.labels(component, stage).observe(time.perf_counter() - started)
+
+def tracked(component: str, stage: str = None):
+    """Decorator form of track() for sync and async functions"""
+    def decorator(func):
+        name = stage or func.__name__.lstrip("_")
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(component, name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(component, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def instrument_engine(engine):
+    """Time every SQL statement executed through an engine by statement type"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        statement_type = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "unknown"
+        STAGE_LATENCY.labels("db", statement_type).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its start
+        # time so the pooled connection's stack stays balanced
+        conn = exception_context.connection
+        if conn is not None and exception_context.cursor is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+def setup_tracing():
+    """Export spans to an OTLP collector when OTEL_EXPORTER_OTLP_ENDPOINT is set"""
+    if trace is None or not settings.OTEL_EXPORTER_OTLP_ENDPOINT:
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=settings.OTEL_EXPORTER_OTLP_ENDPOINT)))
+    trace.set_tracer_provider(provider)
+
+def render_metrics() -> bytes:
+    """Render all metrics, aggregated across workers in multiprocess mode"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
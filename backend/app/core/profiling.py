@@ -0,0 +1,139 @@
+"""On-demand request profiling
+
+A request is profiled when it carries ``X-Profile: 1`` (or ``?profile=1``)
+together with a valid ``X-Admin-Token``, or when it is an analyze request
+picked by the 1-in-PROFILE_SAMPLE_RATE sampler. The profile combines a
+cProfile of the request with torch.profiler operator timings; stages timed
+through core.metrics.track() appear as labelled ranges in the torch trace.
+Artifacts are written to PROFILE_DIR/<profile_id>/ and served by the admin
+router.
+
+cProfile follows the event loop thread, so other requests interleaved at
+await points show up in the profile too. Model inference runs synchronously
+and dominates analyze requests, so in practice the profile is that of the
+request.
+"""
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import datetime
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import re
+import secrets
+import threading
+import time
+from fastapi import Request
+from .config import settings
+
+PROFILE_HEADER = "X-Profile"
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+_ANALYZE_PATH = re.compile(r"^/api/documents/[^/]+/analyze$")
+# Profile IDs are a UTC timestamp and 4 random bytes, see profiling_middleware
+PROFILE_ID = re.compile(r"\d{8}T\d{6}Z-[0-9a-f]{8}")
+ARTIFACTS = ("cprofile.prof", "cprofile.txt", "torch_ops.txt", "torch_trace.json", "meta.json")
+_sample_counter = itertools.count(1)
+# cProfile and torch.profiler are process-global, so only one request is
+# profiled at a time; others run unprofiled instead of waiting
+_profile_lock = threading.Lock()
+_profiling = ContextVar("profiling", default=False)
+
+def is_profiling() -> bool:
+    """Whether the current request is being profiled"""
+    return _profiling.get()
+
+def is_admin(token: str) -> bool:
+    return bool(settings.ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, settings.ADMIN_TOKEN)
+
+def _should_profile(request: Request) -> str:
+    """Return why a request should be profiled, or None"""
+    requested = request.headers.get(PROFILE_HEADER) == "1" or request.query_params.get("profile") == "1"
+    if requested and is_admin(request.headers.get(ADMIN_TOKEN_HEADER)):
+        return "requested"
+    if (
+        settings.PROFILE_SAMPLE_RATE > 0
+        and request.method == "POST"
+        and _ANALYZE_PATH.match(request.url.path)
+        and next(_sample_counter) % settings.PROFILE_SAMPLE_RATE == 0
+    ):
+        return "sampled"
+    return None
+
+def _torch_profiler():
+    try:
+        from torch.profiler import profile, ProfilerActivity
+    except ImportError:
+        return None
+    return profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+
+def _write_artifacts(profile_id: str, profiler: cProfile.Profile, torch_profile, meta: dict):
+    path = os.path.join(settings.PROFILE_DIR, profile_id)
+    os.makedirs(path, exist_ok=True)
+
+    # Binary pstats for snakeviz/gprof2dot plus a readable summary
+    profiler.dump_stats(os.path.join(path, "cprofile.prof"))
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(50)
+    with open(os.path.join(path, "cprofile.txt"), "w") as f:
+        f.write(summary.getvalue())
+
+    if torch_profile is not None:
+        with open(os.path.join(path, "torch_ops.txt"), "w") as f:
+            f.write(torch_profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+        torch_profile.export_chrome_trace(os.path.join(path, "torch_trace.json"))
+
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+async def profiling_middleware(request: Request, call_next):
+    reason = _should_profile(request)
+    if reason is None or not _profile_lock.acquire(blocking=False):
+        return await call_next(request)
+
+    profile_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{secrets.token_hex(4)}"
+    profiler = cProfile.Profile()
+    torch_profile = _torch_profiler()
+    token = _profiling.set(True)
+    started = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            if torch_profile is not None:
+                stack.enter_context(torch_profile)
+            profiler.enable()
+            try:
+                response = await call_next(request)
+            finally:
+                profiler.disable()
+
+        _write_artifacts(profile_id, profiler, torch_profile, {
+            "profile_id": profile_id,
+            "reason": reason,
+            "method": request.method,
+            "path": request.url.path,
+            "status_code": response.status_code,
+            "duration_seconds": time.perf_counter() - started,
+            "created_at": datetime.utcnow().isoformat(),
+        })
+    finally:
+        _profiling.reset(token)
+        _profile_lock.release()
+
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+def list_profiles():
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    profiles = []
+    for profile_id in sorted(os.listdir(settings.PROFILE_DIR), reverse=True):
+        meta_path = os.path.join(settings.PROFILE_DIR, profile_id, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            meta["artifacts"] = sorted(os.listdir(os.path.join(settings.PROFILE_DIR, profile_id)))
+            profiles.append(meta)
+    return profiles
@@ -0,0 +1,180 @@
+"""Size limits for uploads and documents, and the process memory budget
+
+Uploads are read in chunks and rejected once they pass MAX_FILE_SIZE, and
+DOCX files are checked before python-docx parses them: the XML parts it
+builds a DOM from may not inflate beyond MAX_DOCX_XML_SIZE, and documents
+with more than MAX_PARAGRAPHS paragraphs or MAX_CLAUSES clauses are not
+analyzed. Oversized input raises ResourceLimitExceeded (413).
+
+The memory budget is MEMORY_BUDGET_MB per process, measured as its PSS so
+model weights shared copy-on-write with the other workers count once in
+total rather than once per worker. Unset, it is the container's cgroup
+memory limit, measured against the cgroup's working set: what every process
+in the container uses, without page cache the kernel can drop. Above
+MEMORY_HIGH_WATERMARK of the budget, requests that start memory-hungry work
+fail fast with MemoryPressure (503 with Retry-After) and the batch scheduler
+holds its queue until memory drops, instead of the worker being OOM-killed
+mid-analysis.
+"""
+from functools import lru_cache
+from typing import BinaryIO, Optional, Tuple
+import asyncio
+import io
+import os
+import time
+import zipfile
+from .config import settings
+from .metrics import LIMITS_EXCEEDED, MEMORY_BACKPRESSURE_SECONDS
+
+_CHUNK_SIZE = 1024 * 1024
+# Limit, usage and stats files of cgroup v2 and v1, with the stat of page cache the kernel can drop
+_CGROUP_MEMORY = [
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.stat", "inactive_file"),
+    (
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+        "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        "/sys/fs/cgroup/memory/memory.stat",
+        "total_inactive_file",
+    ),
+]
+
+class ResourceLimitExceeded(Exception):
+    """An upload or document is larger than the configured limits"""
+
+class MemoryPressure(Exception):
+    """The process is near its memory budget, the request can be retried later"""
+
+def limit_exceeded(limit: str, message: str) -> ResourceLimitExceeded:
+    LIMITS_EXCEEDED.labels(limit).inc()
+    return ResourceLimitExceeded(message)
+
+def read_limited(stream: BinaryIO, name: str, limit: int = None) -> bytes:
+    """Read a file, giving up as soon as it is larger than limit (MAX_FILE_SIZE)"""
+    limit = limit or settings.MAX_FILE_SIZE
+    chunks, size = [], 0
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise limit_exceeded("file_size", f"{name} exceeds the maximum file size of {limit} bytes")
+        chunks.append(chunk)
+
+def check_docx(content: bytes):
+    """Reject a DOCX whose XML would inflate beyond MAX_DOCX_XML_SIZE, before parsing it
+
+    Declared sizes can be trusted: zipfile stops reading an entry at its
+    declared size and fails its CRC check if there is more.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(content))
+    except zipfile.BadZipFile:
+        return  # Not a DOCX at all, python-docx reports it
+    xml_size = sum(
+        info.file_size for info in archive.infolist()
+        if info.filename.endswith((".xml", ".rels"))
+    )
+    if xml_size > settings.MAX_DOCX_XML_SIZE:
+        raise limit_exceeded("docx_xml_size", f"Document XML inflates to {xml_size} bytes, more than {settings.MAX_DOCX_XML_SIZE}")
+
+def check_count(limit: str, count: int, maximum: int):
+    """Reject a document with more than maximum paragraphs or clauses"""
+    if count > maximum:
+        raise limit_exceeded(limit, f"Document has {count} {limit}, at most {maximum} are analyzed")
+
+def current_rss() -> Optional[int]:
+    """Resident memory of this process in bytes, None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def current_pss() -> Optional[int]:
+    """Proportional set size of this process in bytes: pages shared with other processes count in part
+
+    Falls back to the resident size where smaps_rollup is not available.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return current_rss()
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+@lru_cache(maxsize=None)
+def _cgroup_files() -> Optional[Tuple[str, str, str, str]]:
+    """Memory files of the container's cgroup, None without a memory limit"""
+    for files in _CGROUP_MEMORY:
+        limit = _read_int(files[0])
+        # "max", or a huge number, means no limit
+        if limit is not None and limit < 1 << 60:
+            return files
+    return None
+
+def _cgroup_memory() -> Optional[Tuple[int, int]]:
+    """Working set and memory limit of the container's cgroup in bytes"""
+    files = _cgroup_files()
+    if files is None:
+        return None
+    limit_path, usage_path, stat_path, inactive_stat = files
+    limit, usage = _read_int(limit_path), _read_int(usage_path)
+    if limit is None or usage is None:
+        return None
+    inactive = 0
+    try:
+        with open(stat_path) as f:
+            for line in f:
+                name, _, value = line.partition(" ")
+                if name == inactive_stat:
+                    inactive = int(value)
+                    break
+    except (OSError, ValueError):
+        pass
+    return max(usage - inactive, 0), limit
+
+def memory_usage() -> Optional[Tuple[int, int]]:
+    """Memory in use and the budget it is held to in bytes, None when there is no budget"""
+    if settings.MEMORY_BUDGET_MB:
+        pss = current_pss()
+        return None if pss is None else (pss, settings.MEMORY_BUDGET_MB * 1024 * 1024)
+    return _cgroup_memory()
+
+def under_pressure() -> bool:
+    usage = memory_usage()
+    return usage is not None and usage[0] >= usage[1] * settings.MEMORY_HIGH_WATERMARK
+
+def check_memory():
+    """Raise MemoryPressure instead of starting memory-hungry work near the budget"""
+    if under_pressure():
+        LIMITS_EXCEEDED.labels("memory").inc()
+        raise MemoryPressure("Server is near its memory budget, retry later")
+
+async def wait_for_memory() -> bool:
+    """Wait up to MEMORY_BACKPRESSURE_MAX_WAIT for memory to drop below the watermark
+
+    Returns whether it did; the caller should then go on with as little
+    work at a time as it can.
+    """
+    if not under_pressure():
+        return True
+    started = time.perf_counter()
+    try:
+        while time.perf_counter() - started < settings.MEMORY_BACKPRESSURE_MAX_WAIT:
+            await asyncio.sleep(settings.MEMORY_BACKPRESSURE_POLL)
+            if not under_pressure():
+                return True
+        return False
+    finally:
+        MEMORY_BACKPRESSURE_SECONDS.inc(time.perf_counter() - started)
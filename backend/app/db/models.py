@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Enum, LargeBinary, Index, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -33,23 +33,45 @@ class Document(Base):
     redline_path = Column(String, nullable=True)
     clean_path = Column(String, nullable=True)
     status = Column(Enum(DocumentStatus), default=DocumentStatus.UPLOADED)
+    version = Column(Integer, nullable=False, default=0)  # Bumped by every write, see services/document_state.py
+    claimed_at = Column(DateTime, nullable=True)  # When the running analysis claimed it, set while ANALYZING
+    batch_id = Column(String, ForeignKey("batch_jobs.id"), nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     owner = relationship("User", back_populates="documents")
     analysis_results = relationship("AnalysisResult", back_populates="document")
     feedback_history = relationship("Feedback", back_populates="document")
+    
+    # Keyset pagination of a user's documents, newest first
+    __table_args__ = (Index("ix_documents_user_created", "user_id", "created_at", "id"),)
+    # ORM updates only apply if the row still has the version they read
+    __mapper_args__ = {"version_id_col": version}
+
+class BatchJob(Base):
+    __tablename__ = "batch_jobs"
+
+    id = Column(String, primary_key=True, index=True)  # UUID
+    total = Column(Integer)
+    completed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
 
 class AnalysisResult(Base):
     __tablename__ = "analysis_results"
+    # Keyset pagination of a document's results
+    __table_args__ = (Index("ix_analysis_results_document_id", "document_id", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(String, ForeignKey("documents.id"))
     clause_text = Column(Text)
     original_text = Column(Text)
     suggested_text = Column(Text, nullable=True)
+    label = Column(String, nullable=True)  # keep, modify, remove
     confidence_score = Column(Integer)  # 0-100
     validation_score = Column(Integer, nullable=True)  # 0-100
+    paragraph_hash = Column(String, nullable=True, index=True)  # Source paragraph, for reuse by near-duplicates
     created_at = Column(DateTime, default=datetime.utcnow)
     
     document = relationship("Document", back_populates="analysis_results")
@@ -59,7 +81,49 @@ class Feedback(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(String, ForeignKey("documents.id"))
+    analysis_result_id = Column(Integer, ForeignKey("analysis_results.id"), nullable=True)  # Clause the feedback refers to
     feedback_text = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    applied_at = Column(DateTime, nullable=True, index=True)  # None until a regeneration used it
     
-    document = relationship("Document", back_populates="feedback_history") 
\ No newline at end of file
+    document = relationship("Document", back_populates="feedback_history") 
+
+class TrainingExample(Base):
+    __tablename__ = "training_examples"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(String, ForeignKey("documents.id"))
+    analysis_result_id = Column(Integer, ForeignKey("analysis_results.id"), nullable=True)
+    source = Column(String)  # feedback, accepted, rejected, edited
+    original_text = Column(Text)
+    revised_text = Column(Text, nullable=True)
+    label = Column(String)  # keep, modify, remove
+    created_at = Column(DateTime, default=datetime.utcnow)
+    trained_at = Column(DateTime, nullable=True, index=True)  # None while buffered
+
+class DocumentFingerprint(Base):
+    __tablename__ = "document_fingerprints"
+
+    document_id = Column(String, ForeignKey("documents.id"), primary_key=True)
+    signature = Column(LargeBinary)  # MinHash signature as uint64 bytes
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class LshBucket(Base):
+    __tablename__ = "lsh_buckets"
+    __table_args__ = (Index("ix_lsh_buckets_band_bucket", "band", "bucket"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(String, ForeignKey("documents.id"), index=True)
+    band = Column(Integer)
+    bucket = Column(String)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("key", "operation", "document_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String)
+    operation = Column(String)  # analyze, regenerate, clean
+    document_id = Column(String, ForeignKey("documents.id"))
+    response = Column(JSON(none_as_null=True), nullable=True)  # None while the request is running
+    created_at = Column(DateTime, default=datetime.utcnow)
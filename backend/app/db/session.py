@@ -1,11 +1,17 @@
+import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from ..core.config import settings
+from ..core.metrics import instrument_engine
 
 engine = create_engine(settings.DATABASE_URL)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Forked workers open their own connections instead of sharing the parent's
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
 def get_db():
     db = SessionLocal()
     try:
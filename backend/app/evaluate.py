@@ -0,0 +1,58 @@
+"""Evaluate model quality and latency on a held-out set
+
+Runs the held-out documents and retrieval pairs through AIService in every
+inference mode of EVALUATION_MODES, or the modes given with --mode, and
+prints a JSON report of NER span F1, keep/modify/remove accuracy and F1,
+retrieval recall and latency and memory per mode (see
+services/evaluation.py for the dataset format).
+
+Usage: python -m app.evaluate --dataset heldout.jsonl --floor classification.macro_f1=0.8
+
+Exits with status 1 when a metric of any mode is below its floor, so a
+performance change can be gated on it in CI.
+"""
+import argparse
+import json
+import sys
+from .core.config import settings
+from .services.ai_service import get_ai_service
+from .services.evaluation import load_dataset, evaluate, check_floors
+
+def _pair(value: str):
+    name, _, rest = value.partition("=")
+    if not rest:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got {value!r}")
+    return name, rest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dataset", required=True, help="Held-out JSONL file")
+    parser.add_argument(
+        "--mode", type=_pair, action="append", default=[],
+        help='Inference mode as NAME=JSON settings overrides, e.g. cascade=\'{"CASCADE_ENABLED": true}\''
+    )
+    parser.add_argument(
+        "--floor", type=_pair, action="append", default=[],
+        help="Minimum value of a metric as PATH=VALUE, added to EVALUATION_FLOORS"
+    )
+    parser.add_argument("--top-k", type=int, default=5, help="k of retrieval recall@k")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    modes = {name: json.loads(values) for name, values in args.mode} or settings.EVALUATION_MODES
+    floors = {**settings.EVALUATION_FLOORS, **{path: float(value) for path, value in args.floor}}
+
+    report = evaluate(get_ai_service(), load_dataset(args.dataset), modes, args.top_k)
+    violations = check_floors(report, floors)
+    output = json.dumps({"modes": report, "floors": floors, "violations": violations}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    for violation in violations:
+        print(violation, file=sys.stderr)
+    return 1 if violations else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
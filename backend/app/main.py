@@ -1,36 +1,128 @@
-from fastapi import FastAPI, Depends, HTTPException
+from contextlib import asynccontextmanager
+import asyncio
+import time
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 from .db.session import get_db, engine
 from .db import models
 from .core.config import settings
-from .api.endpoints import documents, validation, feedback, training
+from .core.clients import BackendUnavailable
+from .core.resources import ResourceLimitExceeded, MemoryPressure, current_rss
+from .services.document_state import TransitionConflict, RequestInProgress
+from .core.metrics import HTTP_LATENCY, REQUEST_MEMORY_GROWTH, render_metrics, setup_tracing
+from .core.profiling import profiling_middleware
+from .api import deps
+from .api.endpoints import documents, validation, feedback, training, admin
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables
+    models.Base.metadata.create_all(bind=engine)
+    
+    # Load services and models now, in the background, or on first use
+    if settings.WARMUP == "blocking":
+        await asyncio.to_thread(deps.warm_up)
+    elif settings.WARMUP == "background":
+        deps.start_warm_up()
+    yield
+    
+    # Only serving processes run the lifespan, so the pre-fork master never
+    # overwrites the index its worker wrote
+    await asyncio.to_thread(deps.shutdown)
 
-app = FastAPI(
-    title="NDA Validator API",
-    description="API for validating and analyzing NDA documents",
-    version="1.0.0"
-)
+def create_app() -> FastAPI:
+    """Build the API; nothing heavy is imported or loaded until startup"""
+    app = FastAPI(
+        title="NDA Validator API",
+        description="API for validating and analyzing NDA documents",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+    
+    # Configure CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # In production, replace with specific origins
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    setup_tracing()
+    
+    @app.middleware("http")
+    async def record_request_latency(request: Request, call_next):
+        started = time.perf_counter()
+        rss_before = current_rss()
+        response = await call_next(request)
+        # Label by route template so per-document URLs share one series
+        route = request.scope.get("route")
+        route = route.path if route is not None else "unmatched"
+        HTTP_LATENCY.labels(
+            request.method,
+            route,
+            response.status_code
+        ).observe(time.perf_counter() - started)
+        rss_after = current_rss()
+        if rss_before is not None and rss_after is not None:
+            REQUEST_MEMORY_GROWTH.labels(route).observe(max(rss_after - rss_before, 0))
+        return response
+    
+    # Registered last so it wraps everything else, including the latency middleware
+    app.middleware("http")(profiling_middleware)
+    
+    # A backend behind an open circuit breaker is a temporary condition
+    @app.exception_handler(BackendUnavailable)
+    async def backend_unavailable(request: Request, exc: BackendUnavailable):
+        return JSONResponse({"detail": str(exc)}, status_code=503)
+    
+    # Oversized uploads, and work held back near the memory budget
+    @app.exception_handler(ResourceLimitExceeded)
+    async def resource_limit_exceeded(request: Request, exc: ResourceLimitExceeded):
+        return JSONResponse({"detail": str(exc)}, status_code=413)
+    
+    @app.exception_handler(MemoryPressure)
+    async def memory_pressure(request: Request, exc: MemoryPressure):
+        return JSONResponse(
+            {"detail": str(exc)},
+            status_code=503,
+            headers={"Retry-After": str(settings.MEMORY_RETRY_AFTER)}
+        )
+    
+    # Lost races on a document's status, or a retry of a running request
+    @app.exception_handler(TransitionConflict)
+    @app.exception_handler(RequestInProgress)
+    @app.exception_handler(StaleDataError)
+    async def conflict(request: Request, exc: Exception):
+        return JSONResponse({"detail": str(exc)}, status_code=409)
+    
+    # Health check endpoint, up as soon as the process serves requests
+    @app.get("/health")
+    async def health_check():
+        return {"status": "healthy"}
+    
+    # Readiness endpoint, 503 until every WARMUP_COMPONENTS entry is loaded
+    @app.get("/ready")
+    async def readiness_check():
+        readiness = deps.readiness()
+        return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+    
+    # Prometheus metrics endpoint
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+    
+    # Include routers
+    app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
+    app.include_router(validation.router, prefix="/api/validation", tags=["validation"])
+    app.include_router(feedback.router, prefix="/api/feedback", tags=["feedback"])
+    app.include_router(training.router, prefix="/api/training", tags=["training"])
+    app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
+    
+    return app
 
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, replace with specific origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Health check endpoint
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
-
-# Import and include routers
-app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
-app.include_router(validation.router, prefix="/api/validation", tags=["validation"])
-app.include_router(feedback.router, prefix="/api/feedback", tags=["feedback"])
-app.include_router(training.router, prefix="/api/training", tags=["training"]) 
\ No newline at end of file
+app = create_app()
@@ -0,0 +1,54 @@
+"""Offline job reducing the dimension of the stored embeddings
+
+Fits a PCA projection on the clause vectors, re-indexes every vector
+collection into reduced copies and publishes the projection as a new
+version of the "embedding-projection" model (see
+services/embedding_reduction.py). Prints recall@k of the reduced clause
+index against the full-size one, query latency of both and the size of the
+stored vectors.
+
+Usage: python -m app.reduce_embeddings --dims 128 [--activate]
+
+Without --activate, check the report and activate the version later with
+POST /api/training/models/embedding-projection/activate/{version}. Workers
+serve the new version after a restart.
+"""
+import argparse
+import json
+import sys
+from .services.embedding_reduction import reduce_embeddings
+from .services.vector_backends import get_backend
+from .services.vector_storage import COLLECTIONS, CLAUSES
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dims", type=int, default=128, help="Dimensions to keep")
+    parser.add_argument("--sample", type=int, default=20000, help="Clause vectors the projection is fitted on")
+    parser.add_argument("--queries", type=int, default=200, help="Clause vectors used as recall queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--activate", action="store_true", help="Serve the new projection right away")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    backend = get_backend()
+    backend.setup(COLLECTIONS)
+    report = reduce_embeddings(
+        backend,
+        COLLECTIONS,
+        CLAUSES,
+        args.dims,
+        sample=args.sample,
+        queries=args.queries,
+        top_k=args.top_k,
+        activate=args.activate
+    )
+
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    sys.exit(main())
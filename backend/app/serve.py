@@ -0,0 +1,113 @@
+"""Pre-fork server for running several API workers on shared models
+
+The master process imports the app and loads every model once, then
+forks the workers. Model weights are never written after loading, so the
+workers share those pages copy-on-write with the master instead of each
+loading its own copy.
+
+Usage: python -m app.serve --workers 4 --port 8000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import torch
+import uvicorn
+from .core.config import settings
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def _run_worker(app, sock: socket.socket, threads: int):
+    """Serve requests from the shared listening socket in a forked worker"""
+    # Each worker gets its own slice of the cores instead of every worker
+    # spawning one intra-op thread per core and oversubscribing the machine
+    torch.set_num_threads(threads)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    config = uvicorn.Config(app, log_level="info", timeout_keep_alive=5)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+def _fork_worker(app, sock: socket.socket, threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(app, sock, threads)
+        finally:
+            os._exit(0)
+    return pid
+
+def serve(host: str, port: int, workers: int, threads_per_worker: int):
+    # Keep the master single-threaded while loading so no OpenMP pool
+    # exists yet when we fork
+    torch.set_num_threads(1)
+
+    # Load the models into the master process; the workers' own warm-up
+    # then finds them already loaded
+    from .main import app
+    from .api import deps
+    deps.warm_up()
+
+    # Move everything allocated so far out of the collector's reach; otherwise
+    # the first collection in each worker touches every object header and
+    # un-shares the pages holding them
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind_socket(host, port)
+    children = {_fork_worker(app, sock, threads_per_worker) for _ in range(workers)}
+    print(f"Serving on {host}:{port} with {workers} workers x {threads_per_worker} threads")
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+
+    # Supervise: restart workers that die unexpectedly
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting")
+            time.sleep(1)
+            children.add(_fork_worker(app, sock, threads_per_worker))
+
+    sock.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.SERVE_WORKERS)
+    parser.add_argument("--threads-per-worker", type=int, default=settings.TORCH_THREADS_PER_WORKER)
+    args = parser.parse_args(argv)
+
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    serve(args.host, args.port, args.workers, threads)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple
+import time
 import torch
 from transformers import (
     AutoTokenizer,
@@ -9,63 +11,232 @@ from transformers import (
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from ..core.config import settings
+from ..core.resources import check_count
+from ..core.metrics import tracked, CASCADE_CLAUSES, CLAUSES_PROCESSED, SUGGESTIONS, TOKENS_GENERATED
+from .model_store import ModelStore, map_weights
+from .docx_processing import create_redline, accept_all_changes
+from .clause_normalization import normalize_clauses
+from .clause_alignment import adapt_rewrite
 
 class AIService:
     def __init__(self):
         # Initialize models
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Trained versions from the model store take precedence over the base checkpoints
+        self.model_store = ModelStore()
         
         # Text classification model for clause analysis
-        self.classifier_tokenizer = AutoTokenizer.from_pretrained("nlpaueb/legal-bert-base-uncased")
-        self.classifier_model = AutoModelForSequenceClassification.from_pretrained(
-            "nlpaueb/legal-bert-base-uncased",
+        classifier_path = self.model_store.resolve("classifier", "nlpaueb/legal-bert-base-uncased")
+        self.classifier_tokenizer = AutoTokenizer.from_pretrained(classifier_path)
+        self.classifier_model = map_weights(AutoModelForSequenceClassification.from_pretrained(
+            classifier_path,
             num_labels=3  # [keep, modify, remove]
-        ).to(self.device)
+        ).to(self.device), classifier_path)
         
         # Named Entity Recognition for clause extraction
-        self.ner_tokenizer = AutoTokenizer.from_pretrained("nlpaueb/legal-bert-base-uncased")
-        self.ner_model = AutoModelForTokenClassification.from_pretrained(
-            "nlpaueb/legal-bert-base-uncased",
+        ner_path = self.model_store.resolve("ner", "nlpaueb/legal-bert-base-uncased")
+        self.ner_tokenizer = AutoTokenizer.from_pretrained(ner_path)
+        self.ner_model = map_weights(AutoModelForTokenClassification.from_pretrained(
+            ner_path,
             num_labels=5  # [O, B-CLAUSE, I-CLAUSE, B-SECTION, I-SECTION]
-        ).to(self.device)
+        ).to(self.device), ner_path)
         
         # Sentence transformer for semantic similarity
-        self.sentence_transformer = SentenceTransformer('all-MiniLM-L6-v2').to(self.device)
+        sentence_transformer_path = self.model_store.resolve("sentence_transformer", "all-MiniLM-L6-v2")
+        self.sentence_transformer = SentenceTransformer(sentence_transformer_path).to(self.device)
+        map_weights(self.sentence_transformer[0].auto_model, sentence_transformer_path)
         
         # Text generation pipeline for suggestions
         self.text_generator = pipeline(
             "text-generation",
-            model="gpt2",  # Using GPT-2 as base model
+            model=self.model_store.resolve("generator", "gpt2"),  # Using GPT-2 as base model
             device=0 if self.device == "cuda" else -1
         )
+        
+        # Seconds each model took on its first run, filled by warm_up()
+        self.warm_up_seconds: Dict[str, float] = {}
+
+    def warm_up(self):
+        """Run every model once so the first request does not pay for lazy initialization"""
+        sample = "The Recipient shall keep the Confidential Information strictly confidential."
+        for name, run in [
+            ("ner", lambda: self._extract_clauses(sample)),
+            ("classifier", lambda: self._classify_clause(sample)),
+            ("sentence_transformer", lambda: self.sentence_transformer.encode([sample])),
+            ("generator", lambda: self.text_generator(sample, max_new_tokens=1)),
+        ]:
+            started = time.perf_counter()
+            with torch.no_grad():
+                run()
+            self.warm_up_seconds[name] = round(time.perf_counter() - started, 3)
 
+    @tracked("ai")
     async def analyze_document(self, content: str) -> List[Dict[str, Any]]:
         """Analyze document content and generate suggestions"""
+        return (await self.analyze_documents([content]))[0]
+
+    @tracked("ai")
+    async def analyze_documents(self, contents: List[str]) -> List[List[Dict[str, Any]]]:
+        """Analyze several documents, classifying their clauses in shared batches
+        
+        With CASCADE_ENABLED, clauses close enough to an approved clause are
+        kept without running the classifier, and suggestions are only
+        generated for clauses classified as modify with at least
+        CASCADE_MODIFY_THRESHOLD confidence.
+        """
         # Extract clauses using NER
-        clauses = self._extract_clauses(content)
+        document_clauses, clauses, representatives = [], [], []
+        for content in contents:
+            document, document_representatives = self._extract_clauses(content)
+            representatives.extend(len(clauses) + representative for representative in document_representatives)
+            clauses.extend(document)
+            document_clauses.append(document)
+        analyzed = [index for index, representative in enumerate(representatives) if representative == index]
         
-        analysis_results = []
-        for clause in clauses:
-            # Analyze clause
-            classification = self._classify_clause(clause)
+        # First tier: clauses reviewers already approved as they are
+        results = [None] * len(clauses)
+        if settings.CASCADE_ENABLED and analyzed:
+            from .vector_storage import get_vector_storage
+            scores = get_vector_storage().match_approved_clauses([clauses[index] for index in analyzed])
+            for index, score in zip(analyzed, scores):
+                if score >= settings.CASCADE_APPROVED_THRESHOLD:
+                    CASCADE_CLAUSES.labels("approved_match").inc()
+                    CLAUSES_PROCESSED.labels("keep").inc()
+                    results[index] = {
+                        "clause_text": clauses[index],
+                        "original_text": clauses[index],
+                        "suggested_text": clauses[index],
+                        "confidence_score": int(score * 100),
+                        "label": "keep"
+                    }
+        
+        # Analyze remaining clauses
+        escalated = [index for index in analyzed if results[index] is None]
+        if settings.CASCADE_ENABLED:
+            CASCADE_CLAUSES.labels("classifier").inc(len(escalated))
+        classifications = self._classify_clauses([clauses[index] for index in escalated])
+        for index, classification in zip(escalated, classifications):
+            clause = clauses[index]
+            CLAUSES_PROCESSED.labels(classification["label"]).inc()
             
-            if classification["label"] == "modify":
-                # Generate suggestion
-                suggested_text = self._generate_suggestion(clause)
+            if classification["label"] == "modify" and (
+                not settings.CASCADE_ENABLED or classification["score"] >= settings.CASCADE_MODIFY_THRESHOLD
+            ):
+                # Suggested below, all together
+                suggested_text = None
+                confidence_score = classification["score"]
+            elif classification["label"] == "modify":
+                # Unconfirmed modification: flagged, but not worth a generation
+                suggested_text = clause
                 confidence_score = classification["score"]
             else:
                 suggested_text = clause
                 confidence_score = 100 if classification["label"] == "keep" else 0
             
-            analysis_results.append({
+            results[index] = {
                 "clause_text": clause,
                 "original_text": clause,
                 "suggested_text": suggested_text,
-                "confidence_score": int(confidence_score * 100)
-            })
+                "confidence_score": int(confidence_score * 100),
+                "label": classification["label"]
+            }
+        
+        # Retrieve or generate suggestions
+        pending = [index for index in analyzed if results[index]["suggested_text"] is None]
+        for index, suggested_text in zip(pending, self._suggest([clauses[index] for index in pending])):
+            results[index]["suggested_text"] = suggested_text
         
+        # Duplicates share the analysis of the clause they duplicate, with its
+        # suggestion adapted to their own words or, where that fails, one of their own
+        duplicates = [index for index, representative in enumerate(representatives) if representative != index]
+        for index in duplicates:
+            shared = results[representatives[index]]
+            suggested_text = clauses[index]
+            if shared["suggested_text"] != shared["original_text"]:
+                suggested_text = adapt_rewrite(shared["original_text"], shared["suggested_text"], clauses[index])
+            results[index] = {
+                **shared,
+                "clause_text": clauses[index],
+                "original_text": clauses[index],
+                "suggested_text": suggested_text
+            }
+        pending = [index for index in duplicates if results[index]["suggested_text"] is None]
+        for index, suggested_text in zip(pending, self._suggest([clauses[index] for index in pending])):
+            results[index]["suggested_text"] = suggested_text
+        
+        # Split the results back up by document
+        analysis_results, start = [], 0
+        for document in document_clauses:
+            analysis_results.append(results[start:start + len(document)])
+            start += len(document)
         return analysis_results
 
+    def _suggest(self, clauses: List[str]) -> List[str]:
+        """Suggestions for clauses classified as modify
+        
+        With SUGGESTION_MODE=retrieval, a clause at least
+        REWRITE_MATCH_THRESHOLD similar to the original of an accepted
+        rewrite gets that rewrite, adapted by adapt_rewrite() to the words
+        that differ between the two originals. Other clauses are generated.
+        """
+        matches = [None] * len(clauses)
+        if settings.SUGGESTION_MODE == "retrieval" and clauses:
+            from .vector_storage import get_vector_storage
+            matches = get_vector_storage().find_accepted_rewrites(clauses)
+        
+        suggestions = []
+        for clause, match in zip(clauses, matches):
+            suggested_text = None
+            if match is not None and match["score"] >= settings.REWRITE_MATCH_THRESHOLD:
+                suggested_text = adapt_rewrite(match["original"], match["rewrite"], clause)
+            if suggested_text is not None:
+                SUGGESTIONS.labels("retrieved").inc()
+            else:
+                SUGGESTIONS.labels("generated").inc()
+                if settings.CASCADE_ENABLED:
+                    CASCADE_CLAUSES.labels("generator").inc()
+                suggested_text = self._generate_suggestion(clause)
+            suggestions.append(suggested_text)
+        return suggestions
+
+    @tracked("ai")
+    async def regenerate_clauses(self, clauses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Re-score and re-generate suggestions for clauses that received feedback
+
+        Each clause dict has the "original_text" and the "feedback" texts to
+        take into account; the result carries the new "suggested_text",
+        "confidence_score" and "label" of each clause in order.
+        """
+        results = []
+        for clause in clauses:
+            classification = self._classify_clause(clause["original_text"])
+            CLAUSES_PROCESSED.labels(classification["label"]).inc()
+            # Feedback asks for a change, so a suggestion is generated even for clauses classified as keep
+            results.append({
+                "suggested_text": self._generate_suggestion(clause["original_text"], clause["feedback"]),
+                "confidence_score": int(classification["score"] * 100),
+                "label": classification["label"]
+            })
+        return results
+
+    @tracked("ai")
+    def match_feedback(self, feedback_texts: List[str], clause_texts: List[str]) -> List[List[int]]:
+        """Indices of the clauses each feedback text is about
+
+        A clause matches when its similarity to the feedback reaches
+        REGENERATE_MATCH_THRESHOLD; feedback matching no clause that closely
+        is attributed to its most similar clause.
+        """
+        if not feedback_texts or not clause_texts:
+            return [[] for _ in feedback_texts]
+        embeddings = self.sentence_transformer.encode(feedback_texts + clause_texts, normalize_embeddings=True)
+        similarities = embeddings[:len(feedback_texts)] @ embeddings[len(feedback_texts):].T
+        return [
+            np.flatnonzero(row >= settings.REGENERATE_MATCH_THRESHOLD).tolist() or [int(np.argmax(row))]
+            for row in similarities
+        ]
+
+    @tracked("ai")
     async def validate_clause(
         self,
         clause_text: str,
@@ -74,7 +245,12 @@ class AIService:
     ) -> Dict[str, Any]:
         """Validate a clause and its suggestion"""
         # Compare with similar clauses
-        similar_texts = [c["metadata"]["text"] for c in similar_clauses]
+        similar_texts = [c["metadata"]["text"] for c in similar_clauses if "text" in c["metadata"]]
+        if not similar_texts:
+            return {
+                "validation_score": None,
+                "validation_notes": "No similar clauses in the database to validate against"
+            }
         similarity_scores = self._calculate_similarity(suggested_text, similar_texts)
         
         # Calculate validation score based on similarity and confidence
@@ -86,77 +262,119 @@ class AIService:
             "validation_notes": "Validated against similar clauses in the database"
         }
 
+    @tracked("ai")
     async def create_redline_document(
         self,
-        content: str,
+        content: bytes,
         analysis_results: List[Dict[str, Any]]
-    ) -> str:
+    ) -> bytes:
         """Create a redline version of the document with suggested changes"""
-        # Implementation for creating redline document
-        # This would use python-docx to create a document with tracked changes
-        return content  # Placeholder
+        return create_redline(content, analysis_results)
+
+    @tracked("ai")
+    async def create_clean_document(self, redline_content: bytes) -> bytes:
+        """Create a clean version of the document by accepting all suggested changes"""
+        return accept_all_changes(redline_content)
 
-    def _extract_clauses(self, text: str) -> List[str]:
-        """Extract clauses from text using NER"""
-        inputs = self.ner_tokenizer(
+    @tracked("ai")
+    def _extract_clauses(self, text: str) -> Tuple[List[str], List[int]]:
+        """Extract clauses from text using NER
+        
+        Text longer than the model's 512 tokens is covered by overlapping
+        windows run as one batch. Clause spans are taken from the token
+        character offsets and cleaned up by normalize_clauses(), which also
+        returns the clause each clause shares its analysis with.
+        """
+        encoding = self.ner_tokenizer(
             text,
             return_tensors="pt",
             truncation=True,
-            max_length=512
-        ).to(self.device)
-        
-        outputs = self.ner_model(**inputs)
-        predictions = torch.argmax(outputs.logits, dim=2)
-        
-        # Process predictions to extract clauses
-        clauses = []
-        current_clause = []
+            max_length=512,
+            stride=settings.NER_WINDOW_STRIDE,
+            return_overflowing_tokens=True,
+            return_offsets_mapping=True,
+            padding=True
+        )
+        offsets = encoding.pop("offset_mapping").tolist()
+        encoding.pop("overflow_to_sample_mapping", None)
         
-        for token, pred in zip(self.ner_tokenizer.tokenize(text), predictions[0]):
-            if pred.item() in [1, 2]:  # B-CLAUSE or I-CLAUSE
-                current_clause.append(token)
-            elif current_clause:
-                clauses.append(" ".join(current_clause))
-                current_clause = []
+        predictions = []
+        for start in range(0, len(offsets), settings.CLASSIFY_BATCH_SIZE):
+            window = {key: value[start:start + settings.CLASSIFY_BATCH_SIZE].to(self.device) for key, value in encoding.items()}
+            with torch.no_grad():
+                outputs = self.ner_model(**window)
+            predictions.extend(torch.argmax(outputs.logits, dim=2).tolist())
         
-        if current_clause:
-            clauses.append(" ".join(current_clause))
+        # Character spans of consecutive B-CLAUSE/I-CLAUSE tokens
+        spans = []
+        for window_predictions, window_offsets in zip(predictions, offsets):
+            current = None
+            for pred, (char_start, char_end) in zip(window_predictions, window_offsets):
+                # Special and padding tokens have empty offsets and end a clause
+                inside = char_start != char_end and pred in [1, 2]
+                if current is not None and (not inside or pred == 1):
+                    spans.append(current)
+                    current = None
+                if inside:
+                    current = (char_start, char_end) if current is None else (current[0], char_end)
+            if current is not None:
+                spans.append(current)
         
-        return clauses
+        clauses, representatives = normalize_clauses(text, spans, self._count_tokens)
+        check_count("clauses", len(clauses), settings.MAX_CLAUSES)
+        return clauses, representatives
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self.classifier_tokenizer.tokenize(text))
 
+    @tracked("ai")
     def _classify_clause(self, clause: str) -> Dict[str, Any]:
         """Classify a clause as keep, modify, or remove"""
-        inputs = self.classifier_tokenizer(
-            clause,
-            return_tensors="pt",
-            truncation=True,
-            max_length=512
-        ).to(self.device)
-        
-        outputs = self.classifier_model(**inputs)
-        probabilities = torch.softmax(outputs.logits, dim=1)[0]
-        
+        return self._classify_clauses([clause])[0]
+
+    @tracked("ai")
+    def _classify_clauses(self, clauses: List[str]) -> List[Dict[str, Any]]:
+        """Classify clauses in padded batches of CLASSIFY_BATCH_SIZE"""
         label_map = {0: "keep", 1: "modify", 2: "remove"}
-        label_id = torch.argmax(probabilities).item()
-        
-        return {
-            "label": label_map[label_id],
-            "score": probabilities[label_id].item()
-        }
+        classifications = []
+        for start in range(0, len(clauses), settings.CLASSIFY_BATCH_SIZE):
+            inputs = self.classifier_tokenizer(
+                clauses[start:start + settings.CLASSIFY_BATCH_SIZE],
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=512
+            ).to(self.device)
+            
+            with torch.no_grad():
+                outputs = self.classifier_model(**inputs)
+            probabilities = torch.softmax(outputs.logits, dim=1)
+            scores, label_ids = probabilities.max(dim=1)
+            
+            classifications.extend(
+                {"label": label_map[label_id], "score": score}
+                for label_id, score in zip(label_ids.tolist(), scores.tolist())
+            )
+        return classifications
 
-    def _generate_suggestion(self, clause: str) -> str:
-        """Generate a suggested modification for a clause"""
+    @tracked("ai")
+    def _generate_suggestion(self, clause: str, feedback: List[str] = ()) -> str:
+        """Generate a suggested modification for a clause, following reviewer feedback when given"""
         # Use the text generation pipeline to generate suggestions
-        prompt = f"Improve this legal clause: {clause}\nImproved version:"
+        prompt = "".join(f"Reviewer feedback: {text}\n" for text in feedback)
+        prompt += f"Improve this legal clause: {clause}\nImproved version:"
         generated = self.text_generator(
             prompt,
-            max_length=len(clause.split()) + 20,
+            max_new_tokens=len(clause.split()) + 20,  # Feedback lengthens the prompt
             num_return_sequences=1,
             temperature=0.7
         )
         
-        return generated[0]["generated_text"].split("Improved version:")[1].strip()
+        suggestion = generated[0]["generated_text"].split("Improved version:")[1].strip()
+        TOKENS_GENERATED.inc(len(self.text_generator.tokenizer.encode(suggestion)))
+        return suggestion
 
+    @tracked("ai")
     def _calculate_similarity(self, text: str, texts: List[str]) -> List[float]:
         """Calculate semantic similarity between texts"""
         embeddings = self.sentence_transformer.encode([text] + texts)
@@ -170,4 +388,9 @@ class AIService:
             )
             similarities.append(float(similarity))
         
-        return similarities 
\ No newline at end of file
+        return similarities 
+
+@lru_cache(maxsize=None)
+def get_ai_service() -> AIService:
+    """Process-wide AIService shared by all routers"""
+    return AIService()
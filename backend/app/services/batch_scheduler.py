@@ -0,0 +1,203 @@
+"""Scheduler for bulk document analysis
+
+Documents submitted by the batch intake endpoint are queued in the process
+that accepted them and analyzed in steps of up to BATCH_DOCUMENTS_PER_STEP
+documents. Within a step, fetching and parsing the documents and saving
+their results and redlines run on threads, at most BATCH_IO_CONCURRENCY at a
+time, while the clauses of all documents in the step go through the models
+together so the classifier sees full batches. Model work also runs on a
+thread so the event loop keeps serving requests, e.g. batch progress. The
+services are imported on first use so the scheduler stays cheap to import.
+
+When the process is near its memory budget (see core/resources.py) the
+runner waits for memory to drop before each step, and goes on one document
+at a time if it does not.
+
+The queue is not persisted: documents of a batch still UPLOADED after a
+restart can be analyzed individually.
+"""
+from functools import lru_cache
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
+from ..core.config import settings
+from ..core.metrics import track, BATCH_DOCUMENTS
+from ..core.resources import wait_for_memory
+from ..db.session import SessionLocal
+from ..db.models import AnalysisResult, BatchJob, Document, DocumentStatus
+from .docx_processing import extract_paragraphs, create_redline
+from .document_state import release_claim, transition
+from .fingerprinting import find_near_duplicate, split_reusable, paragraph_of
+
+class BatchScheduler:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._io_slots: Optional[asyncio.Semaphore] = None
+
+    def submit(self, document_ids: List[str]):
+        """Queue documents for analysis, starting the runner on first use"""
+        if self._runner is None or self._runner.done():
+            self._queue = asyncio.Queue()
+            self._io_slots = asyncio.Semaphore(settings.BATCH_IO_CONCURRENCY)
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+        for document_id in document_ids:
+            self._queue.put_nowait(document_id)
+
+    async def _run(self):
+        while True:
+            step = [await self._queue.get()]
+            # Near the memory budget, wait for memory to drop, then take one document at a time
+            step_size = settings.BATCH_DOCUMENTS_PER_STEP if await wait_for_memory() else 1
+            while len(step) < step_size and not self._queue.empty():
+                step.append(self._queue.get_nowait())
+            with track("batch", "step"):
+                await self._process(step)
+
+    async def _io(self, func, *args):
+        async with self._io_slots:
+            return await asyncio.to_thread(func, *args)
+
+    async def _process(self, document_ids: List[str]):
+        prepared = await asyncio.gather(*(self._io(_prepare, document_id) for document_id in document_ids))
+        prepared = [job for job in prepared if job is not None]
+        if prepared:
+            await self._analyze(prepared)
+
+    async def _analyze(self, prepared: List[Dict[str, Any]]):
+        # Clauses of every document in the step share the model batches
+        from .ai_service import get_ai_service
+        ai_service = get_ai_service()
+        try:
+            analyses = await asyncio.to_thread(
+                asyncio.run,
+                ai_service.analyze_documents(["\n".join(job["changed"]) for job in prepared])
+            )
+        except Exception:
+            if len(prepared) > 1:
+                # Analyze one by one so a document over the limits only fails itself
+                for job in prepared:
+                    await self._analyze([job])
+                return
+            await self._io(_fail, prepared[0]["document_id"], prepared[0]["version"])
+            return
+
+        for job, analysis in zip(prepared, analyses):
+            for result in analysis:
+                result["paragraph_hash"] = paragraph_of(result["clause_text"], job["paragraphs"])
+            job["results"] = job["reused"] + analysis
+        await asyncio.gather(*(self._io(_finish, job) for job in prepared))
+
+def _prepare(document_id: str) -> Optional[Dict[str, Any]]:
+    """Fetch and parse a document and find results it can reuse"""
+    from .document_storage import get_document_storage
+    db = SessionLocal()
+    version = None
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        transition(db, document, DocumentStatus.ANALYZING, allowed_from=[DocumentStatus.UPLOADED])
+        db.commit()
+        # The version of this scheduler's claim, only that claim is given back on failure
+        version = document.version
+
+        content = get_document_storage().get_document(document.original_path)
+        paragraphs = extract_paragraphs(content)
+        duplicate = find_near_duplicate(db, document_id) if settings.NEAR_DUPLICATE_DETECTION else None
+        if duplicate is not None:
+            reused, changed = split_reusable(db, paragraphs, duplicate[0])
+        else:
+            reused, changed = [], paragraphs
+        return {
+            "document_id": document_id,
+            "version": version,
+            "content": content,
+            "paragraphs": paragraphs,
+            "reused": reused,
+            "changed": changed
+        }
+    except Exception:
+        # Without a claim (e.g. another analysis holds the document) only the batch counts it
+        db.rollback()
+        _fail(document_id, version)
+        return None
+    finally:
+        db.close()
+
+def _finish(job: Dict[str, Any]):
+    """Store a document's results and redline"""
+    from .document_storage import get_document_storage
+    from .vector_storage import get_vector_storage
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == job["document_id"]).first()
+        results = job["results"]
+
+        db.add_all([
+            AnalysisResult(
+                document_id=document.id,
+                clause_text=result["clause_text"],
+                original_text=result["original_text"],
+                suggested_text=result["suggested_text"],
+                label=result["label"],
+                confidence_score=result["confidence_score"],
+                paragraph_hash=result["paragraph_hash"]
+            )
+            for result in results
+        ])
+
+        document.redline_path = get_document_storage().save_redline_document(
+            create_redline(job["content"], results), "user_1", document.id
+        )
+        transition(db, document, DocumentStatus.REDLINE_READY)
+        _count(db, document.batch_id, BatchJob.completed)
+        db.commit()
+        BATCH_DOCUMENTS.labels("completed").inc()
+    except Exception:
+        db.rollback()
+        _fail(job["document_id"], job["version"])
+        return
+    finally:
+        db.close()
+
+    # Index clauses only once the results are committed
+    try:
+        get_vector_storage().store_clause_embeddings([
+            {"text": result["original_text"], "label": result["label"]}
+            for result in results
+        ])
+    except Exception:
+        pass  # Counted in the stage error metric; a clause missing a reference is re-created on next use
+
+def _fail(document_id: str, version: Optional[int]):
+    """Count a document as failed in its batch, returning it to UPLOADED if this scheduler claimed it
+
+    version is the document's version right after the claim, None when the
+    claim did not happen. A document changed since then belongs to another
+    request and keeps its status.
+    """
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if document is None:
+            return
+        if version is not None:
+            release_claim(db, document, version, DocumentStatus.UPLOADED)
+        _count(db, document.batch_id, BatchJob.failed)
+        db.commit()
+        BATCH_DOCUMENTS.labels("failed").inc()
+    finally:
+        db.close()
+
+def _count(db, batch_id: Optional[str], column):
+    """Increment a batch counter in SQL so concurrent updates are not lost"""
+    if batch_id is None:
+        return
+    db.query(BatchJob).filter(BatchJob.id == batch_id).update({column: column + 1}, synchronize_session=False)
+    batch = db.query(BatchJob).filter(BatchJob.id == batch_id).first()
+    if batch.finished_at is None and batch.completed + batch.failed >= batch.total:
+        batch.finished_at = datetime.utcnow()
+
+@lru_cache(maxsize=None)
+def get_batch_scheduler() -> BatchScheduler:
+    """Process-wide BatchScheduler shared by all routers"""
+    return BatchScheduler()
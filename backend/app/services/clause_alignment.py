@@ -0,0 +1,164 @@
+from typing import List, Dict, Any, Optional, Tuple
+from difflib import SequenceMatcher
+import re
+
+# Clauses longer than this are split further at sentence boundaries
+MAX_CLAUSE_CHARS = 1000
+# Minimum similarity for a replaced clause to count as a modification of an
+# original clause rather than a removal followed by an unrelated insertion
+MODIFY_THRESHOLD = 0.5
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.;:])\s+(?=[A-Z(\d])")
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+def label_change(original: str, revised: str) -> str:
+    """Label how a clause changed between two versions"""
+    if original == revised:
+        return "keep"
+    if not revised:
+        return "remove"
+    return "modify"
+
+def adapt_rewrite(original: str, rewrite: str, clause: str) -> Optional[str]:
+    """Carry a rewrite of original over to a clause that differs from it by substituted words
+
+    Words the clause replaces in original (party names, amounts, periods)
+    are replaced the same way in the rewrite. Returns None when the clause
+    adds or drops words, since there is no telling where those would go, or
+    replaces the same words in two different ways.
+    """
+    original_words = list(_WORD.finditer(original))
+    clause_words = list(_WORD.finditer(clause))
+    matcher = SequenceMatcher(
+        None, [word.group() for word in original_words], [word.group() for word in clause_words], autojunk=False
+    )
+    substitutes = {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if tag != "replace":
+            return None
+        replaced = original[original_words[i1].start():original_words[i2 - 1].end()]
+        substitute = clause[clause_words[j1].start():clause_words[j2 - 1].end()]
+        if substitutes.setdefault(replaced, substitute) != substitute:
+            return None  # The same words became different ones, no single substitution fits
+    if not substitutes:
+        return rewrite
+    # One pass over all replaced words, so swapped terms (parties, periods) do
+    # not replace each other's substitutes; longer matches win, and whole
+    # words only, so replacing "a" leaves "damages" alone
+    pattern = "|".join(re.escape(replaced) for replaced in sorted(substitutes, key=len, reverse=True))
+    return re.sub(rf"(?<!\w)(?:{pattern})(?!\w)", lambda match: substitutes[match.group()], rewrite)
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+def split_clauses(text: str, max_chars: int = MAX_CLAUSE_CHARS) -> List[str]:
+    """Split document text into paragraph-level clauses"""
+    clauses = []
+    for paragraph in text.split("\n"):
+        paragraph = _WHITESPACE.sub(" ", paragraph).strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            clauses.append(paragraph)
+            continue
+
+        # Pack sentences of an overlong paragraph into chunks below max_chars
+        current = ""
+        for sentence in _SENTENCE_BOUNDARY.split(paragraph):
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                clauses.append(current)
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            clauses.append(current)
+    return clauses
+
+def _similarity(a: str, b: str) -> float:
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    # quick_ratio is an upper bound of ratio and much cheaper to compute
+    if matcher.quick_ratio() < MODIFY_THRESHOLD:
+        return 0.0
+    return matcher.ratio()
+
+def _pair_replaced(original: List[str], clean: List[str]) -> List[Tuple[int, int, float]]:
+    """Greedily pair clauses of a replaced block by similarity, keeping order"""
+    pairs = []
+    next_j = 0
+    for i, orig in enumerate(original):
+        best_j, best_score = None, MODIFY_THRESHOLD
+        for j in range(next_j, len(clean)):
+            score = _similarity(orig, clean[j])
+            if score >= best_score:
+                best_j, best_score = j, score
+        if best_j is not None:
+            pairs.append((i, best_j, best_score))
+            next_j = best_j + 1
+    return pairs
+
+def align_clauses(original_text: str, clean_text: str) -> List[Dict[str, Any]]:
+    """Align the clauses of an original document with its clean version
+
+    Returns one entry per original clause with the clause it became in the
+    clean version ("" if it was removed) and its keep/modify/remove label.
+    """
+    original = split_clauses(original_text)
+    clean = split_clauses(clean_text)
+    original_keys = [_normalize(c) for c in original]
+    clean_keys = [_normalize(c) for c in clean]
+
+    aligned = []
+    matcher = SequenceMatcher(None, original_keys, clean_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for offset in range(i2 - i1):
+                aligned.append({
+                    "original": original[i1 + offset],
+                    "clean": clean[j1 + offset],
+                    "label": "keep"
+                })
+        elif tag in ("replace", "delete"):
+            matches = {}
+            if tag == "replace":
+                for i, j, score in _pair_replaced(original_keys[i1:i2], clean_keys[j1:j2]):
+                    matches[i] = j
+            for i in range(i2 - i1):
+                if i in matches:
+                    aligned.append({
+                        "original": original[i1 + i],
+                        "clean": clean[j1 + matches[i]],
+                        "label": "modify"
+                    })
+                else:
+                    aligned.append({
+                        "original": original[i1 + i],
+                        "clean": "",
+                        "label": "remove"
+                    })
+        # Pure insertions have no original clause to learn from
+
+    return aligned
+
+def build_sentence_pairs(aligned: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Build similarity training pairs from aligned clauses of one document
+
+    Every modified clause yields a positive pair with its rewrite and a hard
+    negative with a neighbouring clause of the same clean document, which
+    shares the document's vocabulary but not its meaning.
+    """
+    pairs = []
+    for index, item in enumerate(aligned):
+        if item["label"] != "modify":
+            continue
+        pairs.append({"texts": [item["original"], item["clean"]], "label": 1.0})
+
+        for neighbour in (index - 1, index + 1):
+            if 0 <= neighbour < len(aligned):
+                negative = aligned[neighbour]["clean"]
+                if negative and negative != item["clean"]:
+                    pairs.append({"texts": [item["original"], negative], "label": 0.0})
+                    break
+    return pairs
@@ -0,0 +1,128 @@
+"""Clause normalization between NER extraction and classification
+
+NER yields character spans of the document text. Before any clause reaches
+the classifier or the generator the spans are turned into clean clauses:
+
+- spans overlapping or touching each other, e.g. the same clause found in
+  two overlapping NER windows, are merged
+- text is cut from the document by character offsets, so clauses keep the
+  document's own spelling and spacing instead of WordPiece fragments
+- exact duplicates, clauses contained in another clause and near-duplicates
+  (similarity at least CLAUSE_DEDUP_THRESHOLD) are not analyzed on their
+  own but share the analysis of the clause they duplicate; duplicates with
+  exactly that clause's text are dropped, as the redline marks every
+  occurrence of a changed clause anyway
+- clauses shorter than CLAUSE_MIN_TOKENS are packed with the next clause of
+  the same paragraph, up to CLAUSE_MAX_TOKENS, as the span covering both so
+  the packed text still occurs in the document
+"""
+from typing import Callable, List, Optional, Tuple
+from bisect import bisect_right
+from difflib import SequenceMatcher
+import re
+from ..core.config import settings
+from ..core.metrics import CLAUSES_DROPPED
+
+_WORD = re.compile(r"\w")
+_WHITESPACE = re.compile(r"\s+")
+
+def _merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _trim(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Span without leading and trailing whitespace"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def _near_duplicate_of(clause: str, kept: List[str], threshold: float) -> Optional[int]:
+    """Index of the kept clause that contains or nearly equals clause, None if none does"""
+    for index, other in enumerate(kept):
+        if clause in other:
+            return index
+        matcher = SequenceMatcher(None, clause, other, autojunk=False)
+        # quick_ratio is an upper bound of ratio and much cheaper to compute
+        if matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold:
+            return index
+    return None
+
+def _pack(
+    text: str,
+    spans: List[Tuple[int, int]],
+    count_tokens: Callable[[str], int]
+) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """Packed spans, and the index of the packed span each span ended up in"""
+    packed, packed_into = [], []
+    for start, end in spans:
+        if packed:
+            previous_start, previous_end = packed[-1]
+            same_paragraph = "\n" not in text[previous_end:start]
+            if (
+                same_paragraph
+                and count_tokens(text[previous_start:previous_end]) < settings.CLAUSE_MIN_TOKENS
+                and count_tokens(text[previous_start:end]) <= settings.CLAUSE_MAX_TOKENS
+            ):
+                packed[-1] = (previous_start, end)
+                packed_into.append(len(packed) - 1)
+                CLAUSES_DROPPED.labels("packed").inc()
+                continue
+        packed_into.append(len(packed))
+        packed.append((start, end))
+    return packed, packed_into
+
+def normalize_clauses(
+    text: str,
+    spans: List[Tuple[int, int]],
+    count_tokens: Callable[[str], int]
+) -> Tuple[List[str], List[int]]:
+    """Clause texts for the character spans found by NER, in document order
+    
+    Also returns, for each clause, the index of the clause whose analysis it
+    shares: its own index for clauses to analyze, that of the clause it
+    duplicates for the others.
+    """
+    spans = [_trim(text, start, end) for start, end in _merge_spans(spans)]
+    spans = [(start, end) for start, end in spans if _WORD.search(text[start:end])]
+
+    kept_spans, kept_keys, seen, duplicates = [], [], {}, []
+    for start, end in spans:
+        key = _WHITESPACE.sub(" ", text[start:end]).lower()
+        if key in seen:
+            CLAUSES_DROPPED.labels("duplicate").inc()
+            duplicates.append((start, end, seen[key]))
+            continue
+        kept = _near_duplicate_of(key, kept_keys, settings.CLAUSE_DEDUP_THRESHOLD)
+        if kept is not None:
+            CLAUSES_DROPPED.labels("near_duplicate").inc()
+            duplicates.append((start, end, kept))
+            continue
+        seen[key] = len(kept_keys)
+        kept_keys.append(key)
+        kept_spans.append((start, end))
+
+    packed, packed_into = _pack(text, kept_spans, count_tokens)
+    # Entries are (start, end, index of the packed span analyzed for it)
+    entries = [(start, end, index) for index, (start, end) in enumerate(packed)]
+    starts = [start for start, _ in packed]
+    for start, end, kept in duplicates:
+        representative = packed_into[kept]
+        # Packing can grow a clause over a duplicate between the clauses it joins
+        containing = bisect_right(starts, start) - 1
+        inside = containing >= 0 and end <= packed[containing][1]
+        if not inside and text[start:end] != text[slice(*packed[representative])]:
+            entries.append((start, end, representative))
+
+    order = sorted(range(len(entries)), key=lambda entry: entries[entry][0])
+    position = {entry: index for index, entry in enumerate(order)}
+    return (
+        [text[entries[entry][0]:entries[entry][1]] for entry in order],
+        [position[entries[entry][2]] for entry in order]
+    )
@@ -0,0 +1,182 @@
+"""Document status transitions and idempotent requests
+
+Status changes go through transition(), a single compare-and-set UPDATE on
+the document's status and version, so of two requests racing to start the
+same work only one gets past it and the other gets a TransitionConflict.
+Expensive work (analysis, regeneration) first moves the document to
+ANALYZING and commits, which claims it for the duration of the run. On
+failure the run gives the claim back with release_claim(), which leaves
+the document alone if another request has taken it over since.
+
+Claims are leases: a process killed mid-run (OOM, deploy) never releases
+its claim, so a claim older than CLAIM_LEASE_SECONDS may be taken over by
+the next request that moves the document to ANALYZING.
+
+Clients may also send an Idempotency-Key with analyze, regenerate and
+clean. The first request with a key records it before doing any work;
+retries with the same key get the stored response once it has completed,
+or a RequestInProgress while it is still running. A failed request
+releases its key so it can be retried, and a key still running after
+CLAIM_LEASE_SECONDS is taken over by the next retry.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..core.config import settings
+from ..db.models import Document, DocumentStatus, IdempotencyKey
+
+# Allowed transitions, from status -> to statuses
+TRANSITIONS = {
+    DocumentStatus.UPLOADED: {DocumentStatus.ANALYZING},
+    # Analysis ends in a redline, or returns to where it started on failure
+    DocumentStatus.ANALYZING: {
+        DocumentStatus.REDLINE_READY,
+        DocumentStatus.UPLOADED,
+        DocumentStatus.FEEDBACK_RECEIVED,
+        DocumentStatus.COMPLETED
+    },
+    DocumentStatus.REDLINE_READY: {
+        DocumentStatus.ANALYZING,
+        DocumentStatus.FEEDBACK_RECEIVED,
+        DocumentStatus.COMPLETED
+    },
+    DocumentStatus.FEEDBACK_RECEIVED: {DocumentStatus.ANALYZING, DocumentStatus.COMPLETED},
+    DocumentStatus.CLEAN_READY: {DocumentStatus.COMPLETED},
+    DocumentStatus.COMPLETED: {DocumentStatus.ANALYZING, DocumentStatus.COMPLETED},
+}
+
+class TransitionConflict(Exception):
+    """The document is not in a status the transition can start from, or changed concurrently"""
+
+class RequestInProgress(Exception):
+    """A request with the same idempotency key is still running"""
+
+def _lease_expired(started_at: Optional[datetime]) -> bool:
+    return started_at is None or datetime.utcnow() - started_at > timedelta(seconds=settings.CLAIM_LEASE_SECONDS)
+
+def claim_expired(document: Document) -> bool:
+    """Whether the document is held by an analysis claim older than the lease"""
+    return document.status == DocumentStatus.ANALYZING and _lease_expired(document.claimed_at)
+
+def transition(
+    db: Session,
+    document: Document,
+    to: DocumentStatus,
+    allowed_from: Iterable[DocumentStatus] = None
+):
+    """Move a document to a status, if it still has the status and version it was read with
+
+    allowed_from narrows the statuses the move may start from; without it
+    any status with an edge to the target in TRANSITIONS will do. Moving to
+    ANALYZING also takes over an expired claim. The caller commits.
+    """
+    sources = set(allowed_from) if allowed_from is not None else {
+        status for status, targets in TRANSITIONS.items() if to in targets
+    }
+    takeover = to == DocumentStatus.ANALYZING and claim_expired(document)
+    if not takeover and (document.status not in sources or to not in TRANSITIONS[document.status]):
+        raise TransitionConflict(f"Document is {document.status.value}, it cannot become {to.value}")
+
+    updated = db.query(Document).filter(
+        Document.id == document.id,
+        Document.status == document.status,
+        Document.version == document.version
+    ).update(
+        {
+            Document.status: to,
+            Document.version: Document.version + 1,
+            Document.claimed_at: datetime.utcnow() if to == DocumentStatus.ANALYZING else None
+        },
+        synchronize_session="fetch"
+    )
+    if not updated:
+        raise TransitionConflict("Document was changed by another request")
+
+def release_claim(db: Session, document: Document, version: int, to: DocumentStatus):
+    """Give back a claim made at version, moving the document to the status it came from
+
+    Call after rolling back the failed run. A document changed since the
+    claim was taken over by another request and is left alone. A run that
+    had itself taken over an expired claim returns the document to
+    UPLOADED. The caller commits.
+    """
+    db.refresh(document)
+    if document.version != version or document.status != DocumentStatus.ANALYZING:
+        return
+    if to == DocumentStatus.ANALYZING:
+        to = DocumentStatus.UPLOADED
+    try:
+        transition(db, document, to, allowed_from=[DocumentStatus.ANALYZING])
+    except TransitionConflict:
+        pass  # Taken over between the refresh and the update
+
+def check_unchanged(db: Session, document: Document, statuses: Iterable[DocumentStatus]):
+    """Bump the version of a document still in one of statuses and unchanged since read
+
+    For requests that read the status early and write something else later,
+    e.g. validation results; call just before committing.
+    """
+    updated = db.query(Document).filter(
+        Document.id == document.id,
+        Document.status.in_(list(statuses)),
+        Document.version == document.version
+    ).update({Document.version: Document.version + 1}, synchronize_session="fetch")
+    if not updated:
+        raise TransitionConflict("Document was changed by another request")
+
+def claim_key(db: Session, key: Optional[str], operation: str, document_id: str) -> Optional[Dict[str, Any]]:
+    """Record an idempotency key, or return the response of the request that already used it
+
+    Returns None when the caller should do the work. Commits.
+    """
+    if key is None:
+        return None
+    db.add(IdempotencyKey(key=key, operation=operation, document_id=document_id))
+    try:
+        db.commit()
+        return None
+    except IntegrityError:
+        db.rollback()
+    existing = db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.operation == operation,
+        IdempotencyKey.document_id == document_id
+    ).first()
+    if existing is None:
+        # Released by a failed request in the meantime
+        return claim_key(db, key, operation, document_id)
+    if existing.response is None:
+        if _lease_expired(existing.created_at):
+            # The request that claimed the key died; of several retries only one takes it over
+            taken = db.query(IdempotencyKey).filter(
+                IdempotencyKey.id == existing.id,
+                IdempotencyKey.created_at == existing.created_at,
+                IdempotencyKey.response.is_(None)
+            ).update({IdempotencyKey.created_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+            if taken:
+                return None
+        raise RequestInProgress(f"A {operation} request with this idempotency key is still running")
+    return existing.response
+
+def complete_key(db: Session, key: Optional[str], operation: str, document_id: str, response: Dict[str, Any]):
+    """Store the response for retries of a key; the caller commits it with the work"""
+    if key is None:
+        return
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.operation == operation,
+        IdempotencyKey.document_id == document_id
+    ).update({IdempotencyKey.response: response}, synchronize_session=False)
+
+def release_key(db: Session, key: Optional[str], operation: str, document_id: str):
+    """Forget a key whose request failed so it can be retried; the caller commits"""
+    if key is None:
+        return
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.key == key,
+        IdempotencyKey.operation == operation,
+        IdempotencyKey.document_id == document_id,
+        IdempotencyKey.response.is_(None)
+    ).delete(synchronize_session=False)
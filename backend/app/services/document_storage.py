@@ -1,20 +1,25 @@
-from minio import Minio
+from functools import lru_cache
 from minio.error import S3Error
 from fastapi import UploadFile
+import io
 import os
 from datetime import datetime
+from ..core.clients import get_client, MINIO
 from ..core.config import settings
+from ..core.metrics import tracked
+from ..core.resources import read_limited
 import uuid
 
 class DocumentStorage:
     def __init__(self):
-        self.client = Minio(
-            settings.MINIO_URL,
-            access_key=settings.MINIO_ACCESS_KEY,
-            secret_key=settings.MINIO_SECRET_KEY,
-            secure=False
-        )
+        self._connect()
         self._ensure_bucket_exists()
+        # Forked workers must not reuse the parent's pooled connections
+        os.register_at_fork(after_in_child=self._connect)
+
+    def _connect(self):
+        # Pooled, with timeouts, retries and a circuit breaker (see core/clients.py)
+        self.client = get_client(MINIO)
 
     def _ensure_bucket_exists(self):
         """Ensure the required buckets exist"""
@@ -28,47 +33,55 @@ class DocumentStorage:
         """Generate a file path for storage"""
         return f"{user_id}/{document_id}/{file_type}.docx"
 
+    @tracked("document_storage")
     async def save_original_document(self, file: UploadFile, user_id: str) -> tuple[str, str]:
-        """Save the original uploaded document"""
+        """Save the original uploaded document, up to MAX_FILE_SIZE"""
+        return self.save_original_content(read_limited(file.file, file.filename), user_id)
+
+    @tracked("document_storage")
+    def save_original_content(self, content: bytes, user_id: str) -> tuple[str, str]:
+        """Save the content of an original document under a new document ID"""
         document_id = str(uuid.uuid4())
         file_path = self._generate_file_path(user_id, document_id, "original")
         
         # Save the file
-        content = await file.read()
         self.client.put_object(
             bucket_name=settings.MINIO_BUCKET_NAME,
             object_name=file_path,
-            data=content,
+            data=io.BytesIO(content),
             length=len(content),
             content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
         
         return document_id, file_path
 
+    @tracked("document_storage")
     def save_redline_document(self, content: bytes, user_id: str, document_id: str) -> str:
         """Save the redline version of the document"""
         file_path = self._generate_file_path(user_id, document_id, "redline")
         self.client.put_object(
             bucket_name=settings.MINIO_BUCKET_NAME,
             object_name=file_path,
-            data=content,
+            data=io.BytesIO(content),
             length=len(content),
             content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
         return file_path
 
+    @tracked("document_storage")
     def save_clean_document(self, content: bytes, user_id: str, document_id: str) -> str:
         """Save the clean version of the document"""
         file_path = self._generate_file_path(user_id, document_id, "clean")
         self.client.put_object(
             bucket_name=settings.MINIO_BUCKET_NAME,
             object_name=file_path,
-            data=content,
+            data=io.BytesIO(content),
             length=len(content),
             content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
         return file_path
 
+    @tracked("document_storage")
     def get_document(self, file_path: str) -> bytes:
         """Retrieve a document from storage"""
         try:
@@ -76,11 +89,17 @@ class DocumentStorage:
                 bucket_name=settings.MINIO_BUCKET_NAME,
                 object_name=file_path
             )
-            return response.read()
+            try:
+                return response.read()
+            finally:
+                # Hand the connection back to the pool
+                response.close()
+                response.release_conn()
         except S3Error as e:
             print(f"Error retrieving document: {e}")
             raise
 
+    @tracked("document_storage")
     def delete_document(self, file_path: str):
         """Delete a document from storage"""
         try:
@@ -90,4 +109,9 @@ class DocumentStorage:
             )
         except S3Error as e:
             print(f"Error deleting document: {e}")
-            raise 
\ No newline at end of file
+            raise 
+
+@lru_cache(maxsize=None)
+def get_document_storage() -> DocumentStorage:
+    """Process-wide DocumentStorage shared by all routers"""
+    return DocumentStorage()
@@ -0,0 +1,127 @@
+from typing import List, Dict, Any
+from datetime import datetime
+import copy
+import io
+from ..core.config import settings
+from ..core.resources import check_docx, check_count
+
+# python-docx is imported inside the functions so importing the routers
+# that use them stays cheap
+
+REVISION_AUTHOR = "NDA Validator"
+
+class InvalidDocument(Exception):
+    """Content that python-docx cannot open as a DOCX file"""
+
+def extract_paragraphs(docx_content: bytes) -> List[str]:
+    """Extract the paragraph texts of a DOCX file"""
+    from docx import Document
+    check_docx(docx_content)
+    try:
+        doc = Document(io.BytesIO(docx_content))
+    except Exception as e:
+        # Not a zip, missing parts or malformed XML
+        raise InvalidDocument(f"Not a valid DOCX file: {e}") from e
+    paragraphs = doc.paragraphs
+    check_count("paragraphs", len(paragraphs), settings.MAX_PARAGRAPHS)
+    return [paragraph.text for paragraph in paragraphs]
+
+def extract_text(docx_content: bytes) -> str:
+    """Extract text from a DOCX file"""
+    return "\n".join(extract_paragraphs(docx_content))
+
+def _run(text: str, deleted: bool = False, properties=None):
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    run = OxmlElement("w:r")
+    if properties is not None:
+        run.append(copy.deepcopy(properties))
+    text_element = OxmlElement("w:delText" if deleted else "w:t")
+    text_element.set(qn("xml:space"), "preserve")
+    text_element.text = text
+    run.append(text_element)
+    return run
+
+def _revision(tag: str, revision_id: int, date: str, run):
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    revision = OxmlElement(tag)
+    revision.set(qn("w:id"), str(revision_id))
+    revision.set(qn("w:author"), REVISION_AUTHOR)
+    revision.set(qn("w:date"), date)
+    revision.append(run)
+    return revision
+
+def create_redline(docx_content: bytes, analysis_results: List[Dict[str, Any]]) -> bytes:
+    """Create a copy of a DOCX file with suggested changes as tracked revisions
+
+    Paragraphs containing a clause with a different suggestion are rewritten
+    as plain text around a w:del/w:ins pair, so Word shows the change as a
+    tracked revision that can be accepted or rejected.
+    """
+    from docx import Document
+    from docx.oxml.ns import qn
+    changes = [
+        result for result in analysis_results
+        if result["original_text"] and result["suggested_text"] != result["original_text"]
+    ]
+    doc = Document(io.BytesIO(docx_content))
+    date = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    revision_id = 0
+
+    for paragraph in doc.paragraphs:
+        text = paragraph.text
+        paragraph_changes = []
+        for change in changes:
+            start = text.find(change["original_text"])
+            if start != -1 and all(
+                start >= end or start + len(change["original_text"]) <= other_start
+                for other_start, end, _ in paragraph_changes
+            ):
+                paragraph_changes.append((start, start + len(change["original_text"]), change))
+        if not paragraph_changes:
+            continue
+
+        # Keep the formatting of the first run for the rewritten paragraph
+        runs = paragraph._p.findall(qn("w:r"))
+        properties = runs[0].find(qn("w:rPr")) if runs else None
+        for run in runs:
+            paragraph._p.remove(run)
+
+        position = 0
+        for start, end, change in sorted(paragraph_changes, key=lambda c: c[0]):
+            if start > position:
+                paragraph._p.append(_run(text[position:start], properties=properties))
+            revision_id += 1
+            paragraph._p.append(_revision("w:del", revision_id, date, _run(text[start:end], True, properties)))
+            if change["suggested_text"]:
+                revision_id += 1
+                paragraph._p.append(_revision("w:ins", revision_id, date, _run(change["suggested_text"], properties=properties)))
+            position = end
+        if position < len(text):
+            paragraph._p.append(_run(text[position:], properties=properties))
+
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+def accept_all_changes(docx_content: bytes) -> bytes:
+    """Create a clean DOCX by accepting every tracked insertion and deletion"""
+    from docx import Document
+    from docx.oxml.ns import qn
+    doc = Document(io.BytesIO(docx_content))
+    body = doc.element.body
+
+    for deletion in list(body.iter(qn("w:del"))):
+        deletion.getparent().remove(deletion)
+    for insertion in list(body.iter(qn("w:ins"))):
+        parent = insertion.getparent()
+        index = parent.index(insertion)
+        for child in list(insertion):
+            parent.insert(index, child)
+            index += 1
+        parent.remove(insertion)
+
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
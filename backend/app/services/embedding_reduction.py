@@ -0,0 +1,233 @@
+"""Reduced-dimension embeddings for the vector store
+
+A projection is a PCA of the stored 384-d embeddings down to a few
+principal components. reduce_embeddings() fits one on a sample of the clause
+vectors, saves it as a version of the "embedding-projection" model in the
+ModelStore and re-indexes every collection into a copy per version, e.g.
+"nda-clauses-128d-<version>", so the full-size collections stay untouched
+until the projection is validated and activated.
+
+While a version is active (and EMBEDDING_PROJECTION is set), VectorStorage
+wraps its backend in a ProjectedBackend: reads and writes go to the reduced
+collections, and query and point vectors are projected on the way in. Like
+model versions, workers pick up a newly activated projection on restart.
+Writes made during a re-index may be missing from the copy; run it again,
+or while the service is idle.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+import os
+import time
+import numpy as np
+from ..core.config import settings
+from .model_store import ModelStore
+from .vector_backends import VectorBackend
+
+PROJECTION = "embedding-projection"
+PROJECTION_FILE = "projection.npz"
+
+class Projection:
+    """Centering and PCA components mapping full-size embeddings to dims dimensions"""
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, version: str):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+        self.version = version
+
+    @property
+    def dims(self) -> int:
+        return len(self.components)
+
+    def apply(self, vectors) -> np.ndarray:
+        """Project vectors and re-normalize them for cosine similarity"""
+        projected = (np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T
+        norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+        return projected / np.maximum(norms, 1e-12)
+
+    def collection(self, name: str) -> str:
+        return f"{name}-{self.dims}d-{self.version}"
+
+    def save(self, path: str):
+        np.savez(os.path.join(path, PROJECTION_FILE), mean=self.mean, components=self.components)
+
+    @classmethod
+    def load(cls, path: str, version: str) -> "Projection":
+        arrays = np.load(os.path.join(path, PROJECTION_FILE))
+        return cls(arrays["mean"], arrays["components"], version)
+
+def fit_projection(vectors: np.ndarray, dims: int, version: str) -> Dict[str, Any]:
+    """PCA of normalized vectors; returns the "projection" and its "explained_variance" ratio"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    if dims >= vectors.shape[1] or dims > len(vectors):
+        raise ValueError(f"Cannot reduce {len(vectors)} vectors of {vectors.shape[1]} dimensions to {dims}")
+    mean = vectors.mean(axis=0)
+    _, singular_values, components = np.linalg.svd(vectors - mean, full_matrices=False)
+    variance = singular_values ** 2
+    return {
+        "projection": Projection(mean, components[:dims], version),
+        "explained_variance": float(variance[:dims].sum() / variance.sum()),
+    }
+
+def active_projection(model_store: ModelStore = None) -> Optional[Projection]:
+    """The projection VectorStorage should serve, None for full-size vectors"""
+    if not settings.EMBEDDING_PROJECTION:
+        return None
+    model_store = model_store or ModelStore()
+    version = model_store.active_version(PROJECTION)
+    if version is None:
+        return None
+    return Projection.load(model_store.resolve(PROJECTION, None), version)
+
+class ProjectedBackend(VectorBackend):
+    """A backend serving the reduced copy of every collection"""
+
+    def __init__(self, backend: VectorBackend, projection: Projection):
+        self.backend = backend
+        self.projection = projection
+
+    def _points(self, points: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not points:
+            return []
+        vectors = self.projection.apply([point["vector"] for point in points])
+        return [{**point, "vector": vector.tolist()} for point, vector in zip(points, vectors)]
+
+    def setup(self, collections):
+        self.backend.setup({
+            self.projection.collection(name): {**spec, "size": self.projection.dims}
+            for name, spec in collections.items()
+        })
+
+    def upsert(self, collection, points):
+        self.backend.upsert(self.projection.collection(collection), self._points(points))
+
+    def retrieve(self, collection, ids):
+        return self.backend.retrieve(self.projection.collection(collection), ids)
+
+    def set_payloads(self, collection, updates):
+        self.backend.set_payloads(self.projection.collection(collection), updates)
+
+    def delete(self, collection, ids):
+        self.backend.delete(self.projection.collection(collection), ids)
+
+    def search(self, collection, vector, limit, conditions=None, terms=None, hnsw_ef=None):
+        return self.backend.search(
+            self.projection.collection(collection),
+            self.projection.apply(vector).tolist(),
+            limit,
+            conditions=conditions,
+            terms=terms,
+            hnsw_ef=hnsw_ef
+        )
+
+    def search_batch(self, collection, vectors, limit, conditions=None, hnsw_ef=None):
+        return self.backend.search_batch(
+            self.projection.collection(collection),
+            self.projection.apply(vectors).tolist(),
+            limit,
+            conditions=conditions,
+            hnsw_ef=hnsw_ef
+        )
+
+    def scroll(self, collection, batch_size=256) -> Iterator[List[Dict[str, Any]]]:
+        return self.backend.scroll(self.projection.collection(collection), batch_size)
+
+    def snapshot(self):
+        self.backend.snapshot()
+
+def _sample(backend: VectorBackend, collection: str, size: int) -> List[Dict[str, Any]]:
+    points = []
+    for batch in backend.scroll(collection):
+        points.extend(batch)
+        if len(points) >= size:
+            break
+    return points[:size]
+
+def _latencies(search, queries: np.ndarray, top_k: int):
+    rankings, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        rankings.append(search(query.tolist(), top_k))
+        latencies.append(time.perf_counter() - started)
+    values = np.asarray(latencies) * 1000
+    return rankings, {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+
+def evaluate(
+    backend: VectorBackend,
+    projection: Projection,
+    collection: str,
+    queries: List[Dict[str, Any]],
+    points: int,
+    top_k: int
+) -> Dict[str, Any]:
+    """recall@k of the reduced collection against the full-size one, with latency and vector size
+
+    Queries are stored points; each query's own point is left out of both
+    rankings.
+    """
+    projected = ProjectedBackend(backend, projection)
+    vectors = np.asarray([query["vector"] for query in queries], dtype=np.float32)
+    full, full_latency = _latencies(
+        lambda vector, limit: backend.search(collection, vector, limit)[0], vectors, top_k + 1
+    )
+    reduced, reduced_latency = _latencies(
+        lambda vector, limit: projected.search(collection, vector, limit)[0], vectors, top_k + 1
+    )
+
+    hits = total = 0
+    for query, full_ranking, reduced_ranking in zip(queries, full, reduced):
+        expected = [hit["id"] for hit in full_ranking if hit["id"] != query["id"]][:top_k]
+        found = {hit["id"] for hit in reduced_ranking if hit["id"] != query["id"]}
+        hits += len(found.intersection(expected))
+        total += len(expected)
+    full_dims = vectors.shape[1]
+    return {
+        f"recall@{top_k}": hits / total if total else None,
+        "full": {**full_latency, "dims": full_dims, "vector_bytes": points * full_dims * 4},
+        "reduced": {**reduced_latency, "dims": projection.dims, "vector_bytes": points * projection.dims * 4},
+    }
+
+def reduce_embeddings(
+    backend: VectorBackend,
+    collections: Dict[str, Dict[str, Any]],
+    fit_collection: str,
+    dims: int,
+    sample: int = 20000,
+    queries: int = 200,
+    top_k: int = 10,
+    activate: bool = False,
+    model_store: ModelStore = None
+) -> Dict[str, Any]:
+    """Fit a projection on fit_collection, re-index every collection into it and publish it
+
+    The report, also stored in the version's manifest, holds the explained
+    variance, the points copied per collection and evaluate() of
+    fit_collection.
+    """
+    model_store = model_store or ModelStore()
+    fit_points = _sample(backend, fit_collection, sample)
+    version, path = model_store.create_version(PROJECTION)
+    fitted = fit_projection([point["vector"] for point in fit_points], dims, version)
+    projection = fitted["projection"]
+    projection.save(path)
+
+    projected = ProjectedBackend(backend, projection)
+    projected.setup(collections)
+    copied = {}
+    for name in collections:
+        copied[name] = 0
+        for batch in backend.scroll(name):
+            projected.upsert(name, batch)
+            copied[name] += len(batch)
+    projected.snapshot()
+
+    report = {
+        "version": version,
+        "dims": dims,
+        "explained_variance": fitted["explained_variance"],
+        "points": copied,
+        "evaluation": evaluate(
+            backend, projection, fit_collection, fit_points[:queries], copied[fit_collection], top_k
+        ),
+    }
+    model_store.publish(PROJECTION, version, metadata=report, activate=activate)
+    return report
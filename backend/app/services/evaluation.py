@@ -0,0 +1,209 @@
+"""Quality and cost of the analysis pipeline on a held-out set
+
+The held-out set is a JSONL file with two kinds of lines:
+
+    {"text": "<document text>", "clauses": [{"start": 0, "end": 120, "label": "keep"}, ...]}
+    {"query": "<clause>", "positive": "<clause it should retrieve>"}
+
+Documents give the gold clause spans, as character offsets into the text,
+and the gold keep/modify/remove label of each clause. Retrieval pairs give
+the clause each query should find among all positives.
+
+evaluate() runs the documents through AIService.analyze_documents once per
+inference mode, a set of settings overrides such as {"CASCADE_ENABLED":
+true}. Each mode reports:
+
+- NER span precision/recall/F1. A predicted clause matches a gold clause at
+  SPAN_MATCH_IOU character overlap. The exact-match F1 is reported too.
+- Keep/modify/remove accuracy, per-label F1 and macro F1 over matched
+  clauses, so NER misses are not counted twice.
+- Retrieval recall@k of the sentence transformer over the pairs.
+- Latency per clause and per document, and resident memory growth.
+
+check_floors() compares a report with minimum values so performance work
+can be gated on quality.
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+import asyncio
+import json
+import time
+import numpy as np
+from ..core.config import settings
+from ..core.resources import current_rss
+
+LABELS = ["keep", "modify", "remove"]
+SPAN_MATCH_IOU = 0.5
+
+def load_dataset(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    """The "documents" and "retrieval" pairs of a held-out JSONL file"""
+    dataset = {"documents": [], "retrieval": []}
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "text" in item:
+                dataset["documents"].append(item)
+            elif "query" in item:
+                dataset["retrieval"].append(item)
+            else:
+                raise ValueError(f"{path}:{number}: expected a document with text or a retrieval pair with query")
+    return dataset
+
+def classification_metrics(gold: Sequence[str], predicted: Sequence[str]) -> Dict[str, Any]:
+    """Accuracy, per-label precision/recall/F1 and macro F1"""
+    per_label = {}
+    for label in LABELS:
+        true_positives = sum(g == label and p == label for g, p in zip(gold, predicted))
+        per_label[label] = _f1(true_positives, sum(p == label for p in predicted), sum(g == label for g in gold))
+    return {
+        "count": len(gold),
+        "accuracy": sum(g == p for g, p in zip(gold, predicted)) / len(gold) if gold else None,
+        "per_label": per_label,
+        "macro_f1": float(np.mean([metrics["f1"] for metrics in per_label.values()])),
+    }
+
+def _f1(true_positives: int, predicted: int, gold: int) -> Dict[str, float]:
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / gold if gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+def _iou(a: Tuple[int, int], b: Tuple[int, int]) -> float:
+    overlap = min(a[1], b[1]) - max(a[0], b[0])
+    if overlap <= 0:
+        return 0.0
+    return overlap / (max(a[1], b[1]) - min(a[0], b[0]))
+
+def locate(text: str, clauses: Sequence[str]) -> List[Tuple[int, int]]:
+    """Character spans of extracted clauses, which are cut from the text in document order"""
+    spans, position = [], 0
+    for clause in clauses:
+        start = text.find(clause, position)
+        if start < 0:
+            start = text.find(clause)
+        if start < 0:
+            spans.append((-1, -1))
+            continue
+        spans.append((start, start + len(clause)))
+        position = start + len(clause)
+    return spans
+
+def match_spans(gold: Sequence[Tuple[int, int]], predicted: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Greedy one-to-one (gold, predicted) index pairs with IoU of at least SPAN_MATCH_IOU"""
+    candidates = sorted(
+        (
+            (_iou(g, p), i, j)
+            for i, g in enumerate(gold)
+            for j, p in enumerate(predicted)
+        ),
+        reverse=True
+    )
+    pairs, used_gold, used_predicted = [], set(), set()
+    for iou, i, j in candidates:
+        if iou < SPAN_MATCH_IOU:
+            break
+        if i not in used_gold and j not in used_predicted:
+            pairs.append((i, j))
+            used_gold.add(i)
+            used_predicted.add(j)
+    return pairs
+
+def retrieval_recall(encode, pairs: Sequence[Dict[str, str]], top_k: int) -> Dict[str, Any]:
+    """Share of queries whose positive is among the top_k most similar positives"""
+    if not pairs:
+        return {"count": 0, f"recall@{top_k}": None}
+    queries = encode([pair["query"] for pair in pairs])
+    corpus = encode([pair["positive"] for pair in pairs])
+    similarities = queries @ corpus.T
+    top = np.argsort(-similarities, axis=1)[:, :top_k]
+    hits = sum(index in row for index, row in enumerate(top))
+    return {"count": len(pairs), f"recall@{top_k}": hits / len(pairs)}
+
+@contextmanager
+def overrides(values: Dict[str, Any]) -> Iterator[None]:
+    """Apply settings overrides for the duration of a mode"""
+    previous = {name: getattr(settings, name) for name in values}
+    for name, value in values.items():
+        setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(settings, name, value)
+
+def _percentiles(seconds: Sequence[float]) -> Dict[str, float]:
+    values = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+
+def evaluate_mode(ai_service, dataset: Dict[str, List[Dict[str, Any]]], top_k: int = 5) -> Dict[str, Any]:
+    """Quality, latency and memory of the current settings"""
+    gold_labels, predicted_labels = [], []
+    exact = matched = gold_count = predicted_count = 0
+    latencies = []
+    rss_before = current_rss()
+
+    for document in dataset["documents"]:
+        text = document["text"]
+        gold = [(clause["start"], clause["end"]) for clause in document["clauses"]]
+        started = time.perf_counter()
+        results = asyncio.run(ai_service.analyze_documents([text]))[0]
+        latencies.append(time.perf_counter() - started)
+
+        predicted = locate(text, [result["original_text"] for result in results])
+        pairs = match_spans(gold, predicted)
+        gold_count += len(gold)
+        predicted_count += len(predicted)
+        matched += len(pairs)
+        exact += len(set(gold) & set(predicted))
+        for i, j in pairs:
+            gold_labels.append(document["clauses"][i]["label"])
+            predicted_labels.append(results[j]["label"])
+
+    rss_after = current_rss()
+    report = {
+        "ner": {
+            **_f1(matched, predicted_count, gold_count),
+            "exact_f1": _f1(exact, predicted_count, gold_count)["f1"],
+            "gold_clauses": gold_count,
+            "predicted_clauses": predicted_count,
+        },
+        "classification": classification_metrics(gold_labels, predicted_labels),
+        "retrieval": retrieval_recall(
+            lambda texts: ai_service.sentence_transformer.encode(texts, normalize_embeddings=True),
+            dataset["retrieval"],
+            top_k
+        ),
+        "memory": {
+            "rss_growth_bytes": max(rss_after - rss_before, 0) if rss_before is not None and rss_after is not None else None,
+            "rss_bytes": rss_after,
+        },
+    }
+    if latencies:
+        report["latency"] = {
+            "documents": len(latencies),
+            "ms_per_clause": sum(latencies) * 1000 / predicted_count if predicted_count else None,
+            "per_document": _percentiles(latencies),
+        }
+    return report
+
+def evaluate(ai_service, dataset: Dict[str, List[Dict[str, Any]]], modes: Dict[str, Dict[str, Any]], top_k: int = 5) -> Dict[str, Any]:
+    """evaluate_mode() under each mode's settings overrides"""
+    report = {}
+    for name, values in modes.items():
+        with overrides(values):
+            report[name] = evaluate_mode(ai_service, dataset, top_k)
+    return report
+
+def check_floors(report: Dict[str, Any], floors: Dict[str, float]) -> List[str]:
+    """Metrics below their floor in any mode, floors keyed by dotted path like "classification.macro_f1" """
+    violations = []
+    for mode, metrics in report.items():
+        for path, floor in floors.items():
+            value = metrics
+            for key in path.split("."):
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is None or value < floor:
+                violations.append(f"{mode}: {path} is {value}, below {floor}")
+    return violations
@@ -0,0 +1,175 @@
+"""Near-duplicate detection for uploaded NDAs
+
+Every upload gets a MinHash signature over the word shingles of its
+paragraphs. The signature is split
+into LSH bands whose bucket keys are stored with the document, so a lookup
+only compares signatures of documents sharing at least one bucket. Analysis
+results remember the hash of the paragraph they came from, which lets a
+near-duplicate reuse the results of every paragraph it has in common with an
+analyzed document.
+"""
+from typing import Any, Dict, List, Optional, Set, Tuple
+import hashlib
+import re
+import zlib
+import numpy as np
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from ..core.config import settings
+from ..db.models import AnalysisResult, DocumentFingerprint, LshBucket
+from .clause_alignment import label_change
+
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows put the LSH candidate threshold near a Jaccard
+# similarity of (1/16)^(1/8) ~= 0.7
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+SHINGLE_WORDS = 5
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(20240101)
+# Universal hash permutations h(x) = (a * x + b) mod p; a, b < 2^32 keep
+# a * x within 64 bits for 32-bit shingle hashes
+_A = _rng.integers(1, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+_WORD = re.compile(r"\w+")
+
+def normalize_paragraph(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+def paragraph_hash(text: str) -> str:
+    return hashlib.blake2b(normalize_paragraph(text).encode(), digest_size=8).hexdigest()
+
+def _shingles(paragraphs: List[str]) -> np.ndarray:
+    """32-bit hashes of the word shingles of each paragraph"""
+    hashes = set()
+    for paragraph in paragraphs:
+        words = normalize_paragraph(paragraph).split()
+        for start in range(max(len(words) - SHINGLE_WORDS + 1, 1 if words else 0)):
+            hashes.add(zlib.crc32(" ".join(words[start:start + SHINGLE_WORDS]).encode()))
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+def minhash(paragraphs: List[str]) -> np.ndarray:
+    """MinHash signature of a document's paragraph shingles"""
+    shingles = _shingles(paragraphs)
+    signature = np.full(NUM_PERMUTATIONS, _MERSENNE_PRIME, dtype=np.uint64)
+    # Chunked so the permutation matrix stays small for long documents
+    for start in range(0, len(shingles), 4096):
+        chunk = shingles[start:start + 4096]
+        permuted = (np.outer(chunk, _A) + _B) % _MERSENNE_PRIME
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature
+
+def lsh_buckets(signature: np.ndarray) -> List[Tuple[int, str]]:
+    """(band, bucket key) pairs of a signature"""
+    return [
+        (band, hashlib.blake2b(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(), digest_size=8).hexdigest())
+        for band in range(LSH_BANDS)
+    ]
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(signature == other))
+
+def store_fingerprint(db: Session, document_id: str, paragraphs: List[str]) -> DocumentFingerprint:
+    """Fingerprint a document and add it to the LSH index"""
+    signature = minhash(paragraphs)
+    fingerprint = DocumentFingerprint(document_id=document_id, signature=signature.tobytes())
+    db.add(fingerprint)
+    for band, bucket in lsh_buckets(signature):
+        db.add(LshBucket(document_id=document_id, band=band, bucket=bucket))
+    return fingerprint
+
+def find_near_duplicate(db: Session, document_id: str) -> Optional[Tuple[str, float]]:
+    """The most similar analyzed document above NEAR_DUPLICATE_THRESHOLD and its similarity"""
+    fingerprint = db.query(DocumentFingerprint).filter(DocumentFingerprint.document_id == document_id).first()
+    if fingerprint is None:
+        return None
+    signature = np.frombuffer(fingerprint.signature, dtype=np.uint64)
+
+    # Candidates share a bucket in any band
+    bucket_matches = [
+        (LshBucket.band == band) & (LshBucket.bucket == bucket)
+        for band, bucket in lsh_buckets(signature)
+    ]
+    candidates = [
+        row.document_id for row in db.query(LshBucket.document_id).filter(
+            or_(*bucket_matches),
+            LshBucket.document_id != document_id
+        ).distinct()
+    ]
+    if not candidates:
+        return None
+
+    # Only documents with results to reuse count
+    analyzed = {
+        row.document_id for row in db.query(AnalysisResult.document_id).filter(
+            AnalysisResult.document_id.in_(candidates)
+        ).distinct()
+    }
+    best = None
+    for candidate in db.query(DocumentFingerprint).filter(DocumentFingerprint.document_id.in_(analyzed)):
+        score = similarity(signature, np.frombuffer(candidate.signature, dtype=np.uint64))
+        if score >= settings.NEAR_DUPLICATE_THRESHOLD and (best is None or score > best[1]):
+            best = (candidate.document_id, score)
+    return best
+
+def paragraph_of(clause_text: str, paragraphs: List[str]) -> Optional[str]:
+    """Hash of the first paragraph containing a clause, compared on normalized text"""
+    clause = normalize_paragraph(clause_text)
+    if not clause:
+        return None
+    for paragraph in paragraphs:
+        if clause in normalize_paragraph(paragraph):
+            return paragraph_hash(paragraph)
+    return None
+
+def _touched_paragraphs(clause_text: str, paragraphs: List[str]) -> Set[str]:
+    """Hashes of the paragraphs holding part of a clause that may span paragraphs
+
+    Analyzed text joins paragraphs with newlines, so each line of the clause
+    is part of one paragraph; every paragraph containing a line counts.
+    """
+    lines = [f" {line} " for line in map(normalize_paragraph, clause_text.split("\n")) if line]
+    touched = set()
+    for paragraph in paragraphs:
+        normalized = f" {normalize_paragraph(paragraph)} "
+        if any(line in normalized for line in lines):
+            touched.add(paragraph_hash(paragraph))
+    return touched
+
+def split_reusable(
+    db: Session,
+    paragraphs: List[str],
+    source_document_id: str
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Results of the source document reusable for these paragraphs, and the paragraphs left to analyze"""
+    source_results = db.query(AnalysisResult).filter(AnalysisResult.document_id == source_document_id).all()
+    # A source clause without a paragraph hash was in no single paragraph,
+    # e.g. it spans two; its result cannot be reused, so the paragraphs it
+    # touches are analyzed again even where other results cover them
+    touched = set()
+    for result in source_results:
+        if result.paragraph_hash is None:
+            touched |= _touched_paragraphs(result.clause_text, paragraphs)
+    current = {paragraph_hash(paragraph) for paragraph in paragraphs if paragraph.strip()} - touched
+    reused = [
+        {
+            "clause_text": result.clause_text,
+            "original_text": result.original_text,
+            "suggested_text": result.suggested_text,
+            "confidence_score": result.confidence_score,
+            # Rows stored before labels were kept fall back to comparing the texts
+            "label": result.label or label_change(result.original_text, result.suggested_text),
+            "paragraph_hash": result.paragraph_hash
+        }
+        for result in source_results
+        if result.paragraph_hash in current
+    ]
+    covered = {result.paragraph_hash for result in source_results} - touched
+    changed = [
+        paragraph for paragraph in paragraphs
+        if paragraph.strip() and paragraph_hash(paragraph) not in covered
+    ]
+    return reused, changed
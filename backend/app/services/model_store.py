@@ -0,0 +1,184 @@
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+from datetime import datetime
+import glob
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from ..core.config import settings
+
+if TYPE_CHECKING:
+    import torch
+
+MANIFEST_FILE = "manifest.json"
+ACTIVE_FILE = "ACTIVE"
+
+class ModelStore:
+    """Versioned local store for trained model artifacts
+
+    Layout: ``<root>/<name>/<version>/`` holds the saved model and a
+    manifest with per-file checksums, ``<root>/<name>/ACTIVE`` names the
+    version that is served.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or settings.MODEL_STORE_DIR
+
+    def _model_dir(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def run_dir(self, name: str) -> str:
+        """Scratch directory for checkpoints and logs of a training run"""
+        return os.path.join(self.root, ".runs", name)
+
+    def create_version(self, name: str) -> Tuple[str, str]:
+        """Reserve a new, not yet published version directory"""
+        version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+        path = os.path.join(self._model_dir(name), version)
+        os.makedirs(path)
+        return version, path
+
+    def _checksums(self, path: str) -> Dict[str, Dict[str, Any]]:
+        files = {}
+        for root, _, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                if filename == MANIFEST_FILE:
+                    continue
+                file_path = os.path.join(root, filename)
+                digest = hashlib.sha256()
+                with open(file_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        digest.update(chunk)
+                files[os.path.relpath(file_path, path)] = {
+                    "sha256": digest.hexdigest(),
+                    "size": os.path.getsize(file_path)
+                }
+        return files
+
+    def publish(self, name: str, version: str, metadata: Dict[str, Any] = None, activate: bool = True) -> Dict[str, Any]:
+        """Write the manifest of a saved version and optionally make it active"""
+        path = os.path.join(self._model_dir(name), version)
+        manifest = {
+            "name": name,
+            "version": version,
+            "created_at": datetime.utcnow().isoformat(),
+            "files": self._checksums(path),
+            "metadata": metadata or {}
+        }
+        with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        if activate:
+            self.activate(name, version, verify=False)
+        self._prune(name)
+        return manifest
+
+    def manifest(self, name: str, version: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self._model_dir(name), version, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def verify(self, name: str, version: str) -> bool:
+        """Check the files of a version against its manifest checksums"""
+        manifest = self.manifest(name, version)
+        if manifest is None:
+            return False
+        actual = self._checksums(os.path.join(self._model_dir(name), version))
+        return actual == manifest["files"]
+
+    def activate(self, name: str, version: str, verify: bool = True):
+        """Point the active version of a model at the given version"""
+        if self.manifest(name, version) is None:
+            raise ValueError(f"Unknown version {version} for model {name}")
+        if verify and not self.verify(name, version):
+            raise ValueError(f"Checksum mismatch for {name} version {version}")
+
+        # Write then rename so readers never see a partial pointer
+        pointer = os.path.join(self._model_dir(name), ACTIVE_FILE)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(version)
+        os.replace(pointer + ".tmp", pointer)
+
+    def active_version(self, name: str) -> Optional[str]:
+        pointer = os.path.join(self._model_dir(name), ACTIVE_FILE)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer) as f:
+            return f.read().strip() or None
+
+    def resolve(self, name: str, default: str) -> str:
+        """Path of the active version of a model, or the default checkpoint"""
+        version = self.active_version(name)
+        if version is None:
+            return default
+        if settings.MODEL_STORE_VERIFY_ON_LOAD and not self.verify(name, version):
+            raise ValueError(f"Checksum mismatch for {name} version {version}")
+        return os.path.join(self._model_dir(name), version)
+
+    def list_versions(self, name: str) -> List[Dict[str, Any]]:
+        model_dir = self._model_dir(name)
+        if not os.path.isdir(model_dir):
+            return []
+        active = self.active_version(name)
+        versions = []
+        for version in os.listdir(model_dir):
+            manifest = self.manifest(name, version)
+            if manifest is None:
+                continue
+            versions.append({
+                "version": version,
+                "created_at": manifest["created_at"],
+                "metadata": manifest["metadata"],
+                "active": version == active
+            })
+        return sorted(versions, key=lambda v: v["created_at"])
+
+    def list_models(self) -> Dict[str, List[Dict[str, Any]]]:
+        if not os.path.isdir(self.root):
+            return {}
+        return {
+            name: self.list_versions(name)
+            for name in sorted(os.listdir(self.root))
+            if not name.startswith(".") and os.path.isdir(self._model_dir(name))
+        }
+
+    def _prune(self, name: str):
+        """Delete the oldest inactive versions beyond MODEL_STORE_KEEP_VERSIONS"""
+        versions = self.list_versions(name)
+        excess = len(versions) - settings.MODEL_STORE_KEEP_VERSIONS
+        for version in versions:
+            if excess <= 0:
+                break
+            if not version["active"]:
+                shutil.rmtree(os.path.join(self._model_dir(name), version["version"]))
+                excess -= 1
+
+def map_weights(model: "torch.nn.Module", path: str) -> "torch.nn.Module":
+    """Back the CPU parameters of a loaded model with memory-mapped safetensors
+
+    safetensors maps the weight files privately (copy-on-write), so every
+    process that maps the same version shares the page cache for weights
+    it never writes instead of holding its own copy.
+    """
+    weight_files = glob.glob(os.path.join(path, "*.safetensors"))
+    if not weight_files:
+        return model
+    # Imported here so listing or activating versions does not import torch
+    from safetensors.torch import load_file
+
+    tensors = dict(model.named_parameters())
+    tensors.update(model.named_buffers())
+    for weight_file in weight_files:
+        for key, mapped in load_file(weight_file).items():
+            target = tensors.get(key)
+            if (
+                target is not None
+                and target.device.type == "cpu"
+                and target.shape == mapped.shape
+                and target.dtype == mapped.dtype
+            ):
+                target.data = mapped
+    return model
@@ -0,0 +1,89 @@
+"""Lexical scoring and rank fusion for hybrid clause search
+
+Clause points carry a sparse "lexical" vector next to their dense embedding.
+Its weights are the BM25 term-frequency component of each hashed term, so the
+sparse dot product with a query vector of per-term IDF weights is the BM25
+score of the clause. Dense and lexical hits are merged with reciprocal rank
+fusion, which only uses ranks and so needs no calibration between the cosine
+and BM25 score scales.
+"""
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+import math
+import re
+import zlib
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# BM25 normalises by the average clause length; clauses are short and fairly
+# uniform, so a fixed pivot stands in for the corpus average
+AVG_CLAUSE_TERMS = 40
+RRF_K = 60
+MAX_QUERY_TERMS = 16
+
+STOPWORDS = frozenset("""
+    a an and any are as at be been but by for from has have if in into is it its
+    of on or such that the their then there these this to was were which will with
+""".split())
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens of a text without stopwords"""
+    return [token for token in _TOKEN.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+@lru_cache(maxsize=1 << 16)
+def term_index(term: str) -> int:
+    """Sparse vector dimension of a term"""
+    return zlib.crc32(term.encode())
+
+def _sparse(weights: Dict[int, float]) -> Tuple[List[int], List[float]]:
+    """Indices and values of a sparse vector, sorted by index as Qdrant stores them"""
+    indices = sorted(weights)
+    return indices, [weights[index] for index in indices]
+
+def document_vector(text: str) -> Tuple[List[int], List[float]]:
+    """Sparse BM25 term-frequency weights of a clause"""
+    counts = Counter(tokenize(text))
+    length_norm = 1 - BM25_B + BM25_B * sum(counts.values()) / AVG_CLAUSE_TERMS
+    weights: Dict[int, float] = {}
+    for term, tf in counts.items():
+        index = term_index(term)
+        # Hash collisions are rare enough to simply add up
+        weights[index] = weights.get(index, 0.0) + tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+    return _sparse(weights)
+
+def query_terms(text: str) -> List[str]:
+    """Distinct query terms, longest first when there are too many"""
+    terms = list(dict.fromkeys(tokenize(text)))
+    if len(terms) > MAX_QUERY_TERMS:
+        terms = sorted(terms, key=len, reverse=True)[:MAX_QUERY_TERMS]
+    return terms
+
+def idf(document_frequency: int, total: int) -> float:
+    """BM25 inverse document frequency, always positive"""
+    return math.log(1 + (total - document_frequency + 0.5) / (document_frequency + 0.5))
+
+def query_vector(idf_by_term: Dict[str, float]) -> Tuple[List[int], List[float]]:
+    """Sparse query vector weighting each term by its IDF"""
+    weights: Dict[int, float] = {}
+    for term, weight in idf_by_term.items():
+        index = term_index(term)
+        weights[index] = weights.get(index, 0.0) + weight
+    return _sparse(weights)
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Any]],
+    key: Callable[[Any], Any] = lambda hit: hit.id,
+    k: int = RRF_K
+) -> List[Tuple[Any, float]]:
+    """Merge ranked hit lists, scoring each hit by the sum of 1 / (k + rank)"""
+    scores: Dict[Any, float] = {}
+    hits: Dict[Any, Any] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            hit_key = key(hit)
+            scores[hit_key] = scores.get(hit_key, 0.0) + 1 / (k + rank)
+            hits.setdefault(hit_key, hit)
+    return sorted(((hits[hit_key], score) for hit_key, score in scores.items()), key=lambda item: item[1], reverse=True)
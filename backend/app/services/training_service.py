@@ -1,4 +1,9 @@
+from functools import lru_cache
 from typing import List, Dict, Any, Tuple
+from datetime import datetime
+import io
+import random
+import threading
 import torch
 from torch.utils.data import Dataset, DataLoader
 from transformers import (
@@ -7,7 +12,8 @@ from transformers import (
     AutoModelForTokenClassification,
     TrainingArguments,
     Trainer,
-    DataCollatorForTokenClassification
+    DataCollatorForTokenClassification,
+    DataCollatorWithPadding
 )
 from sentence_transformers import SentenceTransformer, InputExample, losses
 from sentence_transformers.readers import InputExample
@@ -16,39 +22,128 @@ from docx import Document
 from docx.oxml.text.paragraph import CT_P
 from docx.oxml.text.run import CT_R
 from docx.oxml.shared import qn
+from sqlalchemy import func
+from sqlalchemy.orm import Session
 from ..core.config import settings
-from ..services.document_storage import DocumentStorage
-from ..services.vector_storage import VectorStorage
+from ..core.resources import check_docx
+from ..db.models import TrainingExample
+from ..services.document_storage import get_document_storage
+from ..services.vector_storage import get_vector_storage
+from ..services.model_store import ModelStore
+from ..services.docx_processing import extract_text
+from ..services.clause_alignment import align_clauses, build_sentence_pairs, label_change
+from ..services.evaluation import classification_metrics
+
+try:
+    from peft import LoraConfig, get_peft_model
+except ImportError:  # LoRA fine-tuning is optional
+    LoraConfig = None
+
+LABEL_IDS = {"keep": 0, "modify": 1, "remove": 2}
+
+BASE_MODEL = "nlpaueb/legal-bert-base-uncased"
+BASE_SENTENCE_TRANSFORMER = "all-MiniLM-L6-v2"
+# Model store names
+CLASSIFIER = "classifier"
+NER = "ner"
+SENTENCE_TRANSFORMER = "sentence_transformer"
+
+class _PackedDataset(Dataset):
+    """Pre-tokenized, unpadded examples stored in one flat int32 array.
+
+    Padding is left to the data collator so every batch is only padded to
+    its own longest member.
+    """
+
+    def __init__(self, texts: List[str], tokenizer, max_length: int = 512):
+        encodings = tokenizer(
+            texts,
+            truncation=True,
+            max_length=max_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )["input_ids"]
+        self.lengths = np.fromiter((len(ids) for ids in encodings), dtype=np.int64, count=len(encodings))
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+        self.input_ids = np.fromiter(
+            (token for ids in encodings for token in ids),
+            dtype=np.int32,
+            count=int(self.offsets[-1])
+        )
+
+    def _slice(self, idx: int) -> np.ndarray:
+        return self.input_ids[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __len__(self):
+        return len(self.lengths)
+
+class ClassificationDataset(_PackedDataset):
+    def __init__(self, texts: List[str], labels: List[int], tokenizer, max_length: int = 512):
+        super().__init__(texts, tokenizer, max_length)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+    def __getitem__(self, idx):
+        return {"input_ids": self._slice(idx), "labels": int(self.labels[idx])}
+
+class NERDataset(_PackedDataset):
+    def __init__(self, texts: List[str], labels: List[List[int]], tokenizer, max_length: int = 512):
+        super().__init__(texts, tokenizer, max_length)
+        # Align label sequences with the (possibly truncated) token sequences,
+        # marking positions without a label as ignored (-100)
+        self.labels = np.full(int(self.offsets[-1]), -100, dtype=np.int64)
+        for idx, example_labels in enumerate(labels):
+            length = min(len(example_labels), int(self.lengths[idx]))
+            start = self.offsets[idx]
+            self.labels[start:start + length] = example_labels[:length]
+
+    def __getitem__(self, idx):
+        return {
+            "input_ids": self._slice(idx),
+            "labels": self.labels[self.offsets[idx]:self.offsets[idx + 1]]
+        }
+
+def _classifier_metrics(eval_prediction) -> Dict[str, float]:
+    """Trainer metrics of the clause classifier, see services/evaluation.py"""
+    labels = {label_id: label for label, label_id in LABEL_IDS.items()}
+    predictions = np.argmax(eval_prediction.predictions, axis=-1)
+    metrics = classification_metrics(
+        [labels[int(label_id)] for label_id in eval_prediction.label_ids],
+        [labels[int(label_id)] for label_id in predictions]
+    )
+    return {"accuracy": metrics["accuracy"], "macro_f1": metrics["macro_f1"]}
 
 class TrainingService:
     def __init__(self):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.document_storage = DocumentStorage()
-        self.vector_storage = VectorStorage()
+        self.document_storage = get_document_storage()
+        self.vector_storage = get_vector_storage()
+        self.model_store = ModelStore()
+        # Held while an incremental fine-tune runs, so only one runs at a time
+        self.finetune_lock = threading.Lock()
         
         # Initialize models
-        self.classifier_tokenizer = AutoTokenizer.from_pretrained("nlpaueb/legal-bert-base-uncased")
+        self.classifier_tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
         self.classifier_model = AutoModelForSequenceClassification.from_pretrained(
-            "nlpaueb/legal-bert-base-uncased",
+            BASE_MODEL,
             num_labels=3  # [keep, modify, remove]
         ).to(self.device)
         
-        self.ner_tokenizer = AutoTokenizer.from_pretrained("nlpaueb/legal-bert-base-uncased")
+        self.ner_tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
         self.ner_model = AutoModelForTokenClassification.from_pretrained(
-            "nlpaueb/legal-bert-base-uncased",
+            BASE_MODEL,
             num_labels=5  # [O, B-CLAUSE, I-CLAUSE, B-SECTION, I-SECTION]
         ).to(self.device)
         
-        self.sentence_transformer = SentenceTransformer('all-MiniLM-L6-v2').to(self.device)
+        self.sentence_transformer = SentenceTransformer(BASE_SENTENCE_TRANSFORMER).to(self.device)
 
     def extract_text_from_docx(self, docx_content: bytes) -> str:
         """Extract text from a DOCX file"""
-        doc = Document(docx_content)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        return extract_text(docx_content)
 
     def extract_changes_from_redline(self, docx_content: bytes) -> List[Dict[str, str]]:
         """Extract changes from a redline DOCX file"""
-        doc = Document(docx_content)
+        check_docx(docx_content)
+        doc = Document(io.BytesIO(docx_content))
         changes = []
         
         for paragraph in doc.paragraphs:
@@ -78,37 +173,19 @@ class TrainingService:
         
         return changes
 
-    def prepare_classification_dataset(self, original_texts: List[str], redline_texts: List[str]) -> Dataset:
-        """Prepare dataset for clause classification training"""
-        class ClassificationDataset(Dataset):
-            def __init__(self, texts, labels, tokenizer):
-                self.encodings = tokenizer(texts, truncation=True, padding=True)
-                self.labels = labels
-
-            def __getitem__(self, idx):
-                item = {key: torch.tensor(val[idx]) for key, val in self.encodings.items()}
-                item['labels'] = torch.tensor(self.labels[idx])
-                return item
-
-            def __len__(self):
-                return len(self.labels)
-
-        # Determine labels based on text differences
-        labels = []
-        for orig, redline in zip(original_texts, redline_texts):
-            if orig == redline:
-                labels.append(0)  # keep
-            elif not redline:
-                labels.append(2)  # remove
-            else:
-                labels.append(1)  # modify
-
-        return ClassificationDataset(original_texts, labels, self.classifier_tokenizer)
+    def prepare_classification_dataset(self, aligned: List[Dict[str, Any]]) -> Dataset:
+        """Prepare dataset for clause classification training from labeled, aligned clauses"""
+        return ClassificationDataset(
+            [item["original"] for item in aligned],
+            [LABEL_IDS[item["label"]] for item in aligned],
+            self.classifier_tokenizer
+        )
 
-    def train_classifier(self, train_dataset: Dataset, eval_dataset: Dataset = None):
-        """Train the clause classification model"""
-        training_args = TrainingArguments(
-            output_dir="./models/classifier",
+    def _training_arguments(self, output_dir: str, eval_dataset: Dataset = None, **overrides) -> TrainingArguments:
+        """Shared training arguments; batches are grouped by length and padded per batch"""
+        arguments = dict(
+            output_dir=output_dir,
+            save_safetensors=True,
             num_train_epochs=3,
             per_device_train_batch_size=8,
             per_device_eval_batch_size=8,
@@ -117,50 +194,55 @@ class TrainingService:
             logging_dir="./logs",
             logging_steps=10,
             evaluation_strategy="epoch" if eval_dataset else "no",
+            group_by_length=True,
         )
+        arguments.update(overrides)
+        return TrainingArguments(**arguments)
+
+    def _save_version(self, name: str, model, tokenizer=None, metadata: Dict[str, Any] = None) -> str:
+        """Save a trained model as a new active version in the model store"""
+        version, path = self.model_store.create_version(name)
+        if isinstance(model, SentenceTransformer):
+            model.save(path)
+        else:
+            model.save_pretrained(path, safe_serialization=True)
+        if tokenizer is not None:
+            tokenizer.save_pretrained(path)
+        self.model_store.publish(name, version, metadata)
+        return version
+
+    def train_classifier(self, train_dataset: Dataset, eval_dataset: Dataset = None) -> str:
+        """Train the clause classification model
+        
+        With an eval_dataset, accuracy and macro F1 are computed every epoch
+        and the final evaluation is stored in the version's metadata.
+        """
+        training_args = self._training_arguments(self.model_store.run_dir(CLASSIFIER), eval_dataset)
+        data_collator = DataCollatorWithPadding(self.classifier_tokenizer, pad_to_multiple_of=8)
 
         trainer = Trainer(
             model=self.classifier_model,
             args=training_args,
             train_dataset=train_dataset,
             eval_dataset=eval_dataset,
+            data_collator=data_collator,
+            compute_metrics=_classifier_metrics if eval_dataset is not None else None,
         )
 
         trainer.train()
-        trainer.save_model()
+        metadata = {"base_model": BASE_MODEL, "training_samples": len(train_dataset)}
+        if eval_dataset is not None:
+            metadata["evaluation"] = trainer.evaluate()
+        return self._save_version(CLASSIFIER, self.classifier_model, self.classifier_tokenizer, metadata)
 
     def prepare_ner_dataset(self, texts: List[str], labels: List[List[int]]) -> Dataset:
         """Prepare dataset for NER training"""
-        class NERDataset(Dataset):
-            def __init__(self, texts, labels, tokenizer):
-                self.encodings = tokenizer(texts, truncation=True, padding=True)
-                self.labels = labels
-
-            def __getitem__(self, idx):
-                item = {key: torch.tensor(val[idx]) for key, val in self.encodings.items()}
-                item['labels'] = torch.tensor(self.labels[idx])
-                return item
-
-            def __len__(self):
-                return len(self.labels)
-
         return NERDataset(texts, labels, self.ner_tokenizer)
 
-    def train_ner(self, train_dataset: Dataset, eval_dataset: Dataset = None):
+    def train_ner(self, train_dataset: Dataset, eval_dataset: Dataset = None) -> str:
         """Train the NER model"""
-        training_args = TrainingArguments(
-            output_dir="./models/ner",
-            num_train_epochs=3,
-            per_device_train_batch_size=8,
-            per_device_eval_batch_size=8,
-            warmup_steps=500,
-            weight_decay=0.01,
-            logging_dir="./logs",
-            logging_steps=10,
-            evaluation_strategy="epoch" if eval_dataset else "no",
-        )
-
-        data_collator = DataCollatorForTokenClassification(self.ner_tokenizer)
+        training_args = self._training_arguments(self.model_store.run_dir(NER), eval_dataset)
+        data_collator = DataCollatorForTokenClassification(self.ner_tokenizer, pad_to_multiple_of=8)
 
         trainer = Trainer(
             model=self.ner_model,
@@ -171,69 +253,217 @@ class TrainingService:
         )
 
         trainer.train()
-        trainer.save_model()
+        return self._save_version(
+            NER,
+            self.ner_model,
+            self.ner_tokenizer,
+            {"base_model": BASE_MODEL, "training_samples": len(train_dataset)}
+        )
 
-    def train_sentence_transformer(self, original_texts: List[str], clean_texts: List[str]):
+    def train_sentence_transformer(
+        self,
+        sentence_pairs: List[Dict[str, Any]],
+        model: SentenceTransformer = None,
+        epochs: int = 3
+    ) -> str:
         """Train the sentence transformer model"""
-        train_examples = []
-        for orig, clean in zip(original_texts, clean_texts):
-            train_examples.append(InputExample(texts=[orig, clean], label=1.0))
+        model = model or self.sentence_transformer
+        train_examples = [
+            InputExample(texts=pair["texts"], label=pair["label"])
+            for pair in sentence_pairs
+        ]
 
         train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=16)
-        train_loss = losses.CosineSimilarityLoss(self.sentence_transformer)
+        train_loss = losses.CosineSimilarityLoss(model)
 
-        self.sentence_transformer.fit(
+        model.fit(
             train_objectives=[(train_dataloader, train_loss)],
-            epochs=3,
-            warmup_steps=100,
+            epochs=epochs,
+            warmup_steps=min(100, len(train_dataloader) * epochs // 10),
             show_progress_bar=True
         )
 
-        self.sentence_transformer.save("./models/sentence_transformer")
+        return self._save_version(
+            SENTENCE_TRANSFORMER,
+            model,
+            metadata={"base_model": BASE_SENTENCE_TRANSFORMER, "sentence_pairs": len(sentence_pairs)}
+        )
+
+    def _load_serving_classifier(self):
+        """Load the classifier currently being served, falling back to the base checkpoint"""
+        source = self.model_store.resolve(CLASSIFIER, BASE_MODEL)
+        tokenizer = AutoTokenizer.from_pretrained(source)
+        model = AutoModelForSequenceClassification.from_pretrained(source, num_labels=3).to(self.device)
+        return tokenizer, model
+
+    def _load_serving_sentence_transformer(self) -> SentenceTransformer:
+        """Load the sentence transformer currently being served"""
+        source = self.model_store.resolve(SENTENCE_TRANSFORMER, BASE_SENTENCE_TRANSFORMER)
+        return SentenceTransformer(source).to(self.device)
+
+    def incremental_status(self, db: Session) -> Dict[str, Any]:
+        """Report buffered and already trained feedback examples"""
+        buffered = db.query(func.count(TrainingExample.id)).filter(
+            TrainingExample.trained_at.is_(None)
+        ).scalar()
+        trained = db.query(func.count(TrainingExample.id)).filter(
+            TrainingExample.trained_at.isnot(None)
+        ).scalar()
+        return {
+            "buffered_examples": buffered,
+            "trained_examples": trained,
+            "min_examples": settings.INCREMENTAL_MIN_EXAMPLES,
+            "ready": buffered >= settings.INCREMENTAL_MIN_EXAMPLES
+        }
+
+    def incremental_finetune(self, db: Session, force: bool = False) -> Dict[str, Any]:
+        """Fine-tune the serving models on buffered feedback mixed with replayed history
+
+        Training starts from the current serving checkpoints and only sees the
+        new examples plus a bounded replay sample of older ones, so its cost
+        grows with the new data rather than with the whole history.
+        """
+        new_examples = db.query(TrainingExample).filter(
+            TrainingExample.trained_at.is_(None)
+        ).all()
+        if not new_examples or (len(new_examples) < settings.INCREMENTAL_MIN_EXAMPLES and not force):
+            return {
+                "status": "skipped",
+                "buffered_examples": len(new_examples),
+                "min_examples": settings.INCREMENTAL_MIN_EXAMPLES
+            }
+
+        # Replay a random sample of already trained examples to avoid forgetting
+        replay_count = int(len(new_examples) * settings.INCREMENTAL_REPLAY_RATIO)
+        replayed = []
+        if replay_count:
+            replayed = db.query(TrainingExample).filter(
+                TrainingExample.trained_at.isnot(None)
+            ).order_by(func.random()).limit(replay_count).all()
+        examples = new_examples + replayed
+
+        # Fine-tune the classifier from the serving checkpoint
+        tokenizer, model = self._load_serving_classifier()
+        use_lora = settings.INCREMENTAL_USE_LORA and LoraConfig is not None
+        if use_lora:
+            model = get_peft_model(model, LoraConfig(task_type="SEQ_CLS", r=8, lora_alpha=16, lora_dropout=0.1))
+
+        dataset = ClassificationDataset(
+            [example.original_text for example in examples],
+            [LABEL_IDS[example.label] for example in examples],
+            tokenizer
+        )
+        trainer = Trainer(
+            model=model,
+            args=self._training_arguments(
+                self.model_store.run_dir(CLASSIFIER),
+                num_train_epochs=settings.INCREMENTAL_EPOCHS,
+                learning_rate=settings.INCREMENTAL_LEARNING_RATE,
+                warmup_steps=0,
+                warmup_ratio=0.1,
+                save_strategy="no"
+            ),
+            train_dataset=dataset,
+            data_collator=DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8),
+        )
+        trainer.train()
+
+        if use_lora:
+            # Fold the adapters back in so serving loads a plain checkpoint
+            model = model.merge_and_unload()
+        models_saved = {
+            CLASSIFIER: self._save_version(
+                CLASSIFIER,
+                model,
+                tokenizer,
+                {"incremental": True, "new_examples": len(new_examples), "lora": use_lora}
+            )
+        }
+
+        # Fine-tune the sentence transformer on accepted or edited rewrites
+        aligned = [
+            {"original": example.original_text, "clean": example.revised_text, "label": example.label}
+            for example in examples
+            if example.revised_text is not None
+        ]
+        sentence_pairs = build_sentence_pairs(aligned)
+        if sentence_pairs:
+            models_saved[SENTENCE_TRANSFORMER] = self.train_sentence_transformer(
+                sentence_pairs,
+                model=self._load_serving_sentence_transformer(),
+                epochs=settings.INCREMENTAL_EPOCHS
+            )
+
+        trained_at = datetime.utcnow()
+        for example in new_examples:
+            example.trained_at = trained_at
+        db.commit()
+
+        return {
+            "status": "success",
+            "message": "Models fine-tuned incrementally",
+            "new_examples": len(new_examples),
+            "replayed_examples": len(replayed),
+            "sentence_pairs": len(sentence_pairs),
+            "lora": use_lora,
+            "models_saved": models_saved
+        }
 
     async def train_models(self, training_data: List[Dict[str, bytes]]):
         """Train all models using the provided training data"""
-        # Process DOCX files
+        # Process DOCX files into clause-level examples
         processed_data = []
-        
+        sentence_pairs = []
+
         for item in training_data:
             if "redline" in item:
-                # If we have a redline version, extract changes
-                changes = self.extract_changes_from_redline(item["redline"])
-                processed_data.extend(changes)
+                # If we have a redline version, extract changes per paragraph
+                aligned = [
+                    {
+                        "original": change["original"],
+                        "clean": change["redline"],
+                        "label": label_change(change["original"], change["redline"])
+                    }
+                    for change in self.extract_changes_from_redline(item["redline"])
+                ]
             else:
-                # If we have original and clean versions
+                # If we have original and clean versions, align them clause by clause
                 original_text = self.extract_text_from_docx(item["original"])
                 clean_text = self.extract_text_from_docx(item["clean"])
-                processed_data.append({
-                    "original": original_text,
-                    "redline": clean_text,  # Use clean text as redline for training
-                    "clean": clean_text
-                })
+                aligned = align_clauses(original_text, clean_text)
+
+            processed_data.extend(aligned)
+            sentence_pairs.extend(build_sentence_pairs(aligned))
 
-        # Extract texts from processed data
-        original_texts = [item["original"] for item in processed_data]
-        redline_texts = [item["redline"] for item in processed_data]
-        clean_texts = [item["clean"] for item in processed_data]
+        # Hold out a share of the clauses to evaluate the classifier on
+        random.Random(0).shuffle(processed_data)
+        holdout = int(len(processed_data) * settings.EVALUATION_HOLDOUT)
+        eval_data, train_data = processed_data[:holdout], processed_data[holdout:]
 
         # Train classifier
-        classifier_dataset = self.prepare_classification_dataset(original_texts, redline_texts)
-        self.train_classifier(classifier_dataset)
+        classifier_dataset = self.prepare_classification_dataset(train_data)
+        eval_dataset = self.prepare_classification_dataset(eval_data) if eval_data else None
+        models_saved = {CLASSIFIER: self.train_classifier(classifier_dataset, eval_dataset)}
 
         # Train NER (assuming we have labeled data for clause boundaries)
         # This would need to be implemented based on your specific needs
         # ner_dataset = self.prepare_ner_dataset(texts, labels)
         # self.train_ner(ner_dataset)
 
-        # Train sentence transformer
-        self.train_sentence_transformer(original_texts, clean_texts)
+        # Train sentence transformer on rewrites and hard negatives
+        if sentence_pairs:
+            models_saved[SENTENCE_TRANSFORMER] = self.train_sentence_transformer(sentence_pairs)
 
         return {
             "status": "success",
             "message": "Models trained successfully",
-            "models_saved": [
-                "./models/classifier",
-                "./models/sentence_transformer"
-            ],
-            "training_samples": len(processed_data)
-        } 
\ No newline at end of file
+            "models_saved": models_saved,
+            "training_samples": len(train_data),
+            "evaluation_samples": len(eval_data),
+            "sentence_pairs": len(sentence_pairs)
+        }
+
+@lru_cache(maxsize=None)
+def get_training_service() -> TrainingService:
+    """Process-wide TrainingService shared by all routers"""
+    return TrainingService()
@@ -0,0 +1,804 @@
+"""Vector index backends behind VectorStorage
+
+VECTOR_BACKEND selects where clause, document and feedback vectors live:
+
+    qdrant    a Qdrant server at VECTOR_DB_URL, configured by the collection
+              profiles in vector_profiles.py
+    embedded  an in-process index of normalized vectors in memory-mapped
+              NumPy files under VECTOR_DATA_DIR, searched without a network
+              hop; for single-node installs and tests
+
+Points are dicts with an "id", a dense "vector" and a "payload". Collections
+whose spec sets "lexical" also index the BM25 weights of payload["text"] for
+hybrid search. Hits are dicts with "id", "score" and "payload".
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import os
+import pickle
+import threading
+import time
+import numpy as np
+from qdrant_client.http import models
+from ..core.clients import get_client, QDRANT
+from ..core.config import settings
+from . import retrieval, vector_profiles
+
+# Named vectors of lexical Qdrant collections
+DENSE = "dense"
+LEXICAL = "lexical"
+
+class VectorBackend(ABC):
+    """Interface of the vector index backends"""
+
+    @abstractmethod
+    def setup(self, collections: Dict[str, Dict[str, Any]]):
+        """Create missing collections from their specs
+
+        A spec has the vector "size", whether the collection is "lexical"
+        and the "keyword_fields" and "integer_fields" used in filters.
+        """
+
+    @abstractmethod
+    def upsert(self, collection: str, points: List[Dict[str, Any]]):
+        """Insert points or replace the points with their IDs"""
+
+    @abstractmethod
+    def retrieve(self, collection: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Payloads of the points that exist, by ID"""
+
+    @abstractmethod
+    def set_payloads(self, collection: str, updates: List[Tuple[List[str], Dict[str, Any]]]):
+        """Merge each payload into the payloads of its points"""
+
+    @abstractmethod
+    def delete(self, collection: str, ids: List[str]):
+        """Delete the points with these IDs, ignoring missing ones"""
+
+    @abstractmethod
+    def search(
+        self,
+        collection: str,
+        vector: List[float],
+        limit: int,
+        conditions: Dict[str, Any] = None,
+        terms: List[str] = None,
+        hnsw_ef: int = None
+    ) -> List[List[Dict[str, Any]]]:
+        """The vector ranking, followed by the BM25 ranking of terms when given
+
+        conditions are exact payload matches; hnsw_ef is the search effort,
+        the HNSW ef for Qdrant and the number of IVF lists probed when
+        embedded.
+        """
+
+    def search_batch(
+        self,
+        collection: str,
+        vectors: List[List[float]],
+        limit: int,
+        conditions: Dict[str, Any] = None,
+        hnsw_ef: int = None
+    ) -> List[List[Dict[str, Any]]]:
+        """The vector ranking of each query vector"""
+        return [
+            self.search(collection, vector, limit, conditions=conditions, hnsw_ef=hnsw_ef)[0]
+            for vector in vectors
+        ]
+
+    @abstractmethod
+    def scroll(self, collection: str, batch_size: int = 256) -> Iterator[List[Dict[str, Any]]]:
+        """Every point of a collection with its dense vector, in batches"""
+
+    def snapshot(self):
+        """Persist the index where the backend does not do so itself"""
+
+class QdrantBackend(VectorBackend):
+    # Collection setups already done by this process
+    _prepared = set()
+
+    def __init__(self):
+        self.profile = vector_profiles.get_profile()
+        self._connect()
+        # Forked workers must not reuse the parent's pooled connections
+        os.register_at_fork(after_in_child=self._connect)
+        self._lexical = set()
+        # term -> (idf, expiry); document frequencies change slowly
+        self._idf_cache: Dict[str, tuple] = {}
+
+    def _connect(self):
+        # Pooled, with timeouts, retries and a circuit breaker (see core/clients.py)
+        self.client = get_client(QDRANT)
+        # Threads do not survive a fork, so each worker gets its own
+        self._counters = ThreadPoolExecutor(max_workers=settings.IDF_FETCH_CONCURRENCY, thread_name_prefix="idf")
+
+    def setup(self, collections: Dict[str, Dict[str, Any]]):
+        """Create the collections or bring them in line with the profile
+
+        Runs once per process, server and profile; forked workers inherit the
+        record from the master.
+        """
+        self._lexical |= {name for name, spec in collections.items() if spec.get("lexical")}
+        setup_key = (settings.VECTOR_DB_URL, tuple(sorted(self.profile.items())), tuple(sorted(collections)))
+        if setup_key in self._prepared:
+            return
+
+        collection_names = [collection.name for collection in self.client.get_collections().collections]
+        hnsw = vector_profiles.hnsw_config(self.profile)
+        quantization = vector_profiles.quantization_config(self.profile)
+
+        for collection_name, spec in collections.items():
+            lexical = collection_name in self._lexical
+            indexes = {field: models.PayloadSchemaType.KEYWORD for field in spec.get("keyword_fields", [])}
+            indexes.update({field: models.PayloadSchemaType.INTEGER for field in spec.get("integer_fields", [])})
+            if lexical:
+                # Document frequencies for BM25 are counted through the full-text index
+                indexes["text"] = models.TextIndexParams(
+                    type=models.TextIndexType.TEXT,
+                    tokenizer=models.TokenizerType.WORD,
+                    min_token_len=2,
+                    lowercase=True
+                )
+
+            if collection_name not in collection_names:
+                vectors = vector_profiles.vector_params(self.profile, spec["size"])
+                self.client.create_collection(
+                    collection_name=collection_name,
+                    vectors_config={DENSE: vectors} if lexical else vectors,
+                    sparse_vectors_config={LEXICAL: models.SparseVectorParams()} if lexical else None,
+                    hnsw_config=hnsw,
+                    quantization_config=quantization
+                )
+                existing_indexes = {}
+            else:
+                info = self.client.get_collection(collection_name)
+                existing_indexes = info.payload_schema
+                # Index parameters can change in place; moving vectors on or
+                # off disk needs the collection to be re-created
+                if (
+                    (info.config.hnsw_config.m, info.config.hnsw_config.ef_construct) != (hnsw.m, hnsw.ef_construct)
+                    or info.config.quantization_config != quantization
+                ):
+                    self.client.update_collection(
+                        collection_name=collection_name,
+                        hnsw_config=hnsw,
+                        quantization_config=quantization or models.Disabled.DISABLED
+                    )
+
+            for field_name, field_schema in indexes.items():
+                if field_name not in existing_indexes:
+                    self.client.create_payload_index(
+                        collection_name=collection_name,
+                        field_name=field_name,
+                        field_schema=field_schema
+                    )
+
+        self._prepared.add(setup_key)
+
+    def upsert(self, collection: str, points: List[Dict[str, Any]]):
+        structs = []
+        for point in points:
+            vector = point["vector"]
+            if collection in self._lexical:
+                indices, values = retrieval.document_vector(point["payload"]["text"])
+                vector = {DENSE: vector, LEXICAL: models.SparseVector(indices=indices, values=values)}
+            structs.append(models.PointStruct(id=point["id"], vector=vector, payload=point["payload"]))
+        self.client.upsert(collection_name=collection, points=structs)
+
+    def scroll(self, collection: str, batch_size: int = 256) -> Iterator[List[Dict[str, Any]]]:
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=collection,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=[DENSE] if collection in self._lexical else True
+            )
+            yield [
+                {
+                    "id": str(record.id),
+                    "vector": record.vector[DENSE] if collection in self._lexical else record.vector,
+                    "payload": record.payload
+                }
+                for record in records
+            ]
+            if offset is None:
+                return
+
+    def retrieve(self, collection: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {
+            record.id: record.payload
+            for record in self.client.retrieve(collection_name=collection, ids=ids, with_payload=True)
+        }
+
+    def set_payloads(self, collection: str, updates: List[Tuple[List[str], Dict[str, Any]]]):
+        if updates:
+            self.client.batch_update_points(
+                collection_name=collection,
+                update_operations=[
+                    models.SetPayloadOperation(set_payload=models.SetPayload(payload=payload, points=ids))
+                    for ids, payload in updates
+                ]
+            )
+
+    def delete(self, collection: str, ids: List[str]):
+        if ids:
+            self.client.delete(collection_name=collection, points_selector=models.PointIdsList(points=ids))
+
+    @staticmethod
+    def _filter(conditions: Dict[str, Any]) -> Optional[models.Filter]:
+        must = [
+            models.FieldCondition(key=key, match=models.MatchValue(value=value))
+            for key, value in (conditions or {}).items()
+            if value is not None
+        ]
+        return models.Filter(must=must) if must else None
+
+    def _count(self, collection: str, term: str = None) -> int:
+        """Approximate number of points, or of points whose text contains term"""
+        count_filter = None
+        if term is not None:
+            count_filter = models.Filter(must=[
+                models.FieldCondition(key="text", match=models.MatchText(text=term))
+            ])
+        return self.client.count(collection_name=collection, count_filter=count_filter, exact=False).count
+
+    def _idf(self, collection: str, terms: List[str]) -> Dict[str, float]:
+        """IDF of each term over a collection, cached for IDF_CACHE_SECONDS
+
+        Qdrant counts one filter per request, so the counts of uncached terms
+        are requested concurrently, IDF_FETCH_CONCURRENCY at a time.
+        """
+        now = time.time()
+        missing = [term for term in terms if self._idf_cache.get((collection, term), (None, 0))[1] <= now]
+        if missing:
+            total = self._counters.submit(self._count, collection)
+            document_frequencies = list(self._counters.map(lambda term: self._count(collection, term), missing))
+            if len(self._idf_cache) > settings.IDF_CACHE_SIZE:
+                self._idf_cache.clear()
+            for term, document_frequency in zip(missing, document_frequencies):
+                self._idf_cache[(collection, term)] = (
+                    retrieval.idf(document_frequency, total.result()),
+                    now + settings.IDF_CACHE_SECONDS
+                )
+        return {term: self._idf_cache[(collection, term)][0] for term in terms}
+
+    def search(self, collection, vector, limit, conditions=None, terms=None, hnsw_ef=None):
+        query_filter = self._filter(conditions)
+        lexical = collection in self._lexical
+        params = vector_profiles.search_params(self.profile, hnsw_ef)
+        requests = [
+            models.SearchRequest(
+                vector=models.NamedVector(name=DENSE, vector=vector) if lexical else vector,
+                filter=query_filter,
+                params=params,
+                limit=limit,
+                with_payload=True
+            )
+        ]
+        if terms and lexical:
+            indices, values = retrieval.query_vector(self._idf(collection, terms))
+            requests.append(models.SearchRequest(
+                vector=models.NamedSparseVector(
+                    name=LEXICAL,
+                    vector=models.SparseVector(indices=indices, values=values)
+                ),
+                filter=query_filter,
+                limit=limit,
+                with_payload=True
+            ))
+
+        # All rankings come back in a single round trip
+        rankings = self.client.search_batch(collection_name=collection, requests=requests)
+        return [
+            [{"id": hit.id, "score": hit.score, "payload": hit.payload} for hit in ranking]
+            for ranking in rankings
+        ]
+
+    def search_batch(self, collection, vectors, limit, conditions=None, hnsw_ef=None):
+        query_filter = self._filter(conditions)
+        lexical = collection in self._lexical
+        params = vector_profiles.search_params(self.profile, hnsw_ef)
+        rankings = self.client.search_batch(collection_name=collection, requests=[
+            models.SearchRequest(
+                vector=models.NamedVector(name=DENSE, vector=vector) if lexical else vector,
+                filter=query_filter,
+                params=params,
+                limit=limit,
+                with_payload=True
+            )
+            for vector in vectors
+        ])
+        return [
+            [{"id": hit.id, "score": hit.score, "payload": hit.payload} for hit in ranking]
+            for ranking in rankings
+        ]
+
+class _EmbeddedCollection:
+    """One collection of the embedded backend
+
+    Vectors are rows of a memory-mapped float32 matrix that doubles in
+    capacity as it fills. Rows are never rewritten: updates append a new row
+    and deletes clear the row's live flag until the next compaction, which
+    writes the live rows to a new generation of the file that the state
+    switches to when it is next saved. Rows
+    below indexed_upto are covered by the IVF lists and the CSC matrix of
+    BM25 weights; newer rows form a tail that is scanned exhaustively until
+    it grows large enough to be merged in.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, path: str, spec: Dict[str, Any]):
+        self.path = path
+        self.size = spec["size"]
+        self.lexical = bool(spec.get("lexical"))
+        self.indexed_fields = list(spec.get("keyword_fields", [])) + list(spec.get("integer_fields", []))
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        state_path = os.path.join(path, "state.pkl")
+        if os.path.exists(state_path):
+            with open(state_path, "rb") as f:
+                state = pickle.load(f)
+            self.generation = state.get("generation", 0)
+            self.vectors = np.load(self._vectors_path(), mmap_mode="r+")
+        else:
+            state = {
+                "count": 0, "ids": [], "payloads": [], "live": np.zeros(0, dtype=bool),
+                "centroids": None, "trained_at": 0, "assignments": np.zeros(0, dtype=np.int32), "indexed_upto": 0,
+                "lex_rows": np.zeros(0, dtype=np.int64), "lex_terms": np.zeros(0, dtype=np.uint32),
+                "lex_weights": np.zeros(0, dtype=np.float32), "pending_lex": [],
+            }
+            self.generation = 0
+            self.vectors = np.lib.format.open_memmap(
+                self._vectors_path(), mode="w+", dtype=np.float32, shape=(self.INITIAL_CAPACITY, self.size)
+            )
+        # Generation of the vectors file the saved state still points at
+        self._saved_generation = self.generation
+
+        self.count = state["count"]
+        self.ids: List[str] = state["ids"]
+        self.payloads: List[Dict[str, Any]] = state["payloads"]
+        self.live = np.zeros(len(self.vectors), dtype=bool)
+        self.live[:len(state["live"])] = state["live"]
+        self.row_of = {point_id: row for row, point_id in enumerate(self.ids) if self.live[row]}
+        self.centroids = state["centroids"]
+        self.trained_at = state["trained_at"]
+        self.assignments = state["assignments"]
+        self.indexed_upto = state["indexed_upto"]
+        self.lex_rows = state["lex_rows"]
+        self.lex_terms = state["lex_terms"]
+        self.lex_weights = state["lex_weights"]
+        self._pending_lex: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = state["pending_lex"]
+
+        self._field_index: Dict[str, Dict[Any, set]] = {field: {} for field in self.indexed_fields}
+        for row in self.row_of.values():
+            self._index_payload(row)
+        self._build_lists()
+        self._build_lexical()
+
+    def _vectors_path(self, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f"vectors-{generation}.npy" if generation else "vectors.npy")
+
+    # Payload index
+
+    def _index_payload(self, row: int, remove: bool = False):
+        payload = self.payloads[row]
+        for field, index in self._field_index.items():
+            if field in payload:
+                rows = index.setdefault(payload[field], set())
+                if remove:
+                    rows.discard(row)
+                else:
+                    rows.add(row)
+
+    def _mask(self, conditions: Dict[str, Any]) -> np.ndarray:
+        """Live rows matching every condition"""
+        mask = self.live[:self.count].copy()
+        for field, value in (conditions or {}).items():
+            if value is None:
+                continue
+            if field in self._field_index:
+                rows = self._field_index[field].get(value, ())
+                matched = np.zeros(self.count, dtype=bool)
+                matched[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+            else:
+                matched = np.array([payload.get(field) == value for payload in self.payloads], dtype=bool)
+            mask &= matched
+        return mask
+
+    # Writes
+
+    def _grow(self, needed: int):
+        capacity = len(self.vectors)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        vectors_path = self._vectors_path()
+        grown = np.lib.format.open_memmap(vectors_path + ".tmp", mode="w+", dtype=np.float32, shape=(capacity, self.size))
+        grown[:self.count] = self.vectors[:self.count]
+        grown.flush()
+        del grown
+        self.vectors = None
+        os.replace(vectors_path + ".tmp", vectors_path)
+        self.vectors = np.load(vectors_path, mmap_mode="r+")
+        self.live = np.concatenate([self.live, np.zeros(capacity - len(self.live), dtype=bool)])
+
+    def upsert(self, points: List[Dict[str, Any]]):
+        with self.lock:
+            self.delete([point["id"] for point in points if point["id"] in self.row_of])
+            self._grow(self.count + len(points))
+            vectors = np.asarray([point["vector"] for point in points], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            start = self.count
+            self.vectors[start:start + len(points)] = vectors / np.where(norms == 0, 1, norms)
+            for offset, point in enumerate(points):
+                row = start + offset
+                self.ids.append(point["id"])
+                self.payloads.append(dict(point["payload"]))
+                self.row_of[point["id"]] = row
+                self.live[row] = True
+                self._index_payload(row)
+                if self.lexical:
+                    indices, values = retrieval.document_vector(point["payload"].get("text", ""))
+                    self._pending_lex.append((
+                        np.full(len(indices), row, dtype=np.int64),
+                        np.asarray(indices, dtype=np.uint32),
+                        np.asarray(values, dtype=np.float32)
+                    ))
+            self.count += len(points)
+            self._tail_lexical = None
+            self._maybe_merge_tail()
+
+    def set_payload(self, ids: List[str], payload: Dict[str, Any]):
+        with self.lock:
+            for point_id in ids:
+                row = self.row_of.get(point_id)
+                if row is not None:
+                    self._index_payload(row, remove=True)
+                    self.payloads[row].update(payload)
+                    self._index_payload(row)
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            for point_id in ids:
+                row = self.row_of.pop(point_id, None)
+                if row is not None:
+                    self._index_payload(row, remove=True)
+                    self.live[row] = False
+
+    # Indexes
+
+    def _use_ivf(self) -> bool:
+        mode = settings.VECTOR_EMBEDDED_INDEX
+        return mode == "ivf" or (mode == "auto" and self.count >= settings.VECTOR_EMBEDDED_IVF_MIN_POINTS)
+
+    def _train(self):
+        """k-means centroids over a sample of the live vectors"""
+        rows = np.flatnonzero(self.live[:self.count])
+        lists = max(int(np.sqrt(len(rows))), 1)
+        rng = np.random.default_rng(0)
+        sample = self.vectors[np.sort(rng.choice(rows, size=min(len(rows), lists * 40), replace=False))]
+        centroids = sample[rng.choice(len(sample), size=lists, replace=False)]
+        for _ in range(10):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Lists that lost all their members keep their old centroid
+            centroids = np.where(norms > 0, sums / np.where(norms == 0, 1, norms), centroids)
+        self.centroids = centroids
+        self.trained_at = len(rows)
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.indexed_upto = 0
+
+    def _assign(self, start: int, end: int):
+        chunks = [self.assignments]
+        for offset in range(start, end, 65536):
+            block = self.vectors[offset:min(offset + 65536, end)]
+            chunks.append(np.argmax(block @ self.centroids.T, axis=1).astype(np.int32))
+        self.assignments = np.concatenate(chunks)
+
+    def _build_lists(self):
+        if self.centroids is None:
+            self._list_order = self._list_offsets = None
+            return
+        self._list_order = np.argsort(self.assignments, kind="stable")
+        self._list_offsets = np.searchsorted(self.assignments[self._list_order], np.arange(len(self.centroids) + 1))
+
+    def _build_lexical(self):
+        from scipy.sparse import csc_matrix
+        self._tail_lexical = None
+        if not self.lexical or not len(self.lex_terms):
+            self._lex_vocabulary = np.zeros(0, dtype=np.uint32)
+            self._lex_matrix = None
+            return
+        # Hashed term IDs are remapped to dense columns
+        self._lex_vocabulary, columns = np.unique(self.lex_terms, return_inverse=True)
+        self._lex_matrix = csc_matrix(
+            (self.lex_weights, (self.lex_rows, columns)),
+            shape=(self.indexed_upto, len(self._lex_vocabulary))
+        )
+
+    def _maybe_merge_tail(self):
+        tail = self.count - self.indexed_upto
+        if tail < max(settings.VECTOR_EMBEDDED_TAIL, self.indexed_upto // 10):
+            return
+        self.merge_tail()
+
+    def merge_tail(self):
+        """Fold the tail rows into the IVF lists and the BM25 matrix"""
+        with self.lock:
+            if self.centroids is not None or self._use_ivf():
+                live = int(self.live[:self.count].sum())
+                # Retrain once the collection has quadrupled since training;
+                # there is nothing to train on while every row is deleted
+                if live and (self.centroids is None or live > 4 * self.trained_at):
+                    self._train()
+                if self.centroids is not None:
+                    self._assign(self.indexed_upto, self.count)
+            if self._pending_lex:
+                rows, terms, weights = zip(*self._pending_lex)
+                self.lex_rows = np.concatenate([self.lex_rows, *rows])
+                self.lex_terms = np.concatenate([self.lex_terms, *terms])
+                self.lex_weights = np.concatenate([self.lex_weights, *weights])
+                self._pending_lex = []
+            self.indexed_upto = self.count
+            self._build_lists()
+            self._build_lexical()
+
+    # Search
+
+    def _top(self, rows: np.ndarray, scores: np.ndarray, limit: int) -> List[Dict[str, Any]]:
+        if len(rows) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return [
+            {"id": self.ids[row], "score": float(score), "payload": self.payloads[row]}
+            for row, score in zip(rows[order], scores[order])
+        ]
+
+    def search(self, vector, limit, conditions=None, nprobe=None) -> List[Dict[str, Any]]:
+        with self.lock:
+            if not self.count:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1
+            mask = self._mask(conditions)
+            selected = int(mask.sum())
+
+            if self._list_order is None or not self._use_ivf() or selected <= settings.VECTOR_EMBEDDED_TAIL:
+                # Exact search, also used when a filter leaves few candidates
+                rows = np.flatnonzero(mask)
+                if selected < self.count // 4:
+                    return self._top(rows, self.vectors[rows] @ query, limit)
+                return self._top(rows, (self.vectors[:self.count] @ query)[rows], limit)
+
+            nprobe = min(nprobe or settings.VECTOR_EMBEDDED_NPROBE, len(self.centroids))
+            probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            rows = np.concatenate(
+                [self._list_order[self._list_offsets[index]:self._list_offsets[index + 1]] for index in probed]
+                + [np.arange(self.indexed_upto, self.count)]
+            )
+            rows = np.sort(rows[mask[rows]])
+            return self._top(rows, self.vectors[rows] @ query, limit)
+
+    def _tail_matrix(self):
+        """BM25 weights of the tail rows, rebuilt after each write"""
+        if self._tail_lexical is None:
+            from scipy.sparse import csc_matrix
+            if self._pending_lex:
+                rows, terms, weights = (np.concatenate(parts) for parts in zip(*self._pending_lex))
+                vocabulary, columns = np.unique(terms, return_inverse=True)
+                matrix = csc_matrix(
+                    (weights, (rows - self.indexed_upto, columns)),
+                    shape=(self.count - self.indexed_upto, len(vocabulary))
+                )
+                self._tail_lexical = (vocabulary, matrix)
+            else:
+                self._tail_lexical = (np.zeros(0, dtype=np.uint32), None)
+        return self._tail_lexical
+
+    @staticmethod
+    def _columns(vocabulary: np.ndarray, term_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Matrix columns of the terms present in a vocabulary, and which terms they are"""
+        positions = np.minimum(np.searchsorted(vocabulary, term_ids), max(len(vocabulary) - 1, 0))
+        present = np.flatnonzero(vocabulary[positions] == term_ids) if len(vocabulary) else np.zeros(0, dtype=np.int64)
+        return positions[present], present
+
+    def lexical_search(self, terms: List[str], limit: int, conditions=None) -> List[Dict[str, Any]]:
+        with self.lock:
+            if not self.lexical or not self.count:
+                return []
+            term_ids = np.asarray([retrieval.term_index(term) for term in terms], dtype=np.uint32)
+            parts = [(self._lex_vocabulary, self._lex_matrix, 0), (*self._tail_matrix(), self.indexed_upto)]
+
+            # Document frequencies over both parts, counting deleted rows too
+            frequencies = np.zeros(len(terms))
+            for vocabulary, matrix, _ in parts:
+                if matrix is not None:
+                    columns, present = self._columns(vocabulary, term_ids)
+                    frequencies[present] += np.diff(matrix.indptr)[columns]
+            total = int(self.live[:self.count].sum())
+            weights = np.asarray([retrieval.idf(frequency, total) for frequency in frequencies])
+
+            scores = np.zeros(self.count, dtype=np.float32)
+            for vocabulary, matrix, offset in parts:
+                if matrix is not None:
+                    columns, present = self._columns(vocabulary, term_ids)
+                    if len(columns):
+                        scores[offset:offset + matrix.shape[0]] += matrix[:, columns] @ weights[present]
+
+            rows = np.flatnonzero(self._mask(conditions) & (scores > 0))
+            return self._top(rows, scores[rows], limit)
+
+    # Persistence
+
+    def compact(self):
+        """Drop deleted rows, renumbering the remaining ones
+
+        The remaining rows go to the next generation of the vectors file;
+        the saved state keeps pointing at the previous one until snapshot()
+        replaces it, so a crash in between loses nothing.
+        """
+        with self.lock:
+            self.merge_tail()
+            keep = np.flatnonzero(self.live[:self.count])
+            new_row = np.full(self.count, -1, dtype=np.int64)
+            new_row[keep] = np.arange(len(keep))
+            compacted = np.lib.format.open_memmap(
+                self._vectors_path(self.generation + 1), mode="w+", dtype=np.float32, shape=self.vectors.shape
+            )
+            compacted[:len(keep)] = self.vectors[keep]
+            compacted.flush()
+            self.generation += 1
+            self.vectors = compacted
+            self.ids = [self.ids[row] for row in keep]
+            self.payloads = [self.payloads[row] for row in keep]
+            self.live[:] = False
+            self.live[:len(keep)] = True
+            if len(self.assignments):
+                self.assignments = self.assignments[keep]
+            kept = new_row[self.lex_rows] >= 0
+            self.lex_rows = new_row[self.lex_rows[kept]]
+            self.lex_terms = self.lex_terms[kept]
+            self.lex_weights = self.lex_weights[kept]
+            self.count = self.indexed_upto = len(keep)
+            self.row_of = {point_id: row for row, point_id in enumerate(self.ids)}
+            self._field_index = {field: {} for field in self.indexed_fields}
+            for row in range(self.count):
+                self._index_payload(row)
+            self._build_lists()
+            self._build_lexical()
+
+    def snapshot(self):
+        """Flush the vectors and atomically write the rest of the state"""
+        with self.lock:
+            if self.count and self.live[:self.count].sum() < self.count * (1 - settings.VECTOR_EMBEDDED_COMPACT_RATIO):
+                self.compact()
+            self.vectors.flush()
+            state = {
+                "count": self.count,
+                "ids": self.ids,
+                "payloads": self.payloads,
+                "live": self.live[:self.count].copy(),
+                "centroids": self.centroids,
+                "trained_at": self.trained_at,
+                "assignments": self.assignments,
+                "indexed_upto": self.indexed_upto,
+                "lex_rows": self.lex_rows,
+                "lex_terms": self.lex_terms,
+                "lex_weights": self.lex_weights,
+                "pending_lex": [tuple(np.concatenate(parts) for parts in zip(*self._pending_lex))] if self._pending_lex else [],
+                "generation": self.generation,
+            }
+            state_path = os.path.join(self.path, "state.pkl")
+            with open(state_path + ".tmp", "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(state_path + ".tmp", state_path)
+            # Vectors files of earlier generations are no longer referenced
+            for generation in range(self._saved_generation, self.generation):
+                if os.path.exists(self._vectors_path(generation)):
+                    os.remove(self._vectors_path(generation))
+            self._saved_generation = self.generation
+
+class EmbeddedBackend(VectorBackend):
+    """In-process backend; one process must own VECTOR_DATA_DIR
+
+    Forked serving workers each get a private copy of the index, so writes
+    are not shared between them; use it with a single worker. The index is
+    snapshotted every VECTOR_SNAPSHOT_EVERY writes and by whoever owns it on
+    shutdown: the serving process when the API's lifespan ends (see
+    deps.shutdown()), never the pre-fork master, whose copy is stale.
+    """
+
+    def __init__(self, data_dir: str = None):
+        self.data_dir = data_dir or settings.VECTOR_DATA_DIR
+        self.collections: Dict[str, _EmbeddedCollection] = {}
+        self._specs: Dict[str, Dict[str, Any]] = {}
+        self._writes = 0
+        # A worker restarted by the pre-fork master would otherwise start from
+        # the master's copy, older than what the previous worker saved
+        os.register_at_fork(after_in_child=self._reload)
+
+    def setup(self, collections: Dict[str, Dict[str, Any]]):
+        for name, spec in collections.items():
+            if name not in self.collections:
+                self.collections[name] = _EmbeddedCollection(os.path.join(self.data_dir, name), spec)
+                self._specs[name] = spec
+
+    def _reload(self):
+        self.collections = {
+            name: _EmbeddedCollection(os.path.join(self.data_dir, name), spec)
+            for name, spec in self._specs.items()
+        }
+        self._writes = 0
+
+    def _written(self, count: int):
+        self._writes += count
+        if settings.VECTOR_SNAPSHOT_EVERY and self._writes >= settings.VECTOR_SNAPSHOT_EVERY:
+            self.snapshot()
+
+    def upsert(self, collection, points):
+        if points:
+            self.collections[collection].upsert(points)
+            self._written(len(points))
+
+    def retrieve(self, collection, ids):
+        store = self.collections[collection]
+        with store.lock:
+            return {
+                point_id: dict(store.payloads[store.row_of[point_id]])
+                for point_id in ids
+                if point_id in store.row_of
+            }
+
+    def set_payloads(self, collection, updates):
+        for ids, payload in updates:
+            self.collections[collection].set_payload(ids, payload)
+        self._written(sum(len(ids) for ids, _ in updates))
+
+    def delete(self, collection, ids):
+        self.collections[collection].delete(ids)
+        self._written(len(ids))
+
+    def search(self, collection, vector, limit, conditions=None, terms=None, hnsw_ef=None):
+        store = self.collections[collection]
+        rankings = [store.search(vector, limit, conditions, nprobe=hnsw_ef)]
+        if terms and store.lexical:
+            rankings.append(store.lexical_search(terms, limit, conditions))
+        return rankings
+
+    def scroll(self, collection, batch_size=256):
+        store = self.collections[collection]
+        with store.lock:
+            ids = list(store.row_of)
+        # Rows move on compaction, so each batch looks its points up again
+        for start in range(0, len(ids), batch_size):
+            with store.lock:
+                rows = [store.row_of[point_id] for point_id in ids[start:start + batch_size] if point_id in store.row_of]
+                batch = [
+                    {"id": store.ids[row], "vector": np.array(store.vectors[row]), "payload": dict(store.payloads[row])}
+                    for row in rows
+                ]
+            yield batch
+
+    def snapshot(self):
+        for store in self.collections.values():
+            store.snapshot()
+        self._writes = 0
+
+def get_backend(name: str = None) -> VectorBackend:
+    """The backend selected by VECTOR_BACKEND"""
+    name = name or settings.VECTOR_BACKEND
+    if name == "qdrant":
+        return QdrantBackend()
+    if name == "embedded":
+        return EmbeddedBackend()
+    raise ValueError(f"Unknown vector backend {name!r}, expected qdrant or embedded")
@@ -1,119 +1,306 @@
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
+import uuid
 import numpy as np
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
 from sentence_transformers import SentenceTransformer
 from ..core.config import settings
+from ..core.metrics import tracked
+from . import retrieval
+from .vector_backends import get_backend
+from .embedding_reduction import active_projection, ProjectedBackend
+
+CLAUSES = "nda-clauses"
+DOCUMENTS = "nda-documents"
+FEEDBACK = "nda-feedback"
+APPROVED = "nda-approved-clauses"
+REWRITES = "nda-accepted-rewrites"
+
+EMBEDDING_SIZE = 384  # Dimension for all-MiniLM-L6-v2
+
+# Payload fields used in filters are indexed so filtered searches stay fast
+# as collections grow; clause text is also indexed for BM25
+COLLECTIONS = {
+    CLAUSES: {
+        "size": EMBEDDING_SIZE,
+        "lexical": True,
+        "keyword_fields": ["clause_type", "label"],
+        "integer_fields": ["ref_count"],
+    },
+    DOCUMENTS: {
+        "size": EMBEDDING_SIZE,
+        "keyword_fields": ["document_id"],
+    },
+    FEEDBACK: {
+        "size": EMBEDDING_SIZE,
+        "keyword_fields": ["document_id"],
+    },
+    # Clauses reviewers kept unchanged; not reference counted, approvals outlive documents
+    APPROVED: {
+        "size": EMBEDDING_SIZE,
+    },
+    # Original clauses of accepted suggestions, with the accepted rewrite in the payload
+    REWRITES: {
+        "size": EMBEDDING_SIZE,
+    },
+}
+
+# Qdrant only accepts unsigned integers and UUIDs as point IDs, so IDs are
+# UUIDv5s of entity keys; the same key always maps to the same point
+POINT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "nda-validator")
+
+def point_id(*key: Any) -> str:
+    """Deterministic point ID for an entity key"""
+    return str(uuid.uuid5(POINT_NAMESPACE, "\x1f".join(str(part) for part in key)))
+
+def clause_point_id(text: str) -> str:
+    """Point ID of a clause, shared by every document containing the same text"""
+    return point_id("clause", " ".join(text.split()))
+
+def _approved_id(text: str) -> str:
+    return point_id("approved", " ".join(text.split()))
+
+def _rewrite_id(original: str) -> str:
+    return point_id("rewrite", " ".join(original.split()))
 
 class VectorStorage:
     def __init__(self):
-        self.client = QdrantClient(url=settings.VECTOR_DB_URL)
-        self.collection_name = "nda-embeddings"
-        self._ensure_collection_exists()
+        # Qdrant or the embedded index, see vector_backends.py
+        self.backend = get_backend()
+        # Reduced-dimension copies of the collections, see embedding_reduction.py
+        projection = active_projection()
+        if projection is not None:
+            self.backend = ProjectedBackend(self.backend, projection)
+        self.backend.setup(COLLECTIONS)
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
 
-    def _ensure_collection_exists(self):
-        """Ensure the Qdrant collection exists"""
-        collections = self.client.get_collections().collections
-        collection_names = [collection.name for collection in collections]
-        
-        if self.collection_name not in collection_names:
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=models.VectorParams(
-                    size=384,  # Dimension for all-MiniLM-L6-v2
-                    distance=models.Distance.COSINE
-                )
-            )
-
+    @tracked("vector_storage")
     def create_embedding(self, text: str) -> List[float]:
         """Create an embedding for a text"""
         return self.model.encode(text).tolist()
 
+    @tracked("vector_storage")
     def store_document_embedding(self, document_id: str, text: str, metadata: Dict[str, Any] = None):
-        """Store a document embedding in Qdrant"""
-        embedding = self.create_embedding(text)
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=[
-                models.PointStruct(
-                    id=document_id,
-                    vector=embedding,
-                    payload=metadata or {}
-                )
-            ]
-        )
+        """Store a document embedding"""
+        self.backend.upsert(DOCUMENTS, [{
+            "id": point_id("document", document_id),
+            "vector": self.create_embedding(text),
+            "payload": {**(metadata or {}), "document_id": document_id}
+        }])
 
-    def store_clause_embedding(self, document_id: str, clause_id: str, text: str, metadata: Dict[str, Any] = None):
-        """Store a clause embedding in Qdrant"""
-        embedding = self.create_embedding(text)
-        vector_id = f"{document_id}:{clause_id}"
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=[
-                models.PointStruct(
-                    id=vector_id,
-                    vector=embedding,
-                    payload=metadata or {}
-                )
-            ]
-        )
+    @tracked("vector_storage")
+    def store_clause_embeddings(self, clauses: List[Dict[str, Any]]):
+        """Add a reference to each clause, embedding only clauses not stored yet
 
-    def find_similar_clauses(self, text: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Find similar clauses based on text similarity"""
-        query_embedding = self.create_embedding(text)
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_embedding,
-            limit=top_k,
-            with_payload=True
+        Each clause dict needs a "text" and may carry "label" and
+        "clause_type". Call once per document analysis with that document's
+        clauses, and release_clause_embeddings() when the analysis is replaced.
+        Qdrant has no atomic increment, so concurrent analyses sharing a clause
+        can lose an update; a clause deleted early is re-created on next use.
+        """
+        by_id = {}
+        for clause in clauses:
+            by_id.setdefault(clause_point_id(clause["text"]), clause)
+        if not by_id:
+            return
+        
+        existing = self.backend.retrieve(CLAUSES, list(by_id))
+        
+        # Known clauses only need their reference count bumped
+        self._set_ref_counts({
+            clause_id: payload.get("ref_count", 0) + 1 for clause_id, payload in existing.items()
+        })
+        
+        new_ids = [clause_id for clause_id in by_id if clause_id not in existing]
+        if new_ids:
+            texts = [by_id[clause_id]["text"] for clause_id in new_ids]
+            embeddings = self.model.encode(texts)
+            self.backend.upsert(CLAUSES, [
+                {
+                    "id": clause_id,
+                    "vector": embedding.tolist(),
+                    "payload": {
+                        **{key: by_id[clause_id][key] for key in ("label", "clause_type") if by_id[clause_id].get(key) is not None},
+                        "text": text,
+                        "ref_count": 1
+                    }
+                }
+                for clause_id, text, embedding in zip(new_ids, texts, embeddings)
+            ])
+
+    @tracked("vector_storage")
+    def release_clause_embeddings(self, texts: List[str]):
+        """Drop a reference to each clause, deleting clauses nobody references"""
+        clause_ids = list(dict.fromkeys(clause_point_id(text) for text in texts))
+        if not clause_ids:
+            return
+        counts = {
+            clause_id: payload.get("ref_count", 0) - 1
+            for clause_id, payload in self.backend.retrieve(CLAUSES, clause_ids).items()
+        }
+        self.backend.delete(CLAUSES, [clause_id for clause_id, count in counts.items() if count <= 0])
+        self._set_ref_counts({clause_id: count for clause_id, count in counts.items() if count > 0})
+
+    @tracked("vector_storage")
+    def replace_clause_embeddings(self, previous_texts: List[str], clauses: List[Dict[str, Any]]):
+        """Move a document's references from its previous analysis to a new one
+
+        New references are added before old ones are dropped, so clauses in
+        both are never deleted in between. Call it only once the analysis is
+        committed: a rolled back analysis must not change reference counts.
+        """
+        self.store_clause_embeddings(clauses)
+        self.release_clause_embeddings(previous_texts)
+
+    def _set_ref_counts(self, counts: Dict[str, int]):
+        """Write reference counts, one payload update per distinct count"""
+        by_count: Dict[int, List[str]] = {}
+        for clause_id, count in counts.items():
+            by_count.setdefault(count, []).append(clause_id)
+        self.backend.set_payloads(CLAUSES, [
+            (clause_ids, {"ref_count": count}) for count, clause_ids in by_count.items()
+        ])
+
+    @tracked("vector_storage")
+    def find_similar_clauses(
+        self,
+        text: str,
+        top_k: int = 5,
+        clause_type: str = None,
+        label: str = None,
+        hnsw_ef: int = None
+    ) -> List[Dict[str, Any]]:
+        """Find similar clauses by fusing vector and BM25 rankings
+
+        hnsw_ef trades recall for latency of the vector search and defaults
+        to the search_ef of the collection profile.
+        """
+        # Lexical ranking catches exact legal terms that embeddings blur together
+        rankings = self.backend.search(
+            CLAUSES,
+            self.create_embedding(text),
+            limit=max(top_k, settings.HYBRID_CANDIDATES),
+            conditions={"clause_type": clause_type, "label": label},
+            terms=retrieval.query_terms(text) if settings.HYBRID_SEARCH else None,
+            hnsw_ef=hnsw_ef
         )
         return [
             {
-                "id": hit.id,
-                "score": hit.score,
-                "metadata": hit.payload
+                "id": hit["id"],
+                "score": score,
+                "metadata": hit["payload"]
             }
-            for hit in results
+            for hit, score in retrieval.reciprocal_rank_fusion(rankings, key=lambda hit: hit["id"])[:top_k]
         ]
 
+    @tracked("vector_storage")
     def store_feedback_embedding(self, document_id: str, feedback_id: str, text: str, metadata: Dict[str, Any] = None):
         """Store feedback embedding for learning"""
-        embedding = self.create_embedding(text)
-        vector_id = f"feedback:{document_id}:{feedback_id}"
-        self.client.upsert(
-            collection_name=self.collection_name,
-            points=[
-                models.PointStruct(
-                    id=vector_id,
-                    vector=embedding,
-                    payload=metadata or {}
-                )
-            ]
-        )
+        self.backend.upsert(FEEDBACK, [{
+            "id": point_id("feedback", feedback_id),
+            "vector": self.create_embedding(text),
+            "payload": {**(metadata or {}), "document_id": document_id, "feedback_id": feedback_id, "text": text}
+        }])
 
-    def find_similar_feedback(self, text: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    @tracked("vector_storage")
+    def find_similar_feedback(
+        self,
+        text: str,
+        top_k: int = 5,
+        document_id: str = None,
+        hnsw_ef: int = None
+    ) -> List[Dict[str, Any]]:
         """Find similar feedback based on text similarity"""
-        query_embedding = self.create_embedding(text)
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_embedding,
+        ranking, = self.backend.search(
+            FEEDBACK,
+            self.create_embedding(text),
             limit=top_k,
-            with_payload=True,
-            query_filter=models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="type",
-                        match=models.MatchValue(value="feedback")
-                    )
-                ]
-            )
+            conditions={"document_id": document_id},
+            hnsw_ef=hnsw_ef
         )
         return [
             {
-                "id": hit.id,
-                "score": hit.score,
-                "metadata": hit.payload
+                "id": hit["id"],
+                "score": hit["score"],
+                "metadata": hit["payload"]
             }
-            for hit in results
-        ] 
\ No newline at end of file
+            for hit in ranking
+        ]
+
+    @tracked("vector_storage")
+    def find_similar_feedback_batch(
+        self,
+        texts: List[str],
+        top_k: int = 5,
+        hnsw_ef: int = None
+    ) -> List[List[Dict[str, Any]]]:
+        """find_similar_feedback for many texts, embedded and searched in one batch"""
+        if not texts:
+            return []
+        rankings = self.backend.search_batch(
+            FEEDBACK,
+            self.model.encode(texts).tolist(),
+            limit=top_k,
+            hnsw_ef=hnsw_ef
+        )
+        return [
+            [
+                {
+                    "id": hit["id"],
+                    "score": hit["score"],
+                    "metadata": hit["payload"]
+                }
+                for hit in ranking
+            ]
+            for ranking in rankings
+        ]
+
+    @tracked("vector_storage")
+    def store_approved_clauses(self, texts: List[str]):
+        """Remember clauses as approved as they are, for the first tier of cascaded analysis"""
+        texts = list(dict.fromkeys(texts))
+        if not texts:
+            return
+        self.backend.upsert(APPROVED, [
+            {"id": _approved_id(text), "vector": embedding.tolist(), "payload": {"text": text}}
+            for text, embedding in zip(texts, self.model.encode(texts))
+        ])
+
+    @tracked("vector_storage")
+    def forget_approved_clauses(self, texts: List[str]):
+        """Stop keeping clauses as approved, e.g. once a reviewer changed them"""
+        self.backend.delete(APPROVED, list(dict.fromkeys(_approved_id(text) for text in texts)))
+
+    @tracked("vector_storage")
+    def match_approved_clauses(self, texts: List[str]) -> List[float]:
+        """Similarity of each text to its closest approved clause, 0 without any"""
+        if not texts:
+            return []
+        rankings = self.backend.search_batch(APPROVED, self.model.encode(texts).tolist(), limit=1)
+        return [ranking[0]["score"] if ranking else 0.0 for ranking in rankings]
+
+    @tracked("vector_storage")
+    def store_accepted_rewrite(self, original: str, rewrite: str):
+        """Remember a rewrite a reviewer accepted, replacing any earlier one of the same clause"""
+        self.backend.upsert(REWRITES, [{
+            "id": _rewrite_id(original),
+            "vector": self.create_embedding(original),
+            "payload": {"original": original, "rewrite": rewrite}
+        }])
+
+    @tracked("vector_storage")
+    def forget_accepted_rewrites(self, originals: List[str]):
+        """Stop reusing the accepted rewrites of clauses, e.g. once a reviewer kept or removed them"""
+        self.backend.delete(REWRITES, list(dict.fromkeys(_rewrite_id(original) for original in originals)))
+
+    @tracked("vector_storage")
+    def find_accepted_rewrites(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Closest accepted rewrite of each text, with its "score", "original" and "rewrite", or None"""
+        if not texts:
+            return []
+        rankings = self.backend.search_batch(REWRITES, self.model.encode(texts).tolist(), limit=1)
+        return [{"score": ranking[0]["score"], **ranking[0]["payload"]} if ranking else None for ranking in rankings]
+
+@lru_cache(maxsize=None)
+def get_vector_storage() -> VectorStorage:
+    """Process-wide VectorStorage shared by all routers"""
+    return VectorStorage()
@@ -0,0 +1,108 @@
+"""Cost and agreement of cascaded analysis
+
+Analyzes the same synthetic NDAs with CASCADE_ENABLED off and on. The
+approved clause library is seeded with the clauses of separate synthetic
+NDAs, the way reviewers' kept clauses and imported boilerplate would fill
+it. The report holds the time per document in both modes, the share of
+clauses that reached the classifier and the generator, and how often the
+cascade's label agrees with the full analysis.
+
+Qdrant is replaced by the stand-in in benchmarks/standins.py.
+
+Usage (from backend/):
+    python -m benchmarks.cascade --documents 20 --library 10 --output cascade.json
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from . import standins
+from .synthetic import generate_nda_paragraphs
+
+TIERS = ["approved_match", "classifier", "generator"]
+
+def _analyze(ai_service, documents, cascade: bool):
+    from app.core.config import settings
+    settings.CASCADE_ENABLED = cascade
+    started = time.perf_counter()
+    results = [asyncio.run(ai_service.analyze_document(document)) for document in documents]
+    return results, time.perf_counter() - started
+
+def _tier_counts() -> dict:
+    from app.core.metrics import REGISTRY
+    return {
+        tier: REGISTRY.get_sample_value("nda_cascade_clauses_total", {"tier": tier}) or 0.0
+        for tier in TIERS
+    }
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="nda-cascade-")
+    standins.install(workdir)
+    from app.services.ai_service import get_ai_service
+    from app.services.vector_storage import get_vector_storage
+    ai_service = get_ai_service()
+    vector_storage = get_vector_storage()
+
+    library = [
+        "\n".join(generate_nda_paragraphs(args.clauses, args.clause_words, seed=args.seed + i))
+        for i in range(args.library)
+    ]
+    vector_storage.store_approved_clauses([
+        clause for document in library for clause in ai_service._extract_clauses(document)[0]
+    ])
+    documents = [
+        "\n".join(generate_nda_paragraphs(args.clauses, args.clause_words, seed=args.seed + args.library + i))
+        for i in range(args.documents)
+    ]
+
+    # Warm up both paths before measuring
+    _analyze(ai_service, documents[:1], cascade=False)
+    _analyze(ai_service, documents[:1], cascade=True)
+
+    full, full_seconds = _analyze(ai_service, documents, cascade=False)
+    before = _tier_counts()
+    cascaded, cascade_seconds = _analyze(ai_service, documents, cascade=True)
+    tiers = {tier: count - before[tier] for tier, count in _tier_counts().items()}
+
+    labels = [
+        (a["label"], b["label"])
+        for full_document, cascaded_document in zip(full, cascaded)
+        for a, b in zip(full_document, cascaded_document)
+    ]
+    clauses = len(labels)
+    return {
+        "config": {
+            "documents": args.documents,
+            "library": args.library,
+            "clauses": args.clauses,
+            "clause_words": args.clause_words,
+            "seed": args.seed,
+        },
+        "clauses": clauses,
+        "full_seconds_per_document": full_seconds / args.documents,
+        "cascade_seconds_per_document": cascade_seconds / args.documents,
+        "speedup": full_seconds / cascade_seconds if cascade_seconds else None,
+        "escalation_rate": {tier: tiers[tier] / clauses if clauses else None for tier in TIERS},
+        "label_agreement": sum(a == b for a, b in labels) / clauses if clauses else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare analysis with and without the cascade")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--library", type=int, default=10, help="Synthetic NDAs seeding the approved clauses")
+    parser.add_argument("--clauses", type=int, default=12)
+    parser.add_argument("--clause-words", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""End-to-end pipeline benchmark on a synthetic NDA corpus
+
+Drives upload -> analyze -> validate-all -> feedback -> regenerate -> clean
+through the FastAPI app with local stand-ins for MinIO, Qdrant and Postgres
+(see benchmarks/standins.py) and the real models.
+
+Usage (from backend/):
+    python -m benchmarks.pipeline --documents 20 --clauses 15 --output before.json
+
+The JSON report holds per-stage latency percentiles and error counts,
+end-to-end throughput and peak RSS, so runs can be compared across commits.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import tempfile
+import time
+import numpy as np
+from . import standins
+from .synthetic import generate_nda
+
+STAGES = ["upload", "analyze", "validate_all", "feedback", "regenerate", "clean"]
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _summarize(latencies, errors) -> dict:
+    summary = {"count": len(latencies), "errors": errors}
+    if latencies:
+        values = np.asarray(latencies) * 1000
+        summary.update({
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(np.percentile(values, 50)),
+            "p90_ms": float(np.percentile(values, 90)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "max_ms": float(values.max()),
+        })
+    return summary
+
+def _run_document(client, docx: bytes, index: int, timings: dict, errors: dict):
+    """Run one document through every stage, recording per-stage latency"""
+    def _call(stage, method, url, **kwargs):
+        started = time.perf_counter()
+        response = client.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            errors[stage] += 1
+            return None
+        timings[stage].append(elapsed)
+        return response.json()
+
+    uploaded = _call(
+        "upload", "POST", "/api/documents/upload",
+        files={"file": (f"nda-{index}.docx", docx, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+    )
+    if uploaded is None:
+        return
+    document_id = uploaded["id"]
+
+    _call("analyze", "POST", f"/api/documents/{document_id}/analyze")
+    _call("validate_all", "POST", f"/api/validation/{document_id}/validate-all")
+    _call("feedback", "POST", f"/api/feedback/{document_id}", json={"feedback_text": "The penalty clause is too strict."})
+    _call("regenerate", "POST", f"/api/feedback/{document_id}/regenerate")
+    _call("clean", "POST", f"/api/documents/{document_id}/clean")
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="nda-benchmark-")
+    standins.install(workdir)
+
+    started = time.perf_counter()
+    from fastapi.testclient import TestClient
+    from app.main import app
+    standins.override_db(app)
+    startup_seconds = time.perf_counter() - started
+
+    corpus = [
+        generate_nda(args.clauses, args.clause_words, seed=args.seed + i)
+        for i in range(args.warmup + args.documents)
+    ]
+
+    timings = {stage: [] for stage in STAGES}
+    errors = {stage: 0 for stage in STAGES}
+    # Server errors are counted per stage instead of aborting the run
+    with TestClient(app, raise_server_exceptions=False) as client:
+        for i in range(args.warmup):
+            _run_document(client, corpus[i], i, {s: [] for s in STAGES}, {s: 0 for s in STAGES})
+
+        started = time.perf_counter()
+        for i in range(args.warmup, len(corpus)):
+            _run_document(client, corpus[i], i, timings, errors)
+        elapsed = time.perf_counter() - started
+
+    return {
+        "commit": _git_commit(),
+        "config": {
+            "documents": args.documents,
+            "clauses": args.clauses,
+            "clause_words": args.clause_words,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "startup_seconds": startup_seconds,
+        "elapsed_seconds": elapsed,
+        "documents_per_second": args.documents / elapsed if elapsed else None,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "stages": {stage: _summarize(timings[stage], errors[stage]) for stage in STAGES},
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end NDA pipeline benchmark")
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--clauses", type=int, default=12)
+    parser.add_argument("--clause-words", type=int, default=40)
+    parser.add_argument("--warmup", type=int, default=1, help="Documents run before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Measure worker memory and throughput of app.serve as workers go from 1 to N
+
+Usage (from backend/):
+    python -m benchmarks.serving --max-workers 4
+    python -m benchmarks.serving --max-workers 4 --method POST \
+        --path /api/validation/<document_id>/validate-all
+
+Prints one JSON object per worker count with the RSS and PSS (proportional
+set size, which splits shared pages between the processes mapping them) of
+every worker and the requests per second sustained against --path.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+def _children(pid: int):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+def _memory_kb(pid: int):
+    """RSS and PSS of a process in kB"""
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                memory[key.lower()] = int(value.split()[0])
+    return memory
+
+def _wait_until_ready(url: str, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(1)
+    raise TimeoutError(f"Server at {url} did not become ready in {timeout}s")
+
+def _load(url: str, method: str, body: bytes, concurrency: int, duration: float):
+    """Send requests from concurrent threads for a fixed duration"""
+    counts = [0] * concurrency
+    errors = [0] * concurrency
+    deadline = time.time() + duration
+
+    def _client(index: int):
+        while time.time() < deadline:
+            request = urllib.request.Request(url, data=body, method=method, headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                counts[index] += 1
+            except (urllib.error.URLError, ConnectionError):
+                errors[index] += 1
+
+    threads = [threading.Thread(target=_client, args=(i,)) for i in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    return {
+        "requests": sum(counts),
+        "errors": sum(errors),
+        "requests_per_second": sum(counts) / elapsed
+    }
+
+def run(workers: int, args) -> dict:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(args.port)],
+        stdout=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        started = time.time()
+        _wait_until_ready(base_url + "/ready", args.startup_timeout)
+        startup_seconds = time.time() - started
+
+        load = _load(
+            base_url + args.path,
+            args.method,
+            args.body.encode() if args.body else None,
+            args.concurrency or workers * 2,
+            args.duration
+        )
+        worker_memory = [_memory_kb(pid) for pid in _children(server.pid)]
+        return {
+            "workers": workers,
+            "startup_seconds": startup_seconds,
+            "master_memory_kb": _memory_kb(server.pid),
+            "worker_memory_kb": worker_memory,
+            "total_pss_kb": _memory_kb(server.pid)["pss"] + sum(m["pss"] for m in worker_memory),
+            **load
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark app.serve memory and throughput")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--body", default=None)
+    parser.add_argument("--concurrency", type=int, default=0, help="Client threads, defaults to 2 per worker")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    args = parser.parse_args(argv)
+
+    for workers in range(1, args.max_workers + 1):
+        print(json.dumps(run(workers, args)), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Local stand-ins for the external services, used by the benchmarks
+
+Call ``install(workdir)`` before importing ``app.main``: Postgres is
+replaced by a SQLite file, MinIO by an in-memory object store and Qdrant by
+qdrant-client's embedded in-memory mode.
+"""
+import io
+import os
+
+class _ObjectResponse(io.BytesIO):
+    """Object body with the connection handling of urllib3 responses"""
+
+    def release_conn(self):
+        pass
+
+class InMemoryMinio:
+    """The subset of the Minio client used by DocumentStorage"""
+    # Shared by every client so re-connecting (e.g. after fork) keeps the data
+    objects = {}
+    buckets = set()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket_exists(self, bucket_name):
+        return bucket_name in self.buckets
+
+    def make_bucket(self, bucket_name):
+        self.buckets.add(bucket_name)
+
+    def put_object(self, bucket_name, object_name, data, length, content_type=None, **kwargs):
+        self.objects[(bucket_name, object_name)] = data.read(length)
+
+    def get_object(self, bucket_name, object_name, **kwargs):
+        return _ObjectResponse(self.objects[(bucket_name, object_name)])
+
+    def remove_object(self, bucket_name, object_name, **kwargs):
+        self.objects.pop((bucket_name, object_name), None)
+
+def install(workdir: str):
+    """Point the app at local stand-ins; must run before app.main is imported"""
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ.setdefault("MINIO_ACCESS_KEY", "benchmark")
+    os.environ.setdefault("MINIO_SECRET_KEY", "benchmark")
+
+    from qdrant_client import QdrantClient
+    from app.core import clients
+    clients._FACTORIES[clients.MINIO] = InMemoryMinio
+    clients._FACTORIES[clients.QDRANT] = lambda: QdrantClient(location=":memory:")
+
+def override_db(app):
+    """Serve requests from a SQLite session usable across the test client's threads"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.core.config import settings
+    from app.db.models import Base
+    from app.db.session import get_db
+
+    engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def _get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = _get_db
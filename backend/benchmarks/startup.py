@@ -0,0 +1,114 @@
+"""Import cost and startup time of the FastAPI app
+
+Each measurement runs in a fresh interpreter so nothing is already imported:
+
+- import: ``python -X importtime -c "import app.main"``, reporting the wall
+  time, the slowest modules by cumulative import time and which of the
+  heavy libraries the import pulled in.
+- startup: time until /health answers with WARMUP=lazy, then the time
+  each component takes to warm up as reported by /ready.
+
+MinIO, Qdrant and Postgres are replaced by the stand-ins in
+benchmarks/standins.py.
+
+Usage (from backend/):
+    python -m benchmarks.startup --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ["torch", "transformers", "sentence_transformers", "docx", "minio", "qdrant_client"]
+
+def _env(workdir: str) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'startup.db')}"
+    env.setdefault("MINIO_ACCESS_KEY", "benchmark")
+    env.setdefault("MINIO_SECRET_KEY", "benchmark")
+    env["WARMUP"] = "lazy"
+    return env
+
+def measure_import(workdir: str, top: int) -> dict:
+    """Wall time and per-module cost of importing app.main"""
+    code = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True, env=_env(workdir)
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    imported = {module["module"] for module in modules}
+    return {
+        "seconds": float(result.stdout.strip().splitlines()[-1]),
+        "modules_imported": len(modules),
+        "heavy_modules_imported": [name for name in HEAVY_MODULES if name in imported],
+        "slowest": sorted(modules, key=lambda module: -module["cumulative_ms"])[:top],
+    }
+
+def _startup_child():
+    """Runs in the child interpreter started by measure_startup()"""
+    from . import standins
+    standins.install(os.environ["STARTUP_WORKDIR"])
+
+    started = time.perf_counter()
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.api import deps
+    imported = time.perf_counter() - started
+
+    with TestClient(app) as client:
+        client.get("/health").raise_for_status()
+        healthy = time.perf_counter() - started
+
+        warm_up_started = time.perf_counter()
+        deps.warm_up()
+        ready = client.get("/ready")
+        report = {
+            "import_seconds": imported,
+            "health_seconds": healthy,
+            "warm_up_seconds": time.perf_counter() - warm_up_started,
+            "ready": ready.status_code == 200,
+            "components": ready.json()["components"],
+        }
+    print(json.dumps(report))
+
+def measure_startup(workdir: str) -> dict:
+    """Seconds until /health answers, and until every component is warm"""
+    env = _env(workdir)
+    env["STARTUP_WORKDIR"] = workdir
+    result = subprocess.run(
+        [sys.executable, "-c", "from benchmarks.startup import _startup_child; _startup_child()"],
+        capture_output=True, text=True, check=True, env=env
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import cost and startup time of the API")
+    parser.add_argument("--top", type=int, default=15, help="Slowest modules to report")
+    parser.add_argument("--skip-warm-up", action="store_true", help="Only measure the import")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="nda-startup-")
+    report = {"import": measure_import(workdir, args.top)}
+    if not args.skip_warm_up:
+        report["startup"] = measure_startup(workdir)
+
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Synthetic NDA documents for benchmarks"""
+from typing import List
+import io
+import random
+from docx import Document
+
+PARTIES = ["Acme Holdings AG", "Globex Corporation", "Initech GmbH", "Umbrella Ltd.", "Hooli Inc.", "Stark Industries SA"]
+JURISDICTIONS = ["Switzerland", "the State of New York", "England and Wales", "Germany", "Delaware"]
+
+CLAUSES = [
+    ("Definition", "\"Confidential Information\" means all information disclosed by {disclosing} to {receiving}, whether in writing, orally or in any other form, that is marked as confidential or would reasonably be understood to be confidential."),
+    ("Confidentiality", "{receiving} shall keep the Confidential Information strictly confidential and shall not disclose it to any third party without the prior written consent of {disclosing}."),
+    ("Use", "{receiving} shall use the Confidential Information solely for the purpose of evaluating a potential business relationship between the parties."),
+    ("Exceptions", "The obligations of this Agreement shall not apply to information that is or becomes publicly available through no fault of {receiving}, or that was lawfully known to {receiving} before disclosure."),
+    ("Term", "This Agreement shall remain in force for a period of {years} years from the Effective Date, and the obligations of confidentiality shall survive its termination for a further {survival} years."),
+    ("Return of Information", "Upon request of {disclosing}, {receiving} shall promptly return or destroy all Confidential Information and any copies thereof and confirm such destruction in writing."),
+    ("No License", "Nothing in this Agreement grants {receiving} any license or right in respect of the Confidential Information other than as expressly set out herein."),
+    ("Non-Solicitation", "During the term of this Agreement and for {survival} years thereafter, {receiving} shall not solicit or hire any employee of {disclosing}."),
+    ("Remedies", "{receiving} acknowledges that damages alone may not be an adequate remedy for a breach of this Agreement and that {disclosing} shall be entitled to seek injunctive relief."),
+    ("Penalty", "For each breach of this Agreement {receiving} shall pay to {disclosing} a contractual penalty of CHF {penalty}, without prejudice to further damages."),
+    ("Governing Law", "This Agreement shall be governed by and construed in accordance with the laws of {jurisdiction}, and the courts of {jurisdiction} shall have exclusive jurisdiction."),
+    ("Entire Agreement", "This Agreement constitutes the entire agreement between the parties relating to its subject matter and supersedes all prior agreements and understandings."),
+]
+
+FILLER = (
+    "provided that such obligations shall apply mutatis mutandis to any affiliate, officer, director, "
+    "employee, adviser or agent of the parties who has a need to know the information for the purpose "
+    "and is bound by obligations of confidentiality no less protective than those set out herein"
+).split()
+
+def generate_nda_paragraphs(num_clauses: int = 12, clause_words: int = 40, seed: int = 0) -> List[str]:
+    """Generate the paragraphs of a synthetic NDA"""
+    rng = random.Random(seed)
+    disclosing, receiving = rng.sample(PARTIES, 2)
+    values = {
+        "disclosing": disclosing,
+        "receiving": receiving,
+        "years": rng.choice([2, 3, 5]),
+        "survival": rng.choice([1, 2, 3]),
+        "penalty": rng.choice(["50,000", "100,000", "250,000"]),
+        "jurisdiction": rng.choice(JURISDICTIONS),
+    }
+
+    paragraphs = [f"Non-Disclosure Agreement between {disclosing} and {receiving}"]
+    for number in range(num_clauses):
+        title, template = CLAUSES[number % len(CLAUSES)]
+        text = template.format(**values)
+        missing = clause_words - len(text.split())
+        if missing > 0:
+            # Pad with boilerplate to reach the requested clause length
+            text = text[:-1] + ", " + " ".join(FILLER[i % len(FILLER)] for i in range(missing)) + "."
+        paragraphs.append(f"{number + 1}. {title}. {text}")
+    return paragraphs
+
+def generate_nda(num_clauses: int = 12, clause_words: int = 40, seed: int = 0) -> bytes:
+    """Generate a synthetic NDA as DOCX bytes"""
+    doc = Document()
+    for paragraph in generate_nda_paragraphs(num_clauses, clause_words, seed):
+        doc.add_paragraph(paragraph)
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
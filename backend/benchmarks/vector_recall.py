@@ -0,0 +1,120 @@
+"""Recall vs latency of the Qdrant collection profiles
+
+Loads the same vectors into one collection per profile, waits for indexing,
+then sweeps search-time hnsw_ef and reports recall@k against exact numpy
+search together with query latency percentiles.
+
+Usage (from backend/):
+    python -m benchmarks.vector_recall --url http://localhost:6333 --points 100000
+    python -m benchmarks.vector_recall --embed --points 20000 --profiles default int8
+
+Without --url the embedded client is used. It searches exhaustively and
+ignores HNSW and quantization settings, so it only gives a baseline. By
+default the vectors are clustered random vectors; --embed uses sentence
+embeddings of synthetic NDA clauses instead.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from app.services import vector_profiles
+from app.services.vector_storage import EMBEDDING_SIZE
+from .synthetic import generate_nda_paragraphs
+
+def _clustered_vectors(count: int, dim: int, seed: int) -> np.ndarray:
+    """Vectors around a few hundred centres, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(max(count // 200, 1), dim))
+    vectors = centres[rng.integers(len(centres), size=count)] + 0.5 * rng.normal(size=(count, dim))
+    return vectors.astype(np.float32)
+
+def _clause_embeddings(count: int, seed: int) -> np.ndarray:
+    from sentence_transformers import SentenceTransformer
+    clauses = []
+    document_seed = seed
+    while len(clauses) < count:
+        clauses.extend(generate_nda_paragraphs(num_clauses=20, seed=document_seed))
+        document_seed += 1
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    return model.encode(clauses[:count], batch_size=256).astype(np.float32)
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def _load(client: QdrantClient, name: str, profile: dict, vectors: np.ndarray, batch_size: int):
+    client.recreate_collection(
+        collection_name=name,
+        vectors_config=vector_profiles.vector_params(profile, vectors.shape[1]),
+        hnsw_config=vector_profiles.hnsw_config(profile),
+        quantization_config=vector_profiles.quantization_config(profile)
+    )
+    started = time.perf_counter()
+    for offset in range(0, len(vectors), batch_size):
+        batch = vectors[offset:offset + batch_size]
+        client.upsert(
+            collection_name=name,
+            points=models.Batch(ids=list(range(offset, offset + len(batch))), vectors=batch.tolist()),
+            wait=False
+        )
+    # The HNSW graph is built in the background after the upserts
+    while client.get_collection(name).status != models.CollectionStatus.GREEN:
+        time.sleep(0.5)
+    return time.perf_counter() - started
+
+def _measure(client: QdrantClient, name: str, params: models.SearchParams, queries: np.ndarray, truth: np.ndarray, top_k: int) -> dict:
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        results = client.search(collection_name=name, query_vector=query.tolist(), limit=top_k, search_params=params)
+        latencies.append(time.perf_counter() - started)
+        hits += len({hit.id for hit in results} & set(expected.tolist()))
+    values = np.asarray(latencies) * 1000
+    return {
+        f"recall@{top_k}": hits / (len(queries) * top_k),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "qps": len(queries) / values.sum() * 1000,
+    }
+
+def run(args) -> list:
+    vectors = _clause_embeddings(args.points + args.queries, args.seed) if args.embed else _clustered_vectors(args.points + args.queries, EMBEDDING_SIZE, args.seed)
+    vectors = _normalize(vectors)
+    corpus, queries = vectors[:args.points], vectors[args.points:]
+    # Exact neighbours by cosine similarity
+    truth = np.argsort(-(queries @ corpus.T), axis=1)[:, :args.top_k]
+
+    client = QdrantClient(url=args.url) if args.url else QdrantClient(location=":memory:")
+    reports = []
+    for profile_name in args.profiles:
+        profile = vector_profiles.get_profile(profile_name)
+        name = f"bench-recall-{profile_name}"
+        load_seconds = _load(client, name, profile, corpus, args.batch_size)
+        for ef in args.ef:
+            report = {"profile": profile_name, "hnsw_ef": ef, "points": args.points, "load_seconds": load_seconds}
+            report.update(_measure(client, name, vector_profiles.search_params(profile, ef), queries, truth, args.top_k))
+            reports.append(report)
+            print(json.dumps(report), flush=True)
+        if not args.keep:
+            client.delete_collection(name)
+    return reports
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recall vs latency of Qdrant collection profiles")
+    parser.add_argument("--url", help="Qdrant server, defaults to the embedded client")
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--profiles", nargs="+", default=list(vector_profiles.PROFILES))
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--embed", action="store_true", help="Use sentence embeddings of synthetic clauses")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark collections")
+    args = parser.parse_args(argv)
+    run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+
+# Settings without defaults; tests never connect to these
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("MINIO_ACCESS_KEY", "test")
+os.environ.setdefault("MINIO_SECRET_KEY", "test")
+
+import pytest
+
+@pytest.fixture
+def session_factory():
+    """Sessions on one in-memory SQLite database, so tests can race two of them"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    from app.db.models import Base
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine, autoflush=False)
+    engine.dispose()
@@ -0,0 +1,37 @@
+import os
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.endpoints import admin
+from app.core.config import settings
+
+PROFILE_ID = "20261019T120000Z-0123abcd"
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path / "profiles"))
+    os.makedirs(tmp_path / "profiles" / PROFILE_ID)
+    (tmp_path / "profiles" / PROFILE_ID / "meta.json").write_text("{}")
+    (tmp_path / "secret.txt").write_text("secret")
+    app = FastAPI()
+    app.include_router(admin.router, prefix="/api/admin")
+    return TestClient(app, headers={"X-Admin-Token": "secret"})
+
+def test_download_artifact(client):
+    response = client.get(f"/api/admin/profiles/{PROFILE_ID}/meta.json")
+    assert response.status_code == 200 and response.json() == {}
+
+@pytest.mark.parametrize("profile_id, artifact", [
+    ("..", "secret.txt"),
+    ("%2E%2E", "secret.txt"),
+    (f"{PROFILE_ID}%0A", "meta.json"),
+    (PROFILE_ID, "%2E%2E"),
+    (PROFILE_ID, "secret.txt"),
+])
+def test_rejects_names_outside_profiles(client, profile_id, artifact):
+    assert client.get(f"/api/admin/profiles/{profile_id}/{artifact}").status_code in (400, 404)
+
+def test_requires_admin_token(client):
+    response = client.get(f"/api/admin/profiles/{PROFILE_ID}/meta.json", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403
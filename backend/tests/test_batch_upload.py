@@ -0,0 +1,75 @@
+import io
+import zipfile
+import pytest
+from docx import Document as DocxDocument
+from fastapi import HTTPException, UploadFile
+from app.api.endpoints.documents import _batch_entries, _store_batch
+from app.db.models import BatchJob, Document
+
+def _docx(text: str) -> bytes:
+    document = DocxDocument()
+    document.add_paragraph(text)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def _zip(members) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+def _corrupt(archive: bytes, name: str) -> bytes:
+    """Flip bytes in the middle of a member's compressed data"""
+    info = zipfile.ZipFile(io.BytesIO(archive)).getinfo(name)
+    start = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra) + info.compress_size // 2
+    corrupted = bytearray(archive)
+    for offset in range(start, start + 16):
+        corrupted[offset] ^= 0xFF
+    return bytes(corrupted)
+
+class FakeStorage:
+    def __init__(self):
+        self.objects = {}
+
+    def save_original_content(self, content, user_id):
+        document_id = f"doc-{len(self.objects)}"
+        self.objects[f"{user_id}/{document_id}"] = content
+        return document_id, f"{user_id}/{document_id}"
+
+    def delete_document(self, file_path):
+        del self.objects[file_path]
+
+def _upload(name: str, content: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(content), filename=name)
+
+def test_corrupt_zip_member_is_rejected():
+    archive = _corrupt(_zip({"a.docx": _docx("First NDA " * 200)}), "a.docx")
+    (name, read), = _batch_entries([_upload("batch.zip", archive)])
+    with pytest.raises(HTTPException) as error:
+        read()
+    assert error.value.status_code == 400 and "a.docx" in error.value.detail
+
+def test_stores_every_document_once(session_factory):
+    archive = _zip({"a.docx": _docx("First NDA"), "b.docx": _docx("Second NDA")})
+    entries = _batch_entries([_upload("batch.zip", archive), _upload("c.docx", _docx("Third NDA"))])
+    storage, db = FakeStorage(), session_factory()
+    batch = BatchJob(id="batch", total=len(entries), completed=0, failed=0)
+    db.add(batch)
+
+    documents = _store_batch(entries, batch, storage, db)
+    assert len(documents) == len(storage.objects) == 3
+    assert {document.batch_id for document in db.query(Document)} == {"batch"}
+
+def test_bad_document_leaves_nothing_behind(session_factory):
+    entries = _batch_entries([_upload("a.docx", _docx("First NDA")), _upload("b.docx", b"not a docx")])
+    storage, db = FakeStorage(), session_factory()
+    batch = BatchJob(id="batch", total=len(entries), completed=0, failed=0)
+    db.add(batch)
+
+    with pytest.raises(HTTPException) as error:
+        _store_batch(entries, batch, storage, db)
+    assert error.value.status_code == 400
+    assert storage.objects == {}
+    assert db.query(Document).count() == 0 and db.query(BatchJob).count() == 0
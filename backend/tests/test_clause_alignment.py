@@ -0,0 +1,36 @@
+from app.services.clause_alignment import adapt_rewrite
+
+def test_adapt_rewrite_substitutes_words():
+    assert adapt_rewrite(
+        "Acme shall keep the information confidential for 2 years.",
+        "Acme shall keep the information strictly confidential for 2 years.",
+        "Globex shall keep the information confidential for 3 years."
+    ) == "Globex shall keep the information strictly confidential for 3 years."
+
+def test_adapt_rewrite_swapped_parties():
+    assert adapt_rewrite(
+        "The Discloser shall notify the Recipient of any breach.",
+        "The Discloser shall promptly notify the Recipient of any breach.",
+        "The Recipient shall notify the Discloser of any breach."
+    ) == "The Recipient shall promptly notify the Discloser of any breach."
+
+def test_adapt_rewrite_swapped_periods():
+    assert adapt_rewrite(
+        "Obligations last 2 years and notice is due within 5 days.",
+        "Obligations last 2 years and written notice is due within 5 days.",
+        "Obligations last 5 years and notice is due within 2 days."
+    ) == "Obligations last 5 years and written notice is due within 2 days."
+
+def test_adapt_rewrite_whole_words_only():
+    assert adapt_rewrite(
+        "A party is liable for damages.",
+        "A party is only liable for direct damages.",
+        "Each party is liable for damages."
+    ) == "Each party is only liable for direct damages."
+
+def test_adapt_rewrite_gives_up_on_inserted_words():
+    assert adapt_rewrite(
+        "The Recipient shall notify the Discloser.",
+        "The Recipient shall promptly notify the Discloser.",
+        "The Recipient shall immediately notify the Discloser."
+    ) is None
@@ -0,0 +1,46 @@
+from app.services.clause_normalization import normalize_clauses
+
+def _words(text: str) -> int:
+    return len(text.split())
+
+def _normalize(*clauses: str, separator: str = "\n"):
+    text = separator.join(clauses)
+    spans, start = [], 0
+    for clause in clauses:
+        spans.append((start, start + len(clause)))
+        start += len(clause) + len(separator)
+    return normalize_clauses(text, spans, _words)
+
+CONFIDENTIAL = "The Recipient shall keep all Confidential Information of the Discloser strictly confidential."
+TERM = "The obligations of this Agreement survive its termination for a period of two years."
+
+def test_exact_duplicates_are_dropped():
+    clauses, representatives = _normalize(CONFIDENTIAL, TERM, CONFIDENTIAL)
+    assert clauses == [CONFIDENTIAL, TERM]
+    assert representatives == [0, 1]
+
+def test_near_duplicates_share_the_analysis_of_the_first():
+    similar = CONFIDENTIAL.replace("Discloser", "Disclosing Party")
+    spaced = CONFIDENTIAL.upper()
+    clauses, representatives = _normalize(CONFIDENTIAL, TERM, similar, spaced)
+    assert clauses == [CONFIDENTIAL, TERM, similar, spaced]
+    assert representatives == [0, 1, 0, 0]
+
+def test_contained_clauses_share_the_analysis_of_the_containing_clause():
+    contained = "The Recipient shall keep all Confidential Information of the Discloser"
+    clauses, representatives = _normalize(TERM, CONFIDENTIAL, contained)
+    assert clauses == [TERM, CONFIDENTIAL, contained]
+    assert representatives == [0, 1, 1]
+
+def test_duplicates_point_at_packed_clauses():
+    short = "Definitions apply."
+    clauses, representatives = _normalize(short, CONFIDENTIAL, TERM, short, separator=" ")
+    packed = f"{short} {CONFIDENTIAL}"
+    assert clauses == [packed, TERM, short]
+    assert representatives == [0, 1, 0]
+
+def test_duplicates_inside_packed_clauses_are_dropped():
+    short = "Definitions apply."
+    clauses, representatives = _normalize(short, short.lower(), CONFIDENTIAL, separator=" ")
+    assert clauses == [f"{short} {short.lower()} {CONFIDENTIAL}"]
+    assert representatives == [0]
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+import pytest
+from app.core.config import settings
+from app.db.models import Document, DocumentStatus, IdempotencyKey
+from app.services.document_state import (
+    RequestInProgress,
+    TransitionConflict,
+    claim_key,
+    complete_key,
+    release_claim,
+    release_key,
+    transition,
+)
+
+def _document(session_factory, status=DocumentStatus.UPLOADED, **values) -> str:
+    db = session_factory()
+    db.add(Document(id="doc", user_id=1, original_path="doc.docx", status=status, **values))
+    db.commit()
+    db.close()
+    return "doc"
+
+def _load(db, document_id="doc") -> Document:
+    return db.query(Document).filter(Document.id == document_id).one()
+
+def test_transition_bumps_version_and_sets_claim(session_factory):
+    _document(session_factory)
+    db = session_factory()
+    document = _load(db)
+    transition(db, document, DocumentStatus.ANALYZING)
+    db.commit()
+    assert (document.status, document.version) == (DocumentStatus.ANALYZING, 2)
+    assert document.claimed_at is not None
+
+    transition(db, document, DocumentStatus.REDLINE_READY)
+    db.commit()
+    assert document.status == DocumentStatus.REDLINE_READY
+    assert document.claimed_at is None
+
+def test_transition_rejects_missing_edge(session_factory):
+    _document(session_factory)
+    db = session_factory()
+    with pytest.raises(TransitionConflict):
+        transition(db, _load(db), DocumentStatus.COMPLETED)
+
+def test_only_one_of_two_racing_claims_wins(session_factory):
+    _document(session_factory)
+    first, second = session_factory(), session_factory()
+    first_document, second_document = _load(first), _load(second)
+
+    transition(first, first_document, DocumentStatus.ANALYZING)
+    first.commit()
+    with pytest.raises(TransitionConflict):
+        transition(second, second_document, DocumentStatus.ANALYZING)
+
+def test_live_claim_is_not_taken_over(session_factory):
+    _document(session_factory, status=DocumentStatus.ANALYZING, claimed_at=datetime.utcnow())
+    db = session_factory()
+    with pytest.raises(TransitionConflict):
+        transition(db, _load(db), DocumentStatus.ANALYZING)
+
+def test_expired_claim_is_taken_over(session_factory):
+    expired = datetime.utcnow() - timedelta(seconds=settings.CLAIM_LEASE_SECONDS + 1)
+    _document(session_factory, status=DocumentStatus.ANALYZING, claimed_at=expired)
+    db = session_factory()
+    document = _load(db)
+    transition(db, document, DocumentStatus.ANALYZING)
+    db.commit()
+    assert document.claimed_at > expired
+
+def test_release_claim_restores_previous_status(session_factory):
+    _document(session_factory, status=DocumentStatus.REDLINE_READY)
+    db = session_factory()
+    document = _load(db)
+    transition(db, document, DocumentStatus.ANALYZING)
+    db.commit()
+    release_claim(db, document, document.version, DocumentStatus.REDLINE_READY)
+    db.commit()
+    assert _load(session_factory()).status == DocumentStatus.REDLINE_READY
+
+def test_release_claim_leaves_a_taken_over_claim_alone(session_factory):
+    _document(session_factory)
+    stale, current = session_factory(), session_factory()
+    document = _load(stale)
+    transition(stale, document, DocumentStatus.ANALYZING)
+    stale.commit()
+    claimed_version = document.version
+
+    # Another request takes the claim over once it has expired
+    other = _load(current)
+    other.claimed_at = datetime.utcnow() - timedelta(seconds=settings.CLAIM_LEASE_SECONDS + 1)
+    current.commit()
+    transition(current, other, DocumentStatus.ANALYZING)
+    current.commit()
+
+    release_claim(stale, document, claimed_version, DocumentStatus.UPLOADED)
+    stale.commit()
+    assert _load(session_factory()).status == DocumentStatus.ANALYZING
+
+def test_claim_key_returns_stored_response(session_factory):
+    _document(session_factory)
+    db = session_factory()
+    assert claim_key(db, "key", "analyze", "doc") is None
+    complete_key(db, "key", "analyze", "doc", {"status": "done"})
+    db.commit()
+    assert claim_key(session_factory(), "key", "analyze", "doc") == {"status": "done"}
+
+def test_claim_key_while_running_conflicts(session_factory):
+    _document(session_factory)
+    assert claim_key(session_factory(), "key", "analyze", "doc") is None
+    with pytest.raises(RequestInProgress):
+        claim_key(session_factory(), "key", "analyze", "doc")
+
+def test_released_key_can_be_claimed_again(session_factory):
+    _document(session_factory)
+    db = session_factory()
+    assert claim_key(db, "key", "analyze", "doc") is None
+    release_key(db, "key", "analyze", "doc")
+    db.commit()
+    assert claim_key(session_factory(), "key", "analyze", "doc") is None
+
+def test_release_key_keeps_completed_response(session_factory):
+    _document(session_factory)
+    db = session_factory()
+    claim_key(db, "key", "analyze", "doc")
+    complete_key(db, "key", "analyze", "doc", {"status": "done"})
+    db.commit()
+    release_key(db, "key", "analyze", "doc")
+    db.commit()
+    assert claim_key(session_factory(), "key", "analyze", "doc") == {"status": "done"}
+
+def test_expired_running_key_is_taken_over_once(session_factory):
+    _document(session_factory)
+    db = session_factory()
+    claim_key(db, "key", "analyze", "doc")
+    db.query(IdempotencyKey).update({
+        IdempotencyKey.created_at: datetime.utcnow() - timedelta(seconds=settings.CLAIM_LEASE_SECONDS + 1)
+    })
+    db.commit()
+
+    assert claim_key(session_factory(), "key", "analyze", "doc") is None
+    with pytest.raises(RequestInProgress):
+        claim_key(session_factory(), "key", "analyze", "doc")
@@ -0,0 +1,143 @@
+import os
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services.vector_backends import EmbeddedBackend
+
+SPEC = {"size": 8, "lexical": True, "keyword_fields": ["label"]}
+TEXTS = [
+    "confidential information disclosed by the discloser",
+    "the recipient shall return all documents",
+    "obligations survive termination for two years",
+    "governing law and jurisdiction of the courts",
+    "no license is granted under any patent",
+    "remedies include injunctive relief",
+]
+
+@pytest.fixture(autouse=True)
+def embedded_settings(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_EMBEDDED_INDEX", "exact")
+    monkeypatch.setattr(settings, "VECTOR_EMBEDDED_TAIL", 2000)
+    monkeypatch.setattr(settings, "VECTOR_EMBEDDED_COMPACT_RATIO", 0.2)
+    monkeypatch.setattr(settings, "VECTOR_SNAPSHOT_EVERY", 0)
+
+def _backend(path) -> EmbeddedBackend:
+    backend = EmbeddedBackend(str(path))
+    backend.setup({"clauses": SPEC})
+    return backend
+
+def _points(count: int, seed: int = 0):
+    vectors = np.random.default_rng(seed).normal(size=(count, SPEC["size"]))
+    return [
+        {
+            "id": f"p{i}",
+            "vector": vectors[i].tolist(),
+            "payload": {"text": TEXTS[i % len(TEXTS)], "label": "keep" if i % 2 else "modify"}
+        }
+        for i in range(count)
+    ]
+
+def _top_id(backend, vector, **kwargs):
+    return backend.search("clauses", vector, 1, **kwargs)[0][0]["id"]
+
+def test_round_trip(tmp_path):
+    points = _points(20)
+    backend = _backend(tmp_path)
+    backend.upsert("clauses", points)
+    backend.snapshot()
+
+    reloaded = _backend(tmp_path)
+    assert reloaded.retrieve("clauses", ["p3"])["p3"] == points[3]["payload"]
+    for point in points:
+        assert _top_id(reloaded, point["vector"]) == point["id"]
+
+def test_upsert_replaces_point(tmp_path):
+    backend = _backend(tmp_path)
+    backend.upsert("clauses", _points(5))
+    replacement = {**_points(1, seed=1)[0], "payload": {"text": "new", "label": "remove"}}
+    backend.upsert("clauses", [replacement])
+    assert backend.retrieve("clauses", ["p0"])["p0"]["label"] == "remove"
+    assert _top_id(backend, replacement["vector"]) == "p0"
+    assert sum(len(batch) for batch in backend.scroll("clauses")) == 5
+
+def test_filter(tmp_path):
+    backend = _backend(tmp_path)
+    points = _points(20)
+    backend.upsert("clauses", points)
+    ranking, = backend.search("clauses", points[0]["vector"], 20, conditions={"label": "keep"})
+    assert ranking and all(hit["payload"]["label"] == "keep" for hit in ranking)
+    assert "p0" not in {hit["id"] for hit in ranking}
+
+def test_lexical_search(tmp_path):
+    backend = _backend(tmp_path)
+    points = _points(12)
+    backend.upsert("clauses", points)
+    _, lexical = backend.search("clauses", points[0]["vector"], 3, terms=["injunctive", "relief"])
+    assert lexical and all(hit["payload"]["text"] == TEXTS[5] for hit in lexical)
+
+def test_delete_compact_reload(tmp_path):
+    backend = _backend(tmp_path)
+    points = _points(10)
+    backend.upsert("clauses", points)
+    backend.snapshot()
+    deleted = [point["id"] for point in points[:6]]
+    backend.delete("clauses", deleted)
+    # More than VECTOR_EMBEDDED_COMPACT_RATIO deleted, so this compacts
+    backend.snapshot()
+
+    store = backend.collections["clauses"]
+    assert store.count == 4 and store.generation == 1
+    assert not os.path.exists(os.path.join(store.path, "vectors.npy"))
+
+    reloaded = _backend(tmp_path)
+    assert reloaded.retrieve("clauses", deleted) == {}
+    for point in points[6:]:
+        assert _top_id(reloaded, point["vector"]) == point["id"]
+    _, lexical = reloaded.search("clauses", points[0]["vector"], 10, terms=["confidential"])
+    assert {hit["id"] for hit in lexical} <= {point["id"] for point in points[6:]}
+
+def test_compaction_before_state_is_saved_loses_nothing(tmp_path):
+    backend = _backend(tmp_path)
+    points = _points(10)
+    backend.upsert("clauses", points)
+    backend.delete("clauses", ["p0", "p1", "p2"])
+    backend.snapshot()
+    backend.delete("clauses", ["p3", "p4", "p5"])
+    # A crash after compacting but before the state is replaced
+    backend.collections["clauses"].compact()
+
+    reloaded = _backend(tmp_path)
+    for point in points[3:]:
+        assert _top_id(reloaded, point["vector"]) == point["id"]
+
+def test_ivf_with_tail(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_EMBEDDED_INDEX", "ivf")
+    monkeypatch.setattr(settings, "VECTOR_EMBEDDED_TAIL", 16)
+    backend = _backend(tmp_path)
+    points = _points(100)
+    backend.upsert("clauses", points[:90])
+    backend.upsert("clauses", points[90:])
+    store = backend.collections["clauses"]
+    assert store.centroids is not None and store.indexed_upto < store.count
+
+    lists = len(store.centroids)
+    for point in points:
+        assert _top_id(backend, point["vector"], hnsw_ef=lists) == point["id"]
+
+    backend.snapshot()
+    reloaded = _backend(tmp_path)
+    for point in points[::7]:
+        assert _top_id(reloaded, point["vector"], hnsw_ef=lists) == point["id"]
+
+def test_ivf_with_every_row_deleted(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_EMBEDDED_INDEX", "ivf")
+    backend = _backend(tmp_path)
+    points = _points(10)
+    backend.upsert("clauses", points)
+    backend.delete("clauses", [point["id"] for point in points])
+    backend.snapshot()
+
+    reloaded = _backend(tmp_path)
+    assert reloaded.search("clauses", points[0]["vector"], 5) == [[]]
+    reloaded.upsert("clauses", points[:3])
+    assert _top_id(reloaded, points[1]["vector"]) == "p1"
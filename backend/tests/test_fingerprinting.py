@@ -0,0 +1,41 @@
+from app.db.models import AnalysisResult, Document
+from app.services.fingerprinting import paragraph_hash, paragraph_of, split_reusable
+
+DEFINITIONS = "Confidential Information means all information disclosed by the Discloser."
+OBLIGATIONS = "The Recipient shall not disclose Confidential Information. It shall use it only for the Purpose."
+TERM = "This Agreement ends after two years."
+SOURCE = [DEFINITIONS, OBLIGATIONS, TERM]
+
+def _store(db, clauses, paragraphs):
+    db.add(Document(id="source", user_id=1, original_path="source.docx"))
+    for clause in clauses:
+        db.add(AnalysisResult(
+            document_id="source",
+            clause_text=clause,
+            original_text=clause,
+            suggested_text=clause,
+            label="keep",
+            confidence_score=100,
+            paragraph_hash=paragraph_of(clause, paragraphs)
+        ))
+    db.commit()
+
+def test_unchanged_paragraphs_are_reused(session_factory):
+    db = session_factory()
+    _store(db, SOURCE, SOURCE)
+    new_term = "This Agreement ends after three years."
+
+    reused, changed = split_reusable(db, [DEFINITIONS, OBLIGATIONS, new_term], "source")
+    assert [result["clause_text"] for result in reused] == [DEFINITIONS, OBLIGATIONS]
+    assert changed == [new_term]
+
+def test_paragraphs_touched_by_a_spanning_clause_are_analyzed(session_factory):
+    db = session_factory()
+    spanning = "It shall use it only for the Purpose.\nThis Agreement ends"
+    _store(db, [DEFINITIONS, "The Recipient shall not disclose Confidential Information.", spanning, TERM], SOURCE)
+    assert paragraph_of(spanning, SOURCE) is None
+
+    reused, changed = split_reusable(db, SOURCE, "source")
+    assert [result["clause_text"] for result in reused] == [DEFINITIONS]
+    assert changed == [OBLIGATIONS, TERM]
+    assert {result["paragraph_hash"] for result in reused} == {paragraph_hash(DEFINITIONS)}
@@ -0,0 +1,43 @@
+import threading
+import time
+from types import SimpleNamespace
+from app.core.config import settings
+from app.services import retrieval, vector_backends
+from app.services.vector_backends import QdrantBackend
+
+class CountingClient:
+    """Qdrant client stand-in that counts how many count requests overlap"""
+    def __init__(self, frequencies, total):
+        self.frequencies, self.total = frequencies, total
+        self.requests, self.in_flight, self.max_in_flight = 0, 0, 0
+        self.lock = threading.Lock()
+
+    def count(self, collection_name, count_filter=None, exact=True):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        if count_filter is None:
+            return SimpleNamespace(count=self.total)
+        return SimpleNamespace(count=self.frequencies[count_filter.must[0].match.text])
+
+def test_idf_counts_missing_terms_concurrently(monkeypatch):
+    frequencies = {"confidential": 40, "recipient": 10, "injunctive": 1, "jurisdiction": 5}
+    client = CountingClient(frequencies, total=100)
+    monkeypatch.setattr(vector_backends, "get_client", lambda backend: client)
+    monkeypatch.setattr(settings, "IDF_FETCH_CONCURRENCY", 8)
+    backend = QdrantBackend.__new__(QdrantBackend)
+    backend._idf_cache = {}
+    backend._connect()
+
+    idf = backend._idf("clauses", list(frequencies))
+    assert idf == {term: retrieval.idf(frequency, 100) for term, frequency in frequencies.items()}
+    assert client.requests == len(frequencies) + 1
+    assert client.max_in_flight > 1
+
+    # Cached terms are not counted again
+    assert backend._idf("clauses", ["recipient"]) == {"recipient": idf["recipient"]}
+    assert client.requests == len(frequencies) + 1
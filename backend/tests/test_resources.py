@@ -0,0 +1,42 @@
+import pytest
+from app.core import resources
+from app.core.config import settings
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    files = tuple(str(tmp_path / name) for name in ("memory.max", "memory.current", "memory.stat")) + ("inactive_file",)
+    monkeypatch.setattr(resources, "_CGROUP_MEMORY", [files])
+    monkeypatch.setattr(settings, "MEMORY_BUDGET_MB", 0)
+    monkeypatch.setattr(settings, "MEMORY_HIGH_WATERMARK", 0.85)
+    resources._cgroup_files.cache_clear()
+    yield tmp_path
+    resources._cgroup_files.cache_clear()
+
+def _write(path, limit, usage, inactive):
+    (path / "memory.max").write_text(f"{limit}\n")
+    (path / "memory.current").write_text(f"{usage}\n")
+    (path / "memory.stat").write_text(f"anon {usage - inactive}\ninactive_file {inactive}\nactive_file 0\n")
+
+def test_cgroup_working_set_excludes_inactive_page_cache(cgroup):
+    _write(cgroup, 1000, 950, 200)
+    assert resources.memory_usage() == (750, 1000)
+    assert not resources.under_pressure()
+
+    _write(cgroup, 1000, 950, 50)
+    assert resources.under_pressure()
+
+def test_unlimited_cgroup_has_no_budget(cgroup):
+    (cgroup / "memory.max").write_text("max\n")
+    assert resources.memory_usage() is None
+    assert not resources.under_pressure()
+
+def test_budget_is_held_against_pss(cgroup, monkeypatch):
+    _write(cgroup, 1000, 999, 0)
+    monkeypatch.setattr(settings, "MEMORY_BUDGET_MB", 100)
+    monkeypatch.setattr(resources, "current_pss", lambda: 90 * 1024 * 1024)
+    assert resources.memory_usage() == (90 * 1024 * 1024, 100 * 1024 * 1024)
+    assert resources.under_pressure()
+
+def test_current_pss_reads_this_process():
+    pss, rss = resources.current_pss(), resources.current_rss()
+    assert pss is not None and 0 < pss <= rss